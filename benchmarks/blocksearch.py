@@ -0,0 +1,65 @@
+"""blocksearch latency on a survey with 50k questions: unindexed substring scans against the indexed text search.
+
+Needs the configured Postgres server, a throwaway test database is created and dropped around the run. Run from the
+repository root with ``python -m benchmarks.blocksearch``.
+"""
+import random
+
+from benchmarks.common import best_of, setup_django
+from django.contrib.postgres.search import SearchVector
+from django.db import connection
+from django.db.models import Q
+
+setup_django()
+
+from main.models import Block, DistributedPoll, Question  # noqa: E402
+
+BLOCKS = 2500
+QUESTIONS_PER_BLOCK = 20
+SYLLABLES = ["ba", "ko", "mi", "tu", "re", "sa", "lo", "ne", "di", "ga", "pu", "ve", "zo", "ha", "fi"]
+WORDS = sorted({''.join(random.Random(i).choices(SYLLABLES, k=4)) for i in range(20000)})
+
+
+def sentence(words: int) -> str:
+    return ' '.join(random.choice(WORDS) for _ in range(words))
+
+
+def populate() -> DistributedPoll:
+    poll = DistributedPoll.objects.create(name='benchmark')
+    Block.objects.bulk_create([Block(poll=poll, name=sentence(3)) for _ in range(BLOCKS)], batch_size=1000)
+    # Question ids are four characters, hex indexes keep them unique without the per row lookup Question.save does.
+    blocks = list(poll.block_set.all())
+    questions = [Question(id=f"{index:04x}", block=blocks[index // QUESTIONS_PER_BLOCK], question=sentence(12),
+                          options=['Yes', 'No'])
+                 for index in range(BLOCKS * QUESTIONS_PER_BLOCK)]
+    Question.objects.bulk_create(questions, batch_size=1000)
+    # bulk_create skips save, so the vectors are filled in afterwards just like the migration does.
+    Block.objects.update(search_vector=SearchVector('name', config='simple'))
+    Question.objects.update(search_vector=SearchVector('question', config='simple'))
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return poll
+
+
+def main() -> None:
+    random.seed(0)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        poll = populate()
+        print(f"{Question.objects.count()} questions in {Block.objects.count()} blocks")
+        queries = [WORDS[0], WORDS[len(WORDS) // 2][:5], f"{WORDS[10]} {WORDS[20]}", "nothing"]
+        print(f"{'query':>18} {'name scan ms':>13} {'text scan ms':>13} {'search ms':>10} {'matches':>8}")
+        for query in queries:
+            name_time, _ = best_of(lambda: list(poll.block_set.filter(name__icontains=query)))
+            text_time, _ = best_of(lambda: list(poll.block_set.filter(
+                Q(name__icontains=query) | Q(question__question__icontains=query)).distinct()))
+            search_time, found = best_of(lambda: poll.search_blocks(query, 5))
+            print(f"{query:>18} {name_time * 1000:>13.2f} {text_time * 1000:>13.2f} {search_time * 1000:>10.2f} "
+                  f"{len(found):>8}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+import os
+import time
+from typing import Callable, Tuple
+
+
+def setup_django() -> None:
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "simpleslackpoll.settings")
+    os.environ.setdefault("POLLS_SECRET_KEY", "benchmark")
+    import django
+    django.setup()
+
+
+def best_of(func: Callable[[], object], repeat: int = 5) -> Tuple[float, object]:
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
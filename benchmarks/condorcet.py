@@ -0,0 +1,39 @@
+"""Cost of keeping ranked poll results current: one incremental ballot change versus recounting every ballot.
+
+Run from the repository root with ``python -m benchmarks.condorcet``.
+"""
+import random
+from typing import List
+
+from benchmarks.common import best_of
+
+from main import condorcet
+
+SIZE = 99
+
+
+def random_rankings(count: int, options: int) -> List[List[int]]:
+    rankings = []
+    for _ in range(count):
+        ranked = random.sample(range(options), random.randint(1, options))
+        ranking = [0] * options
+        for rank, option in enumerate(ranked, start=1):
+            ranking[option] = rank
+        rankings.append(ranking)
+    return rankings
+
+
+def main() -> None:
+    random.seed(0)
+    print(f"{'ballots':>8} {'options':>8} {'rebuild ms':>11} {'delta ms':>9} {'schulze ms':>11}")
+    for ballots, options in ((1000, 5), (10000, 20), (50000, 99)):
+        rankings = random_rankings(ballots, options)
+        rebuild_time, matrix = best_of(lambda: condorcet.pairwise_matrix(rankings, SIZE), repeat=3)
+        delta_time, _ = best_of(lambda: matrix + condorcet.ballot_change(rankings[0], rankings[1], SIZE))
+        schulze_time, _ = best_of(lambda: condorcet.score(matrix, options))
+        print(f"{ballots:>8} {options:>8} {rebuild_time * 1000:>11.1f} {delta_time * 1000:>9.3f} "
+              f"{schulze_time * 1000:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
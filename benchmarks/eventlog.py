@@ -0,0 +1,59 @@
+"""Tally rebuild latency by history length: replaying the whole event log against starting from the newest snapshot.
+
+Gives one poll a growing history of vote events, snapshots it and appends a fixed tail of 1,000 events, then times
+rebuilding the tally both ways. Needs the configured Postgres server, a throwaway test database is created and dropped
+around the run. Run from the repository root with ``python -m benchmarks.eventlog``.
+"""
+import datetime
+
+from benchmarks.common import best_of, setup_django
+from django.db import connection
+from django.utils import timezone
+
+setup_django()
+
+from main import events  # noqa: E402
+from main.models import Poll, TimestampField, VoteEvent  # noqa: E402
+
+OPTIONS = 10
+TAIL = 1000
+HISTORIES = (10000, 100000, 1000000)
+
+
+def append_events(poll: Poll, count: int) -> None:
+    # Alternating adds and removals, skewed towards adds, spread over the options.
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {VoteEvent._meta.db_table} (poll_id, user_id, kind, option, delta, created)
+            SELECT %s, i, %s, i %% {OPTIONS}, CASE WHEN i %% 3 = 0 THEN -1 ELSE 1 END, now()
+            FROM generate_series(1, %s) AS i
+        """, [TimestampField.get_prep_value_static(poll.pk), VoteEvent.VOTE, count])
+        cursor.execute("ANALYZE")
+
+
+def main() -> None:
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        poll = Poll.objects.bulk_create([Poll(timestamp='1557457622.000001', channel='CBENCH', question='Bench?',
+                                              options=[f'Option {i}' for i in range(OPTIONS)])])[0]
+        target = events.target_of(poll)
+        print(f"{TAIL} events after the snapshot")
+        print(f"{'history':>8} {'full replay ms':>15} {'from snapshot ms':>17}")
+        written = 0
+        for history in HISTORIES:
+            append_events(poll, history - written)
+            written = history
+            events.take_snapshots(timezone.now() + datetime.timedelta(hours=1))
+            append_events(poll, TAIL)
+            written += TAIL
+            full, expected = best_of(lambda: events.rebuild(target, OPTIONS, from_snapshot=False))
+            snapshot, result = best_of(lambda: events.rebuild(target, OPTIONS))
+            assert result == expected
+            print(f"{history:>8} {full * 1000:>15.2f} {snapshot * 1000:>17.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
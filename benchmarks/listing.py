@@ -0,0 +1,65 @@
+"""Listing latency by page depth: OFFSET pagination against the keyset pagination the listing endpoints use.
+
+Fills a channel with a million polls and a user with a vote on each, then times fetching page 1, 100 and 10,000 of
+50 rows both ways. Needs the configured Postgres server, a throwaway test database is created and dropped around the
+run. Run from the repository root with ``python -m benchmarks.listing [rows]``.
+"""
+import sys
+
+from benchmarks.common import best_of, setup_django
+from django.db import connection
+
+setup_django()
+
+from main import listing  # noqa: E402
+from main.models import Poll, User, Vote  # noqa: E402
+
+PAGE = 50
+DEPTHS = (1, 100, 10000)
+
+
+def populate(rows: int) -> User:
+    user = User.objects.create(name='benchmark')
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {Poll._meta.db_table} (timestamp, channel, question, options, ranked, version, modified)
+            SELECT to_timestamp(1500000000 + i), 'CBENCH', 'Question ' || i, ARRAY['Yes', 'No'], false, 0, now()
+            FROM generate_series(1, %s) AS i
+        """, [rows])
+        cursor.execute(f"""
+            INSERT INTO {Vote._meta.db_table} (poll_id, option, user_id)
+            SELECT timestamp, 0, %s FROM {Poll._meta.db_table}
+        """, [user.pk])
+        cursor.execute("ANALYZE")
+    return user
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = populate(rows)
+        polls = Poll.objects.filter(channel='CBENCH').order_by('timestamp')
+        votes = Vote.objects.filter(user=user).select_related('poll').order_by('id')
+        print(f"{rows} polls and votes, {PAGE} per page")
+        print(f"{'page':>6} {'poll offset ms':>15} {'poll seek ms':>13} {'vote offset ms':>15} {'vote seek ms':>13}")
+        for depth in DEPTHS:
+            offset = (depth - 1) * PAGE
+            if offset >= rows:
+                break
+            # The cursor a client would hold after reading the previous page.
+            poll_cursor = polls.values_list('timestamp', flat=True)[offset - 1] if offset else None
+            vote_cursor = votes.values_list('id', flat=True)[offset - 1] if offset else None
+            poll_offset, _ = best_of(lambda: list(polls[offset:offset + PAGE]))
+            poll_seek, _ = best_of(lambda: listing.seek(polls, 'timestamp', poll_cursor, PAGE))
+            vote_offset, _ = best_of(lambda: list(votes[offset:offset + PAGE]))
+            vote_seek, _ = best_of(lambda: listing.seek(votes, 'id', vote_cursor, PAGE))
+            print(f"{depth:>6} {poll_offset * 1000:>15.2f} {poll_seek * 1000:>13.2f} {vote_offset * 1000:>15.2f} "
+                  f"{vote_seek * 1000:>13.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""chat.update payload size and render time against the number of voters on a poll.
+
+Run from the repository root with ``python -m benchmarks.render_payload``.
+"""
+import json
+from typing import List
+
+from benchmarks.common import best_of, setup_django
+from django.test import override_settings
+
+setup_django()
+
+from main.views import format_attachments, format_text, order_options  # noqa: E402
+
+OPTIONS = [f"Option number {i}" for i in range(10)]
+LOCATION = "https://localhost:8000/polls/1557457622.123456/"
+
+
+def ballots(voters: int) -> List[List[str]]:
+    votes: List[List[str]] = [[] for _ in OPTIONS]
+    for i in range(voters):
+        votes[i % len(OPTIONS)].append(f"user.name.{i:07d}")
+    return votes
+
+
+def render(votes: List[List[str]]) -> str:
+    options, ordered = order_options(OPTIONS, votes)
+    body = {
+        "channel": "C0123456",
+        "ts": "1557457622.123456",
+        "text": format_text("Where should we have lunch?", options, ordered, LOCATION),
+        "attachments": format_attachments(OPTIONS),
+        "parse": "full"
+    }
+    return json.dumps(body)
+
+
+def main() -> None:
+    print(f"{'voters':>8} {'full bytes':>12} {'full ms':>9} {'compact bytes':>14} {'compact ms':>11}")
+    for voters in (10, 100, 1000, 10000, 100000):
+        votes = ballots(voters)
+        with override_settings(POLLS_COMPACT_RENDER_THRESHOLD=float('inf')):
+            full_time, full = best_of(lambda: render(votes))
+        compact_time, compact = best_of(lambda: render(votes))
+        print(f"{voters:>8} {len(full):>12} {full_time * 1000:>9.2f} {len(compact):>14} {compact_time * 1000:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
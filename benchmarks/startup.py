@@ -0,0 +1,99 @@
+"""Worker start up: time to first response and unique memory per worker, with and without preloading the app.
+
+Starts gunicorn from ``gunicorn.conf.py`` once per mode on a free local port and polls ``/status/`` until it answers,
+then reads each worker's unique set size (private pages, the memory a worker costs on top of what it shares) from
+``/proc``. Linux only. Run from the repository root with ``python -m benchmarks.startup [workers]``.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import requests
+
+MODES = {
+    'lazy': {'POLLS_GUNICORN_PRELOAD': '0', 'POLLS_WARM_UP': '0'},
+    'warm': {'POLLS_GUNICORN_PRELOAD': '0', 'POLLS_WARM_UP': '1'},
+    'preload': {'POLLS_GUNICORN_PRELOAD': '1', 'POLLS_WARM_UP': '1'},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def children(pid: int) -> List[int]:
+    found = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may contain spaces, the parent pid is the second field after it.
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        found.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return found
+
+
+def unique_kb(pid: int) -> int:
+    total = 0
+    with open(f'/proc/{pid}/smaps') as f:
+        for line in f:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(line.split()[1])
+    return total
+
+
+def measure(mode: str, workers: int) -> Tuple[float, float, List[int]]:
+    port = free_port()
+    env = dict(os.environ, **MODES[mode])
+    env.setdefault("POLLS_SECRET_KEY", "benchmark")
+    env.setdefault("DJANGO_SETTINGS_MODULE", "simpleslackpoll.settings")
+    # gunicorn 19 cannot be run with -m.
+    command = [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()', 'simpleslackpoll.wsgi',
+               '--config', 'gunicorn.conf.py', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+               '--log-level', 'warning']
+    start = time.perf_counter()
+    master = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_response = None
+        while first_response is None:
+            if master.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {master.returncode} in {mode} mode")
+            try:
+                requests.get(f'http://127.0.0.1:{port}/status/', timeout=30).raise_for_status()
+                first_response = time.perf_counter() - start
+            except requests.ConnectionError:
+                time.sleep(0.01)
+        # Every worker has to have booted and served something before its memory means anything.
+        while len(children(master.pid)) < workers:
+            time.sleep(0.05)
+        for _ in range(workers * 20):
+            requests.get(f'http://127.0.0.1:{port}/status/', timeout=30)
+        all_up = time.perf_counter() - start
+        return first_response, all_up, [unique_kb(pid) for pid in children(master.pid)]
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+def main() -> None:
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    results: Dict[str, Tuple[float, float, List[int]]] = {}
+    for mode in MODES:
+        results[mode] = measure(mode, workers)
+    print(f"{workers} workers")
+    for mode, (first, all_up, sizes) in results.items():
+        print(f"{mode:>8}: first response {first * 1000:6.0f} ms, all workers serving {all_up * 1000:6.0f} ms, "
+              f"unique memory per worker {sum(sizes) / len(sizes) / 1024:5.1f} MiB "
+              f"({', '.join(f'{size / 1024:.1f}' for size in sizes)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""Gunicorn settings, used by the Procfile.
+
+By default the app is preloaded: Django, the URLconf, templates and the WordNet word lists are loaded once in the
+master and shared copy on write with the workers, which only rebuild what must not cross a fork. Set
+POLLS_GUNICORN_PRELOAD=0 to have every worker load the app on its own.
+"""
+import gc
+import os
+
+preload_app = os.environ.get("POLLS_GUNICORN_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        # Everything loaded so far lives as long as the process, frozen objects are skipped by the collector so
+        # it does not write to their pages and unshare them in every worker.
+        gc.freeze()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from main.warmup import after_fork
+        after_fork()
@@ -0,0 +1,71 @@
+"""Named Elastic APM spans around Slack calls and tally work.
+
+Whether the agent runs is decided once at import from ``INSTALLED_APPS``. Without it ``span`` hands out one shared
+no-op object. Hot paths check ``ENABLED`` before building a span's name and labels, and compare the entered span with
+``NO_SPAN`` before working out labels known only at the end, so without an agent they compute nothing for it.
+"""
+import contextlib
+from typing import Any, Iterator, Optional
+
+from django.conf import settings
+
+try:
+    from elasticapm.contrib.django.client import get_client
+    from elasticapm.traces import capture_span
+except ImportError:  # pragma: no cover
+    capture_span = None
+
+ENABLED = capture_span is not None and 'elasticapm.contrib.django' in settings.INSTALLED_APPS
+
+
+class NoSpan:
+    def label(self, **labels: Any) -> None:
+        pass
+
+    def __enter__(self) -> 'NoSpan':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+NO_SPAN = NoSpan()
+
+if capture_span is not None:
+    class _Span(capture_span):
+        __slots__ = ()
+
+        def __enter__(self) -> Any:
+            # Unsampled transactions and code outside any transaction get no span to label.
+            return super().__enter__() or NO_SPAN
+
+
+def span(name: str, span_type: str = 'app', subtype: Optional[str] = None, **labels: Any) -> Any:
+    """A context manager timing its block as a span of the current transaction, entering it gives the span.
+
+    Labels known only once the block ran go through ``label`` on the entered span.
+    """
+    if not ENABLED:
+        return NO_SPAN
+    return _Span(name, span_type, span_subtype=subtype, labels=labels or None)
+
+
+@contextlib.contextmanager
+def _background_transaction(name: str) -> Iterator[None]:
+    client = get_client()
+    client.begin_transaction('background')
+    result = 'success'
+    try:
+        yield
+    except Exception:
+        result = 'failure'
+        raise
+    finally:
+        client.end_transaction(name, result)
+
+
+def background_transaction(name: str) -> Any:
+    """A transaction of its own for a task on the background executor, which runs outside any request's."""
+    if not ENABLED:
+        return NO_SPAN
+    return _background_transaction(name)
@@ -0,0 +1,65 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional, Set
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from main import apm, metrics, ratelimit
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=settings.POLLS_BACKGROUND_WORKERS, thread_name_prefix='background')
+
+_lock = threading.Lock()
+_pending: Set[Hashable] = set()
+
+
+def reset() -> None:
+    """Replace the executor in a forked child.
+
+    The parent's threads do not survive the fork and its queue is not ours.
+    """
+    global executor, _lock
+    executor = ThreadPoolExecutor(max_workers=settings.POLLS_BACKGROUND_WORKERS, thread_name_prefix='background')
+    _lock = threading.Lock()
+    _pending.clear()
+
+
+def run(func: Callable[..., Any], *args: Any) -> None:
+    try:
+        # Nobody is waiting on a response here, so Slack calls may sleep for their rate limit buckets.
+        with apm.background_transaction(func.__name__), ratelimit.patient():
+            func(*args)
+    except Exception:
+        metrics.increment('background.failed')
+        logger.exception("Background task %s failed", func.__name__)
+    finally:
+        # Worker threads hold their own connections, nothing else would ever close them.
+        connections.close_all()
+
+
+def submit(func: Callable[..., Any], *args: Any) -> Future:
+    metrics.increment('background.submitted')
+    return executor.submit(run, func, *args)
+
+
+def submit_once(key: Hashable, func: Callable[..., Any], *args: Any) -> Optional[Future]:
+    """Queue ``func`` unless a task with the same key is still waiting to start, which already covers this call."""
+    with _lock:
+        if key in _pending:
+            metrics.increment('background.coalesced')
+            return None
+        _pending.add(key)
+
+    def start() -> None:
+        with _lock:
+            _pending.discard(key)
+        func(*args)
+    start.__name__ = func.__name__
+    return submit(start)
+
+
+def after_commit(key: Hashable, func: Callable[..., Any], *args: Any) -> None:
+    transaction.on_commit(lambda: submit_once(key, func, *args))
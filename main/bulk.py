@@ -0,0 +1,283 @@
+import logging
+import queue
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils.dateparse import parse_datetime
+
+from main import condorcet, events, ratelimit
+from main.models import apply_matrix_delta, Block, CompleteVote, default_options_inner, default_ranking, \
+    DistributedPoll, PairwiseMatrix, Poll, PollBatch, Question, Response, TimestampField, touch_poll, User, Vote, \
+    VoteEvent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# Inserts a batch of button votes, returning only the rows that were not already there so each gets one event.
+INSERT_VOTES = """
+INSERT INTO {table} (poll_id, option, user_id)
+SELECT %s, option, user_id FROM unnest(%s::integer[], %s::integer[]) AS rows (option, user_id)
+ON CONFLICT DO NOTHING
+RETURNING option, user_id
+"""
+
+
+def upsert_users(names: Iterable[str]) -> Dict[str, int]:
+    names = set(names)
+    User.objects.bulk_create([User(name=name) for name in names], batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return dict(User.objects.filter(name__in=names).values_list('name', 'id'))
+
+
+def import_votes(poll: Poll, votes: List[Dict[str, Any]], ballots: List[Dict[str, Any]]) \
+        -> Tuple[int, int, List[Dict[str, Any]]]:
+    """Import button votes and complete ballots in one transaction, refreshing the Slack message once at the end.
+
+    Rows that fail validation are skipped and reported back as ``{'kind', 'index', 'error'}`` dicts.
+    """
+    errors: List[Dict[str, Any]] = []
+    valid_votes: List[Tuple[str, int]] = []
+    for index, row in enumerate(votes):
+        try:
+            name = row['user']
+            option = poll.options.index(row['option'])
+        except (KeyError, TypeError, ValueError):
+            errors.append({'kind': 'vote', 'index': index, 'error': "Needs a user and one of the poll's options."})
+            continue
+        if not isinstance(name, str) or not 0 < len(name) <= 100:
+            errors.append({'kind': 'vote', 'index': index, 'error': "Invalid user name."})
+            continue
+        valid_votes.append((name, option))
+
+    valid_ballots: Dict[str, Tuple[int, List[bool], List[int], Any]] = {}
+    for index, row in enumerate(ballots):
+        try:
+            name = row['user']
+            chosen = list(row['options'])
+            secret = row.get('secret')
+        except (KeyError, TypeError, AttributeError):
+            errors.append({'kind': 'ballot', 'index': index, 'error': "Needs a user and a list of options."})
+            continue
+        if not isinstance(name, str) or not 0 < len(name) <= 100 \
+                or (secret is not None and (not isinstance(secret, str) or len(secret) > 11)):
+            errors.append({'kind': 'ballot', 'index': index, 'error': "Invalid user name or secret."})
+            continue
+        inner = [option in chosen for option in poll.options]
+        if sum(inner) != len(chosen):
+            errors.append({'kind': 'ballot', 'index': index, 'error': "Included duplicate or invalid values."})
+            continue
+        if name in valid_ballots:
+            errors.append({'kind': 'ballot', 'index': index, 'error': "Duplicate ballot for this user."})
+            continue
+        # On ranked polls the options are listed in order of preference.
+        ranking = [chosen.index(option) + 1 if selected else 0 for option, selected in zip(poll.options, inner)] \
+            if poll.ranked else []
+        valid_ballots[name] = (index, inner + default_options_inner()[len(inner):],
+                               ranking + default_ranking()[len(ranking):], secret)
+
+    with transaction.atomic():
+        users = upsert_users([name for name, _ in valid_votes] + list(valid_ballots))
+        changes: List[VoteEvent] = []
+        inserted = 0
+        poll_id = TimestampField.get_prep_value_static(poll.pk)
+        with connection.cursor() as cursor:
+            for start in range(0, len(valid_votes), BATCH_SIZE):
+                batch = valid_votes[start:start + BATCH_SIZE]
+                cursor.execute(INSERT_VOTES.format(table=Vote._meta.db_table),
+                               [poll_id, [option for _, option in batch], [users[name] for name, _ in batch]])
+                rows = cursor.fetchall()
+                # Votes already there are skipped by the insert, only the rows it returns are new.
+                inserted += len(rows)
+                changes.extend(events.toggled(VoteEvent.VOTE, user_id, option, True, poll_id=poll.pk)
+                               for option, user_id in rows)
+
+        existing = {vote.user_id: vote for vote in CompleteVote.objects.select_for_update()
+                    .filter(poll=poll, user_id__in=[users[name] for name in valid_ballots])}
+        created: List[CompleteVote] = []
+        updated: List[CompleteVote] = []
+        delta = PairwiseMatrix.empty()
+        for name, (index, inner, ranking, secret) in valid_ballots.items():
+            vote = existing.get(users[name])
+            if vote is None:
+                created.append(CompleteVote(poll=poll, user_id=users[name], options_inner=inner, ranking=ranking,
+                                            user_secret=secret))
+                changes.extend(events.ballot_changes(poll.pk, users[name], None, inner))
+                if poll.ranked:
+                    delta += condorcet.ballot_change(None, ranking, Poll.MAX_OPTIONS)
+            elif vote.user_secret == secret:
+                if poll.ranked:
+                    delta += condorcet.ballot_change(vote.ranking, ranking, Poll.MAX_OPTIONS)
+                changes.extend(events.ballot_changes(poll.pk, users[name], vote.options_inner, inner))
+                vote.options_inner = inner
+                vote.ranking = ranking
+                updated.append(vote)
+            else:
+                errors.append({'kind': 'ballot', 'index': index, 'error': "Secret does not match the existing ballot."})
+        CompleteVote.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        CompleteVote.objects.bulk_update(updated, ['options_inner', 'ranking'], batch_size=BATCH_SIZE)
+        events.record(changes)
+        if poll.ranked:
+            apply_matrix_delta(poll.pk, delta)
+        touch_poll(poll.pk)
+
+    logger.info("Imported %d votes and %d ballots into %s with %d errors",
+                inserted, len(created) + len(updated), poll.pk, len(errors))
+    poll.update_poll()
+    return inserted, len(created) + len(updated), sorted(errors, key=lambda e: (e['kind'], e['index']))
+
+
+def poll_from_spec(spec: Dict[str, Any], default_channel: str) -> Poll:
+    from main.views import unique_list
+    if not isinstance(spec, dict):
+        raise ValueError("Each poll must be an object.")
+    question = spec.get('question')
+    options = spec.get('options')
+    channel = spec.get('channel', default_channel)
+    if not isinstance(question, str) or not 0 < len(question) <= 200:
+        raise ValueError("Needs a question of at most 200 characters.")
+    if not isinstance(options, list) or not all(isinstance(option, str) and 0 < len(option) <= 100
+                                                for option in options):
+        raise ValueError("Options must be a list of strings of at most 100 characters.")
+    options = unique_list(options)
+    if len(options) > Poll.MAX_OPTIONS:
+        raise ValueError(f"A poll can have at most {Poll.MAX_OPTIONS} options.")
+    if not isinstance(channel, str) or not 0 < len(channel) <= 9:
+        raise ValueError("Needs a channel id.")
+    closes_at = None
+    if spec.get('closes_at'):
+        try:
+            closes_at = parse_datetime(spec['closes_at'])
+        except (TypeError, ValueError):
+            closes_at = None
+        if closes_at is None or closes_at.tzinfo is None:
+            raise ValueError("closes_at must be an ISO 8601 datetime with a timezone.")
+    return Poll(channel=channel, question=question, options=options, closes_at=closes_at,
+                ranked=bool(spec.get('ranked', False)))
+
+
+def post_channel_polls(polls: List[Tuple[int, Poll]], patience: float,
+                       report: Callable[[int, Optional[str]], None]) -> None:
+    # Slack allows about one message per second per channel, so a channel's polls are posted one after another. Each
+    # ``ts`` is reported as soon as Slack assigns it, polls not posted are reported with None.
+    reported = 0
+    try:
+        with ratelimit.patient(patience):
+            for position, (index, poll) in enumerate(polls):
+                if position:
+                    time.sleep(settings.POLLS_SLACK_CHANNEL_INTERVAL)
+                try:
+                    ts = poll.post_poll()
+                except (requests.RequestException, ratelimit.RateLimited, KeyError, ValueError):
+                    logger.warning("Could not post poll %d to %s", index, poll.channel, exc_info=True)
+                    report(index, None)
+                    reported += 1
+                    continue
+                poll.timestamp = TimestampField.from_db_value_static(ts)
+                report(index, ts)
+                reported += 1
+    finally:
+        for index, _ in polls[reported:]:
+            report(index, None)
+        # Runs on its own thread, nothing else would close a connection the rate limiter opened.
+        connection.close()
+
+
+def create_polls(specs: List[Dict[str, Any]], default_channel: str,
+                 progress: Callable[[int], None] = lambda done: None) -> List[Dict[str, Any]]:
+    """Validate, post and store a batch of new polls, returning one result per spec in order.
+
+    Channels are posted to concurrently with at most ``POLLS_SLACK_CONCURRENCY`` requests in flight, one
+    ``chat.postMessage`` per poll as the message carries its link from the start. The polls Slack accepted are stored
+    with one bulk insert. ``progress`` is called with the number of specs handled as the batch goes.
+    """
+    results: List[Dict[str, Any]] = [{'index': index} for index in range(len(specs))]
+    by_channel: Dict[str, List[Tuple[int, Poll]]] = defaultdict(list)
+    for index, spec in enumerate(specs):
+        try:
+            poll = poll_from_spec(spec, default_channel)
+        except ValueError as e:
+            results[index]['error'] = str(e)
+            continue
+        by_channel[poll.channel].append((index, poll))
+    polls = {index: poll for channel_polls in by_channel.values() for index, poll in channel_polls}
+    progress(len(specs) - len(polls))
+
+    # The posting threads report back here, where progress is recorded and the polls are stored on this thread's
+    # connection. They are inserted even when a channel fails part way, so no posted message is left without its poll.
+    reports: "queue.Queue[Tuple[int, Optional[str]]]" = queue.Queue()
+    posted: List[Poll] = []
+    try:
+        with ThreadPoolExecutor(max_workers=settings.POLLS_SLACK_CONCURRENCY) as executor:
+            # The posting threads wait for rate limits as long as this one may.
+            futures = [executor.submit(post_channel_polls, channel_polls, ratelimit.patience(),
+                                       lambda index, ts: reports.put((index, ts)))
+                       for channel_polls in by_channel.values()]
+            for _ in range(len(polls)):
+                index, ts = reports.get()
+                if ts is None:
+                    results[index]['error'] = "Could not post the poll to Slack."
+                else:
+                    posted.append(polls[index])
+                    results[index]['timestamp'] = ts
+                    results[index]['location'] = polls[index].get_absolute_url()
+                progress(1)
+            for future in futures:
+                future.result()
+    finally:
+        Poll.objects.bulk_create(posted, batch_size=BATCH_SIZE)
+    return results
+
+
+def post_poll_batch(batch_id: int) -> None:
+    batches = PollBatch.objects.filter(pk=batch_id)
+    batch = batches.get()
+    if batch.results is not None:
+        return
+    results = create_polls(batch.specs, batch.default_channel,
+                           lambda done: batches.update(done=models.F('done') + done))
+    batches.update(results=results)
+    logger.info("Posted poll batch %d, %d of %d polls", batch_id, sum('timestamp' in r for r in results), batch.total)
+
+
+def purge_batches(poll_id: int) -> List[Tuple[str, str]]:
+    """DELETE statements removing up to ``%(limit)s`` rows of the poll's responses, then questions, then blocks."""
+    response, question, block = Response._meta.db_table, Question._meta.db_table, Block._meta.db_table
+    return [
+        (response, f"DELETE FROM {response} WHERE id IN (SELECT r.id FROM {response} r "
+                   f"JOIN {question} q ON q.id = r.question_id JOIN {block} b ON b.id = q.block_id "
+                   f"WHERE b.poll_id = %(poll)s LIMIT %(limit)s)"),
+        (question, f"DELETE FROM {question} WHERE id IN (SELECT q.id FROM {question} q "
+                   f"JOIN {block} b ON b.id = q.block_id WHERE b.poll_id = %(poll)s LIMIT %(limit)s)"),
+        (block, f"DELETE FROM {block} WHERE id IN (SELECT id FROM {block} WHERE poll_id = %(poll)s LIMIT %(limit)s)"),
+    ]
+
+
+def purge_distributed_poll(poll_id: int, batch_size: Optional[int] = None) -> None:
+    """Delete a distributed poll and everything under it in bounded, separately committed batches.
+
+    Unlike ``DistributedPoll.delete`` nothing is loaded into memory, each batch is one set based DELETE and the
+    progress is written to ``purge_done`` so it can be followed while it runs.
+    """
+    batch_size = batch_size or settings.POLLS_PURGE_BATCH_SIZE
+    polls = DistributedPoll.objects.filter(pk=poll_id)
+    total = Response.objects.filter(question__block__poll_id=poll_id).count() \
+        + Question.objects.filter(block__poll_id=poll_id).count() + Block.objects.filter(poll_id=poll_id).count()
+    polls.update(purge_total=total, purge_done=0)
+    for table, sql in purge_batches(poll_id):
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, {'poll': poll_id, 'limit': batch_size})
+                deleted = cursor.rowcount
+                polls.update(purge_done=models.F('purge_done') + deleted)
+            logger.debug("Purged %d rows from %s for distributed poll %d", deleted, table, poll_id)
+            if deleted < batch_size:
+                break
+    # Everything below the poll is gone, so the row can go without the collector loading its blocks first.
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {DistributedPoll._meta.db_table} WHERE id = %s", [poll_id])
+    logger.info("Purged distributed poll %d, %d rows", poll_id, total)
@@ -0,0 +1,73 @@
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+UNRANKED = np.iinfo(np.int32).max
+
+
+def preferences(ranking: Sequence[int], size: int) -> np.ndarray:
+    """Pairwise preferences of one ballot: ``prefs[i, j]`` is 1 when option i is ranked above option j.
+
+    ``ranking[i]`` is the rank given to option i, starting at 1, with 0 for unranked options. Ranked options beat
+    unranked ones and options sharing a rank are tied.
+    """
+    ranks = np.zeros(size, dtype=np.int32)
+    ranks[:len(ranking)] = ranking
+    ranks = np.where(ranks > 0, ranks, UNRANKED)
+    return (ranks[:, None] < ranks[None, :]).astype(np.int32)
+
+
+def ballot_change(old: Optional[Sequence[int]], new: Optional[Sequence[int]], size: int) -> np.ndarray:
+    delta = np.zeros((size, size), dtype=np.int32)
+    if old is not None:
+        delta -= preferences(old, size)
+    if new is not None:
+        delta += preferences(new, size)
+    return delta
+
+
+def pairwise_matrix(rankings: Iterable[Sequence[int]], size: int, chunk: int = 1000) -> np.ndarray:
+    """Sum the preferences of many ballots, a chunk at a time to bound memory."""
+    matrix = np.zeros((size, size), dtype=np.int32)
+    batch: List[Sequence[int]] = []
+    for ranking in rankings:
+        batch.append(list(ranking)[:size] + [0] * (size - len(ranking)))
+        if len(batch) == chunk:
+            matrix += _sum_preferences(batch)
+            batch = []
+    if batch:
+        matrix += _sum_preferences(batch)
+    return matrix
+
+
+def _sum_preferences(batch: List[Sequence[int]]) -> np.ndarray:
+    ranks = np.asarray(batch, dtype=np.int32)
+    ranks = np.where(ranks > 0, ranks, UNRANKED)
+    return (ranks[:, :, None] < ranks[:, None, :]).sum(axis=0, dtype=np.int32)
+
+
+def condorcet_winner(matrix: np.ndarray, count: int) -> Optional[int]:
+    d = matrix[:count, :count]
+    beats = d > d.T
+    np.fill_diagonal(beats, True)
+    winners = np.flatnonzero(beats.all(axis=1))
+    return int(winners[0]) if len(winners) else None
+
+
+def schulze(matrix: np.ndarray, count: int) -> List[List[int]]:
+    """Schulze ranking of the first ``count`` options as a list of tiers, best first."""
+    d = matrix[:count, :count].astype(np.int64)
+    strength = np.where(d > d.T, d, 0)
+    for k in range(count):
+        # Widest path through k, computed for every pair at once.
+        strength = np.maximum(strength, np.minimum(strength[:, k, None], strength[None, k, :]))
+    np.fill_diagonal(strength, 0)
+    wins = (strength > strength.T).sum(axis=1)
+    tiers: List[List[int]] = []
+    for score in sorted(set(wins.tolist()), reverse=True):
+        tiers.append(np.flatnonzero(wins == score).tolist())
+    return tiers
+
+
+def score(matrix: np.ndarray, count: int) -> Tuple[List[List[int]], Optional[int]]:
+    return schulze(matrix, count), condorcet_winner(matrix, count)
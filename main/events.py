@@ -0,0 +1,112 @@
+import datetime
+import itertools
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from django.conf import settings
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from main.models import Poll, Question, TallySnapshot, VoteEvent
+
+logger = logging.getLogger(__name__)
+
+Target = Dict[str, Any]
+
+
+def toggled(kind: int, user_id: int, option: int, added: bool, poll_id: Any = None,
+            question_id: Optional[str] = None) -> VoteEvent:
+    return VoteEvent(kind=kind, poll_id=poll_id, question_id=question_id, user_id=user_id, option=option,
+                     delta=1 if added else -1)
+
+
+def ballot_changes(poll_id: Any, user_id: int, old: Optional[Sequence[bool]], new: Sequence[bool]) -> List[VoteEvent]:
+    """Events turning the options selected in ``old`` into those selected in ``new``."""
+    return [toggled(VoteEvent.BALLOT, user_id, option, selected, poll_id=poll_id)
+            for option, (was, selected) in enumerate(itertools.zip_longest(old or [], new, fillvalue=False))
+            if bool(was) != bool(selected)]
+
+
+def record(events: List[VoteEvent]) -> None:
+    if events:
+        VoteEvent.objects.bulk_create(events, batch_size=1000)
+
+
+def target_of(obj: Union[Poll, Question]) -> Target:
+    return {'poll_id': obj.pk} if isinstance(obj, Poll) else {'question_id': obj.pk}
+
+
+def rebuild(target: Target, size: int, at: Optional[datetime.datetime] = None, through: Optional[int] = None,
+            from_snapshot: bool = True) -> Tuple[List[int], int]:
+    """Per option counts of a poll or question and the id of the last event they include.
+
+    Starts from the newest snapshot that fits the bounds and adds up the events after it, so the cost follows the
+    tail since that snapshot rather than the whole history. ``at`` replays as of a point in time, ``through`` up to
+    an event id. Without ``from_snapshot`` only the baseline taken when the log was introduced is used, which
+    replays the whole log and is what snapshots are verified against.
+    """
+    snapshots = TallySnapshot.objects.filter(**target)
+    events = VoteEvent.objects.filter(**target)
+    if at is not None:
+        snapshots = snapshots.filter(covers__lte=at)
+        events = events.filter(created__lte=at)
+    if through is not None:
+        snapshots = snapshots.filter(last_event__lte=through)
+        events = events.filter(id__lte=through)
+    if not from_snapshot:
+        snapshots = snapshots.filter(last_event=0)
+    snapshot = snapshots.order_by('-last_event').first()
+    counts = [0] * size
+    last = 0
+    if snapshot is not None:
+        last = snapshot.last_event
+        for option, count in enumerate(snapshot.counts[:size]):
+            counts[option] = count
+    tail = events.filter(id__gt=last).order_by().values('option').annotate(total=Sum('delta'), last=Max('id'))
+    for row in tail:
+        if 0 <= row['option'] < size:
+            counts[row['option']] += row['total']
+        last = max(last, row['last'])
+    return counts, last
+
+
+def live_counts(obj: Union[Poll, Question]) -> List[int]:
+    if isinstance(obj, Poll):
+        return [len(voters) for voters in obj.votes]
+    return [len(responders) for responders in obj.responses]
+
+
+def verify(obj: Union[Poll, Question], from_snapshot: bool = True) -> Optional[Tuple[List[int], List[int]]]:
+    """None when the replayed tally matches the live tables, the replayed and live counts otherwise."""
+    replayed, _ = rebuild(target_of(obj), len(obj.options), from_snapshot=from_snapshot)
+    live = live_counts(obj)
+    return None if replayed == live else (replayed, live)
+
+
+def take_snapshots(now: Optional[datetime.datetime] = None) -> int:
+    """Snapshot every poll and question with events since the last run, returning how many snapshots were taken.
+
+    Only events older than ``POLLS_TALLY_SNAPSHOT_LAG`` seconds are included, so transactions still in flight when
+    their ids were handed out have committed before a snapshot moves past them.
+    """
+    cutoff = (now or timezone.now()) - datetime.timedelta(seconds=settings.POLLS_TALLY_SNAPSHOT_LAG)
+    since = TallySnapshot.objects.aggregate(last=Max('last_event'))['last'] or 0
+    last = VoteEvent.objects.filter(id__gt=since, created__lte=cutoff).aggregate(last=Max('id'))['last']
+    if last is None:
+        return 0
+    tail = VoteEvent.objects.filter(id__gt=since, id__lte=last)
+    covers = tail.aggregate(covers=Max('created'))['covers']
+    poll_ids = set(tail.filter(poll__isnull=False).values_list('poll_id', flat=True).distinct())
+    question_ids = set(tail.filter(question__isnull=False).values_list('question_id', flat=True).distinct())
+    sizes: List[Tuple[Target, int]] = \
+        [({'poll_id': pk}, len(options)) for pk, options
+         in Poll.objects.filter(pk__in=poll_ids).values_list('pk', 'options')] + \
+        [({'question_id': pk}, len(options)) for pk, options
+         in Question.objects.filter(pk__in=question_ids).values_list('pk', 'options')]
+    snapshots = []
+    for target, size in sizes:
+        counts, _ = rebuild(target, size, through=last)
+        snapshots.append(TallySnapshot(last_event=last, counts=counts, covers=covers, **target))
+    TallySnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    logger.info("Took %d tally snapshots through event %d", len(snapshots), last)
+    return len(snapshots)
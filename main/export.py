@@ -0,0 +1,150 @@
+import csv
+import datetime
+import io
+import json
+import math
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.utils.dateparse import parse_datetime
+
+from main.models import ArchivedCompleteVote, ArchivedVote, CompleteVote, Poll, ranked_options, TimestampField, Vote
+from main.routers import replica_reads
+
+FORMATS = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+CSV_HEADER = ['timestamp', 'channel', 'question', 'source', 'user', 'option', 'rank']
+
+
+def check_epoch(value: str) -> str:
+    """Return ``value`` if it is an epoch timestamp a poll can have, raise ValueError otherwise.
+
+    ``float`` also takes inf, nan and seconds past year 9999, which would only fail once the query runs.
+    """
+    seconds = float(value)
+    if math.isfinite(seconds):
+        try:
+            datetime.datetime.utcfromtimestamp(seconds)
+            return value
+        except (OverflowError, OSError, ValueError):
+            pass
+    raise ValueError(f"Not a timestamp: {value}")
+
+
+def parse_bound(value: Optional[str]) -> Optional[str]:
+    """Slack style epoch timestamps pass through, ISO 8601 datetimes are converted to them."""
+    if not value:
+        return None
+    try:
+        float(value)
+    except ValueError:
+        pass
+    else:
+        return check_epoch(value)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Not a timestamp: {value}")
+    if parsed.tzinfo is not None:
+        try:
+            parsed = parsed.astimezone(datetime.timezone.utc)
+        except OverflowError:
+            raise ValueError(f"Not a timestamp: {value}")
+    return TimestampField.to_python_static(parsed)
+
+
+def poll_chunks(channel: Optional[str], since: Optional[str], until: Optional[str], after: Optional[str],
+                chunk_size: int, replica: bool = False) -> Iterator[List[Poll]]:
+    """Polls in timestamp order, fetched ``chunk_size`` at a time by keyset so every query stays cheap."""
+    polls = Poll.objects.order_by('timestamp')
+    if channel:
+        polls = polls.filter(channel=channel)
+    if since:
+        polls = polls.filter(timestamp__gte=since)
+    if until:
+        polls = polls.filter(timestamp__lt=until)
+    cursor = after
+    while True:
+        with replica_reads(replica):
+            chunk = list((polls.filter(timestamp__gt=cursor) if cursor else polls)[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        cursor = chunk[-1].timestamp
+
+
+def poll_records(polls: List[Poll], replica: bool = False) -> Iterator[Dict[str, Any]]:
+    """One JSON ready record per poll with its live and archived votes and ballots, fetched in four queries."""
+    keys = [poll.pk for poll in polls]
+    votes: Dict[Any, List[Tuple[str, int]]] = defaultdict(list)
+    ballots: Dict[Any, List[Tuple[str, List[bool], Optional[List[int]]]]] = defaultdict(list)
+    with replica_reads(replica):
+        for model in (Vote, ArchivedVote):
+            for poll_id, option, user in model.objects.filter(poll_id__in=keys).order_by('poll_id', 'user__name') \
+                    .values_list('poll_id', 'option', 'user__name'):
+                votes[poll_id].append((user, option))
+        for model in (CompleteVote, ArchivedCompleteVote):
+            for poll_id, inner, ranking, user in model.objects.filter(poll_id__in=keys) \
+                    .order_by('poll_id', 'user__name').values_list('poll_id', 'options_inner', 'ranking', 'user__name'):
+                ballots[poll_id].append((user, inner, ranking))
+
+    for poll in polls:
+        options = poll.options
+        record = {
+            'timestamp': poll.timestamp_str,
+            'channel': poll.channel,
+            'question': poll.question,
+            'options': options,
+            'ranked': poll.ranked,
+            'closes_at': poll.closes_at.isoformat() if poll.closes_at else None,
+            'closed_at': poll.closed_at.isoformat() if poll.closed_at else None,
+            'votes': [{'user': user, 'option': options[option]} for user, option in votes[poll.pk]
+                      if option < len(options)],
+            'ballots': [],
+        }
+        for user, inner, ranking in ballots[poll.pk]:
+            ballot: Dict[str, Any] = {'user': user, 'options': [o for o, chosen in zip(options, inner) if chosen]}
+            if poll.ranked and ranking is not None:
+                ballot['ranking'] = ranked_options(options, ranking)
+            record['ballots'].append(ballot)
+        yield record
+
+
+def csv_rows(record: Dict[str, Any]) -> Iterator[List[Any]]:
+    """Flatten a poll record to one row per chosen option, a poll nobody voted on still gets a row."""
+    poll = [record['timestamp'], record['channel'], record['question']]
+    empty = True
+    for vote in record['votes']:
+        empty = False
+        yield poll + ['vote', vote['user'], vote['option'], '']
+    for ballot in record['ballots']:
+        ranking = ballot.get('ranking')
+        for option in ballot['options']:
+            empty = False
+            yield poll + ['ballot', ballot['user'], option, ranking.index(option) + 1 if ranking else '']
+    if empty:
+        yield poll + ['', '', '', '']
+
+
+def csv_line(row: List[Any]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue()
+
+
+def export_lines(fmt: str, channel: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                 after: Optional[str] = None, chunk_size: int = 500, replica: bool = False) -> Iterator[str]:
+    """Stream polls as JSON Lines or CSV, holding at most one chunk of polls and their votes in memory.
+
+    Output is ordered by timestamp, so an interrupted export resumes by passing the last timestamp written as
+    ``after``.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt}")
+    if fmt == 'csv' and not after:
+        yield csv_line(CSV_HEADER)
+    for chunk in poll_chunks(channel, since, until, after, chunk_size, replica):
+        for record in poll_records(chunk, replica):
+            if fmt == 'jsonl':
+                yield json.dumps(record) + '\n'
+            else:
+                yield ''.join(csv_line(row) for row in csv_rows(record))
@@ -0,0 +1,166 @@
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, TextIO
+from urllib.parse import parse_qs, urlparse
+
+SURVEY = """[[Block: Lunch]]
+Where should we have lunch?
+
+Tacos
+Pizza
+Sushi
+
+How often do you eat out?
+
+Daily
+Weekly
+Never
+
+[[Block: Commute]]
+How do you get to the office?
+
+Bike
+Train
+Car
+"""
+
+
+class FakeSlack(ThreadingHTTPServer):
+    """Offline stand-in for the Slack Web API that records every call.
+
+    ``latency`` seconds (plus up to ``jitter``) are added to each answer, ``error_rate`` of the calls fail with a 500
+    and ``rate_limit_rate`` of them with a 429 and a ``Retry-After`` header. Shared files are served from ``files``
+    by id, falling back to a small survey. ``GET /_calls`` returns the per method
+    counts, status codes and messages posted so far, ``POST /_reset`` clears them.
+    """
+    daemon_threads = True
+
+    def __init__(self, address: Any, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: int = 1, record: Optional[TextIO] = None):
+        super().__init__(address, FakeSlackHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.record = record
+        self.lock = threading.Lock()
+        self.counts: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.messages: List[Dict[str, Any]] = []
+        self.sequence = itertools.count(1)
+        self.files: Dict[str, bytes] = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_ts(self) -> str:
+        return f"{int(time.time())}.{next(self.sequence) % 1000000:06d}"
+
+    def log_call(self, method: str, status: int, body: Dict[str, Any]) -> None:
+        with self.lock:
+            self.counts[method] += 1
+            self.statuses[str(status)] += 1
+            if self.record is not None:
+                self.record.write(json.dumps({'time': time.time(), 'method': method, 'status': status,
+                                              'channel': body.get('channel')}) + '\n')
+                self.record.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'counts': dict(self.counts), 'statuses': dict(self.statuses), 'messages': list(self.messages)}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counts.clear()
+            self.statuses.clear()
+            self.messages.clear()
+
+
+class FakeSlackHandler(BaseHTTPRequestHandler):
+    server: FakeSlack
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def send_json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def request_body(self) -> Dict[str, Any]:
+        url = urlparse(self.path)
+        body: Dict[str, Any] = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            raw = self.rfile.read(length)
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                body.update(json.loads(raw))
+            else:
+                body.update({key: values[0] for key, values in parse_qs(raw.decode()).items()})
+        return body
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path
+        if path == '/_calls':
+            self.send_json(200, self.server.snapshot())
+        elif path.startswith('/files/'):
+            body = self.server.files.get(path.rsplit('/', 1)[-1], SURVEY.encode())
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.do_POST()
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path
+        if path == '/_reset':
+            self.server.reset()
+            self.send_json(200, {'ok': True})
+            return
+        method = path.rsplit('/', 1)[-1]
+        body = self.request_body()
+        server = self.server
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        roll = random.random()
+        if roll < server.rate_limit_rate:
+            server.log_call(method, 429, body)
+            self.send_json(429, {'ok': False, 'error': 'ratelimited'}, {'Retry-After': str(server.retry_after)})
+        elif roll < server.rate_limit_rate + server.error_rate:
+            server.log_call(method, 500, body)
+            self.send_json(500, {'ok': False, 'error': 'internal_error'})
+        else:
+            server.log_call(method, 200, body)
+            self.send_json(200, self.answer(method, body))
+
+    def answer(self, method: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        server = self.server
+        if method == 'chat.postMessage':
+            ts = server.next_ts()
+            with server.lock:
+                server.messages.append({'channel': body.get('channel'), 'ts': ts})
+            return {'ok': True, 'channel': body.get('channel'), 'ts': ts}
+        if method == 'chat.update':
+            return {'ok': True, 'channel': body.get('channel'), 'ts': body.get('ts')}
+        if method == 'dialog.open':
+            return {'ok': True}
+        if method == 'files.info':
+            file_id = body.get('file', 'F0')
+            size = len(server.files.get(file_id, SURVEY.encode()))
+            return {'ok': True, 'file': {'id': file_id, 'title': f"survey-{file_id}.txt", 'size': size,
+                                         'url_private_download': f"{server.url}/files/{file_id}"}}
+        return {'ok': False, 'error': 'unknown_method'}
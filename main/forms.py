@@ -1,14 +1,14 @@
 import random
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple, Type
 
 from django import forms
 from django.core.exceptions import ValidationError
 from django.http import QueryDict
-
 from wn import WordNet
-from wn.constants import wordnet_30_dir, NOUN, ADJ
+from wn.constants import ADJ, NOUN, wordnet_30_dir
 
-from main.models import CompleteVote, Poll, validate_vote
+from main.models import CompleteVote, default_ranking, Poll
+from main.votes import upsert_ballot
 
 
 def get_default_secret(max_word_length: int = 4):
@@ -39,49 +39,96 @@ class MultipleChoiceCompleteVoteForm(forms.ModelForm):
 
     class Meta:
         model = CompleteVote
-        fields = ('poll', 'user', 'user_secret')
+        fields = ('user', 'user_secret')
         widgets = {
-            'poll': forms.HiddenInput(),
             'user': forms.HiddenInput(),
             'user_secret': forms.HiddenInput()
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, poll: Optional[Poll] = None, **kwargs):
         if len(args) > 0:
             kwargs['data'] = args[0]
             args = tuple(args[1:])
         super().__init__(*args, **kwargs)
-        if 'data' in kwargs:
-            print(kwargs['data'])
-            if 'poll' in kwargs['data']:
-                setattr(self.instance, 'poll', Poll.objects.get(timestamp=kwargs['data']['poll']))
-        if not self.instance.poll:
-            raise ValidationError("Must define poll")
+        set_form_poll(self, poll, kwargs.get('data'))
         self.fields['options'].choices = ((x, x) for x in self.instance.poll.options)
         if 'data' in kwargs and 'options' in kwargs['data']:
             options = kwargs['data']['options']
             if isinstance(kwargs['data'], QueryDict):
                 options = kwargs['data'].getlist('options')
-            print(f"kwargs.data.options {options}")
             self.instance.options = options
         self.options = self.instance.options
-        print(self.options)
+
+    @property
+    def ballot(self) -> Tuple[List[bool], List[int]]:
+        return self.instance.options_inner, default_ranking()
 
     def save(self, commit=True):
-        if self.errors:
-            raise ValueError(
-                "The %s could not be %s because the data didn't validate." % (
-                    self.instance._meta.object_name,
-                    'created' if self.instance._state.adding else 'changed',
-                )
-            )
-        existing = validate_vote(self.instance.poll, self.instance.user, self.instance.user_secret)
-        if existing:
-            self.instance = existing
-        print(self.data['options'])
-        self.instance.options = self.options
-        print(self.instance.options)
-        super().save(commit)
+        return save_ballot(self)
 
     def validate_unique(self):
-        return True
\ No newline at end of file
+        return True
+
+
+class RankedCompleteVoteForm(forms.ModelForm):
+    class Meta:
+        model = CompleteVote
+        fields = ('user', 'user_secret')
+        widgets = {
+            'user': forms.HiddenInput(),
+            'user_secret': forms.HiddenInput()
+        }
+
+    def __init__(self, *args, poll: Optional[Poll] = None, **kwargs):
+        if len(args) > 0:
+            kwargs['data'] = args[0]
+            args = tuple(args[1:])
+        super().__init__(*args, **kwargs)
+        set_form_poll(self, poll, kwargs.get('data'))
+        options = self.instance.poll.options
+        for index, option in enumerate(options):
+            rank = self.instance.ranking[index]
+            self.fields[f'rank_{index}'] = forms.IntegerField(label=option, required=False, min_value=1,
+                                                              max_value=len(options), initial=rank or None)
+
+    @property
+    def ranking(self) -> List[int]:
+        return [self.cleaned_data.get(f'rank_{index}') or 0 for index in range(len(self.instance.poll.options))]
+
+    @property
+    def ballot(self) -> Tuple[List[bool], List[int]]:
+        self.instance.set_ranking(self.ranking)
+        return self.instance.options_inner, self.instance.ranking
+
+    def save(self, commit=True):
+        return save_ballot(self)
+
+    def validate_unique(self):
+        return True
+
+
+def set_form_poll(form: forms.ModelForm, poll: Optional[Poll], data: Optional[Dict[str, Any]]) -> None:
+    # Views pass the poll they already loaded, looking it up from the submitted data is the fallback.
+    if poll is not None:
+        form.instance.poll = poll
+    elif data is not None and 'poll' in data:
+        form.instance.poll = Poll.objects.get(timestamp=data['poll'])
+    if form.instance.poll_id is None:
+        raise ValidationError("Must define poll")
+
+
+def save_ballot(form: forms.ModelForm) -> int:
+    if form.errors:
+        raise ValueError(
+            "The %s could not be %s because the data didn't validate." % (
+                form.instance._meta.object_name,
+                'created' if form.instance._state.adding else 'changed',
+            )
+        )
+    options_inner, ranking = form.ballot
+    return upsert_ballot(form.instance.poll, form.cleaned_data['user'], form.cleaned_data['user_secret'],
+                         options_inner, ranking)
+
+
+def complete_vote_form(poll: Poll) -> Type[forms.ModelForm]:
+    return RankedCompleteVoteForm if poll.ranked else MultipleChoiceCompleteVoteForm
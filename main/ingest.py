@@ -0,0 +1,51 @@
+import codecs
+import time
+from typing import Iterable, Iterator, List, Optional
+
+HEADER = '[[Block:'
+CHUNK_SIZE = 64 * 1024
+
+
+class SurveyRejected(Exception):
+    """A shared file that is not turned into a distributed poll, the message says why."""
+
+
+class NotASurvey(SurveyRejected):
+    """A shared file that is no survey at all, such as an image, which is dropped without a word in the channel."""
+
+
+def survey_lines(chunks: Iterable[bytes], max_bytes: int, deadline: Optional[float] = None) -> Iterator[str]:
+    """Decode a download chunk by chunk into lines for the survey parser, holding at most one line at a time.
+
+    Fails as soon as the first text is not a ``[[Block:`` header, which rejects unrelated uploads after their first
+    chunk with NotASurvey, more than ``max_bytes`` arrived or the ``time.monotonic`` deadline passed.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    received = 0
+    # Leading text until it is long enough to tell whether it is a block header.
+    head: Optional[str] = ''
+    partial: List[str] = []
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if head is not None:
+            head = (head + text).lstrip()
+            if not (head.startswith(HEADER) or HEADER.startswith(head)):
+                raise NotASurvey(f"it does not start with a {HEADER} header")
+            if len(head) >= len(HEADER):
+                head = None
+        received += len(chunk)
+        if received > max_bytes:
+            raise SurveyRejected(f"it is larger than {max_bytes} bytes")
+        if deadline is not None and time.monotonic() > deadline:
+            raise SurveyRejected("downloading it took too long")
+        *lines, rest = text.split('\n')
+        if lines:
+            lines[0] = ''.join(partial) + lines[0]
+            partial = []
+            yield from lines
+        partial.append(rest)
+    if head is not None:
+        raise NotASurvey(f"it does not start with a {HEADER} header")
+    last = ''.join(partial) + decoder.decode(b'', final=True)
+    if last:
+        yield last
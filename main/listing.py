@@ -0,0 +1,67 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.db.models import Model, QuerySet
+
+from main.models import CompleteVote, Poll, Response, User, Vote
+
+
+def seek(queryset: QuerySet, key: str, after: Optional[Any], limit: int) -> Tuple[List[Any], bool]:
+    """One page of ``queryset`` ordered by ``key`` starting after the cursor, and whether another page follows.
+
+    The cursor is the last key of the previous page, so every page is one index range scan of ``limit + 1`` rows
+    however deep it is, where OFFSET would read and throw away every row before it.
+    """
+    if after is not None:
+        queryset = queryset.filter(**{f'{key}__gt': after})
+    rows = list(queryset.order_by(key)[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def poll_item(poll: Poll) -> Dict[str, Any]:
+    return {
+        'timestamp': poll.timestamp_str,
+        'question': poll.question,
+        'options': poll.options,
+        'ranked': poll.ranked,
+        'closes_at': poll.closes_at.isoformat() if poll.closes_at else None,
+        'closed': poll.is_closed,
+        'url': poll.get_absolute_url(),
+    }
+
+
+def vote_item(vote: Vote) -> Dict[str, Any]:
+    return {'id': vote.id, 'poll': vote.poll.timestamp_str, 'question': vote.poll.question,
+            'option': vote.chosen_option}
+
+
+def ballot_item(ballot: CompleteVote) -> Dict[str, Any]:
+    item = {'id': ballot.id, 'poll': ballot.poll.timestamp_str, 'question': ballot.poll.question,
+            'options': ballot.options}
+    if ballot.poll.ranked:
+        item['ranking'] = ballot.ranked_options
+    return item
+
+
+def response_item(response: Response) -> Dict[str, Any]:
+    question = response.question
+    return {'id': response.id, 'poll': question.block.poll.name, 'block': question.block.name,
+            'question': question.question, 'option': response.chosen_option}
+
+
+# Rows of each kind of history with the relations their items read, fetched in the same query.
+HISTORY: Dict[str, Tuple[Model, Tuple[str, ...], Callable[[Any], Dict[str, Any]]]] = {
+    'votes': (Vote, ('poll',), vote_item),
+    'ballots': (CompleteVote, ('poll',), ballot_item),
+    'responses': (Response, ('question__block__poll',), response_item),
+}
+
+
+def channel_polls(channel: str, after: Optional[str], limit: int) -> Dict[str, Any]:
+    polls, more = seek(Poll.objects.filter(channel=channel), 'timestamp', after, limit)
+    return {'polls': [poll_item(poll) for poll in polls], 'next': polls[-1].timestamp_str if more else None}
+
+
+def user_history(user: User, kind: str, after: Optional[int], limit: int) -> Dict[str, Any]:
+    model, related, item = HISTORY[kind]
+    rows, more = seek(model.objects.filter(user=user).select_related(*related), 'id', after, limit)
+    return {kind: [item(row) for row in rows], 'next': str(rows[-1].id) if more else None}
@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+from main import metrics
+from main.routers import replica_reads
+
+logger = logging.getLogger(__name__)
+
+
+class ResultsHub:
+    """Fan poll result changes out to every live watcher in this process.
+
+    A single background thread checks the version stamp of each watched poll once per interval and, when it moved,
+    computes the results once and wakes every watcher of that poll. Watchers only block on a condition variable, so
+    N watchers of a poll cost one tally per change rather than N.
+    """
+
+    def __init__(self, interval: float, max_streams: int = 0):
+        self.interval = interval
+        self.max_streams = max_streams
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every watcher and the refresh thread, also used in a child forked from a process with a hub."""
+        self.streams = threading.BoundedSemaphore(self.max_streams) if self.max_streams else None
+        self.changed = threading.Condition()
+        self.watchers: Dict[str, int] = defaultdict(int)
+        self.latest: Dict[str, Tuple[int, str]] = {}
+        self.pending = False
+        self.thread: Optional[threading.Thread] = None
+
+    def subscribe(self, poll_timestamp: str) -> None:
+        with self.changed:
+            self.watchers[poll_timestamp] += 1
+            self.pending = True
+            self.changed.notify_all()
+
+    def unsubscribe(self, poll_timestamp: str) -> None:
+        with self.changed:
+            self.watchers[poll_timestamp] -= 1
+            if self.watchers[poll_timestamp] <= 0:
+                del self.watchers[poll_timestamp]
+                self.latest.pop(poll_timestamp, None)
+
+    def claim_stream(self) -> bool:
+        """Take one of the stream slots of this process, False when they are all in use."""
+        return self.streams is None or self.streams.acquire(blocking=False)
+
+    def release_stream(self) -> None:
+        if self.streams is not None:
+            self.streams.release()
+
+    def wait(self, poll_timestamp: str, seen: Optional[int], timeout: float) -> Optional[Tuple[int, str]]:
+        def ready() -> bool:
+            return poll_timestamp in self.latest and self.latest[poll_timestamp][0] != seen
+
+        with self.changed:
+            if self.changed.wait_for(ready, timeout):
+                return self.latest[poll_timestamp]
+        return None
+
+    def start(self) -> None:
+        with self.changed:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='results-hub', daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            try:
+                with replica_reads():
+                    self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh live poll results")
+                # Drop a possibly broken connection, the next refresh opens a fresh one.
+                connection.close()
+            with self.changed:
+                # New subscribers wake the thread so they get their first event without waiting a full interval.
+                self.changed.wait_for(lambda: self.pending, self.interval)
+
+    def refresh(self) -> None:
+        from main.models import Poll
+        from main.views import results_payload
+        with self.changed:
+            self.pending = False
+            watched = list(self.watchers)
+        for poll_timestamp in watched:
+            version = Poll.objects.filter(timestamp=poll_timestamp).values_list('version', flat=True).first()
+            if version is None or self.latest.get(poll_timestamp, (None,))[0] == version:
+                continue
+            data = json.dumps(results_payload(Poll.objects.get(timestamp=poll_timestamp)))
+            with self.changed:
+                if poll_timestamp in self.watchers:
+                    self.latest[poll_timestamp] = (version, data)
+                    self.changed.notify_all()
+
+
+hub = ResultsHub(settings.POLLS_SSE_POLL_INTERVAL, settings.POLLS_SSE_MAX_STREAMS)
+
+
+def results_events(poll_timestamp: str) -> Iterator[str]:
+    hub.start()
+    hub.subscribe(poll_timestamp)
+    try:
+        seen = None
+        # Connections are recycled periodically, EventSource reconnects on its own.
+        deadline = time.monotonic() + settings.POLLS_SSE_MAX_SECONDS
+        while time.monotonic() < deadline:
+            event = hub.wait(poll_timestamp, seen, settings.POLLS_SSE_KEEPALIVE_SECONDS)
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                seen, data = event
+                yield f"id: {seen}\nevent: results\ndata: {data}\n\n"
+    finally:
+        hub.unsubscribe(poll_timestamp)
+
+
+class ResultsStream:
+    """The events of one live results connection, holding a stream slot of the hub until the response is closed.
+
+    Django closes the streamed content when the connection ends, including when it ends before the first event.
+    """
+
+    def __init__(self, poll_timestamp: str):
+        self.events = results_events(poll_timestamp)
+        self.closed = False
+
+    def __iter__(self) -> Iterator[str]:
+        return self.events
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.events.close()
+            hub.release_stream()
+
+
+def open_stream(poll_timestamp: str) -> Optional[ResultsStream]:
+    """A stream of ``poll_timestamp``'s results, None when this process already serves as many as it may."""
+    if not hub.claim_stream():
+        metrics.increment('sse.rejected')
+        return None
+    return ResultsStream(poll_timestamp)
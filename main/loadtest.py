@@ -0,0 +1,128 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import requests
+
+SCENARIOS = ('poll', 'click', 'event')
+OPTIONS = ['Tacos', 'Pizza', 'Sushi', 'Salad']
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class PhaseResult(NamedTuple):
+    scenario: str
+    requests: int
+    errors: int
+    elapsed: float
+    latencies: List[float]
+    outbound: Dict[str, int]
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def amplification(self) -> float:
+        return sum(self.outbound.values()) / self.requests if self.requests else 0.0
+
+    def report(self) -> str:
+        calls = ', '.join(f"{method}={count}" for method, count in sorted(self.outbound.items())) or 'none'
+        p50, p99 = percentile(self.latencies, 50) * 1000, percentile(self.latencies, 99) * 1000
+        return (f"{self.scenario:>6}: {self.requests} requests, {self.errors} errors, {self.throughput:.1f} req/s, "
+                f"p50 {p50:.0f} ms, p99 {p99:.0f} ms, {self.amplification:.2f} Slack calls per request ({calls})")
+
+
+class LoadTest:
+    """Replays Slack slash commands, button clicks and message events against a running app at a target rate.
+
+    The app has to be started with ``POLLS_SLACK_API_URL`` pointing at the fake Slack server whose ``/_calls``
+    counters are compared before and after each phase to attribute outbound calls to the inbound requests.
+    """
+
+    def __init__(self, app_url: str, slack_url: str, token: str, channels: int = 5, users: int = 500):
+        self.app_url = app_url.rstrip('/')
+        self.slack_url = slack_url.rstrip('/')
+        self.token = token
+        self.channels = [f"CLOAD{i:04d}" for i in range(channels)]
+        self.users = [f"load.user.{i}" for i in range(users)]
+        self.session = requests.Session()
+        self.polls: List[Tuple[str, str]] = []
+        self.survey = ''
+
+    def slack_calls(self) -> Dict[str, Any]:
+        return self.session.get(f"{self.slack_url}/_calls").json()
+
+    def setup(self, polls: int) -> None:
+        """Create the polls clicked on and the distributed poll asked for, through the same endpoints Slack uses."""
+        known = {(m['channel'], m['ts']) for m in self.slack_calls()['messages']}
+        for index in range(polls):
+            path, kwargs = self.request('poll', index)
+            self.session.post(f"{self.app_url}{path}", **kwargs).raise_for_status()
+        self.polls = [(m['channel'], m['ts']) for m in self.slack_calls()['messages']
+                      if m['channel'] in self.channels and (m['channel'], m['ts']) not in known]
+        file_id = f"F{random.getrandbits(32):08X}"
+        self.survey = f"survey-{file_id}"
+        posted = len(self.slack_calls()['messages'])
+        self.session.post(f"{self.app_url}/event_handling/", json={
+            'token': self.token, 'type': 'event_callback',
+            'event': {'type': 'file_shared', 'file': {'id': file_id}, 'channel_id': self.channels[0]}
+        }).raise_for_status()
+        # The survey is ingested in the background, it exists once the app has announced it in the channel.
+        deadline = time.monotonic() + 30
+        while len(self.slack_calls()['messages']) == posted and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    def request(self, scenario: str, index: int) -> Tuple[str, Dict[str, Any]]:
+        channel = self.channels[index % len(self.channels)]
+        if scenario == 'poll':
+            text = f'"Load test question {index}?" ' + ' '.join(f'"{option}"' for option in OPTIONS)
+            return '/poll/', {'data': {'token': self.token, 'channel_id': channel, 'text': text}}
+        if scenario == 'click':
+            channel, ts = random.choice(self.polls)
+            payload = {'callback_id': 'options', 'token': self.token, 'channel': {'id': channel},
+                       'actions': [{'name': 'option', 'value': random.choice(OPTIONS)}],
+                       'original_message': {'ts': ts}, 'user': {'name': random.choice(self.users)}}
+            return '/interactive_button/', {'data': {'payload': json.dumps(payload)}}
+        if scenario == 'event':
+            return '/event_handling/', {'json': {'token': self.token, 'type': 'event_callback', 'event': {
+                'type': 'message', 'text': f"dpoll {self.survey}", 'channel': channel}}}
+        raise ValueError(f"Unknown scenario {scenario}")
+
+    def fire(self, scenario: str, index: int) -> Tuple[float, bool]:
+        path, kwargs = self.request(scenario, index)
+        start = time.perf_counter()
+        try:
+            ok = self.session.post(f"{self.app_url}{path}", timeout=60, **kwargs).status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    def run_phase(self, scenario: str, rps: float, duration: float, concurrency: int) -> PhaseResult:
+        """Open loop: requests start on schedule whether or not earlier ones finished, up to ``concurrency`` at once."""
+        before = self.slack_calls()['counts']
+        total = max(1, int(rps * duration))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = []
+            for index in range(total):
+                delay = start + index / rps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(self.fire, scenario, index))
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        # Give calls the app defers until after the response, such as vote refreshes, a moment to land.
+        time.sleep(1)
+        after = self.slack_calls()['counts']
+        outbound = {method: count - before.get(method, 0) for method, count in after.items()
+                    if count != before.get(method, 0)}
+        return PhaseResult(scenario, total, sum(1 for _, ok in results if not ok), elapsed,
+                           [latency for latency, _ in results], outbound)
@@ -0,0 +1,100 @@
+import copy
+import logging
+import logging.handlers
+import queue
+import random
+from importlib import import_module
+from typing import Any, Dict, List, Optional
+
+from main import metrics
+
+# Pass as ``extra=PAYLOAD`` on log calls that dump request or response bodies so they can be sampled.
+PAYLOAD = {'payload': True}
+
+
+def import_class(path: str) -> Any:
+    module_path, class_name = path.rsplit('.', 1)
+    return getattr(import_module(module_path), class_name)
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Block rather than fail when stopping with a full queue, the thread is still draining it.
+        self.queue.put(self._sentinel)
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """Forward records to ``target`` on a background thread through a bounded queue.
+
+    When the queue is full the record is dropped and counted instead of blocking the request.
+    """
+
+    def __init__(self, target: str, queue_size: int = 10000, **kwargs: Any):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = import_class(target)(**kwargs)
+        self.listener = _Listener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        self.listening = True
+
+    def stop(self) -> None:
+        # logging.shutdown() closes every handler at exit, which flushes whatever is still queued.
+        if self.listening:
+            self.listening = False
+            self.listener.stop()
+
+    def restart(self) -> None:
+        """Start over with an empty queue and a new listener thread in a child forked while this one was running."""
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        sock = getattr(self.target, 'sock', None)
+        if sock is not None:
+            # A socket shared with the parent would interleave both processes' records, the target reconnects.
+            sock.close()
+            self.target.sock = None
+        self.listener = _Listener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        self.listening = True
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue never leaves the process, so keep exc_info for the target instead of flattening it to text.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment('logging.dropped')
+
+    def close(self) -> None:
+        self.stop()
+        self.target.close()
+        super().close()
+
+
+def queued_handlers() -> List[QueuedHandler]:
+    loggers = [logging.getLogger()] + [logger for logger in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    found: List[QueuedHandler] = []
+    for logger in loggers:
+        found += [handler for handler in logger.handlers if isinstance(handler, QueuedHandler) and handler not in found]
+    return found
+
+
+class PayloadSampler(logging.Filter):
+    """Keep only a fraction of the records logged with ``extra=PAYLOAD``, other records always pass."""
+
+    def __init__(self, rate: float = 1.0, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rate = rate
+        self.rates = rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'payload', False):
+            return True
+        rate = self.rates.get(record.name, self.rate)
+        if rate >= 1 or random.random() < rate:
+            return True
+        metrics.increment('logging.sampled_out')
+        return False
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.models import Poll
+
+
+class Command(BaseCommand):
+    help = "Close every poll whose deadline has passed, snapshotting its final tally."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive', action='store_true', default=settings.POLLS_ARCHIVE_ON_CLOSE,
+                            help="Move the raw vote rows of closed polls into the archive tables.")
+
+    def handle(self, *args, **options):
+        due = Poll.objects.filter(closed_at__isnull=True, closes_at__lte=timezone.now())
+        for poll in due.iterator():
+            poll.close(archive=options['archive'])
+            self.stdout.write(f"Closed {poll.timestamp_str}")
@@ -0,0 +1,122 @@
+import csv
+import io
+import json
+import os
+import sys
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main import export
+
+
+BLOCK_SIZE = 64 * 1024
+
+
+def complete_lines_reversed(f: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+    """Newline terminated lines from the end of ``f`` backwards, each with the offset just past it.
+
+    A last line cut off mid-write is skipped. Blocks are read until a whole line is in hand, however long it is.
+    """
+    position = f.seek(0, os.SEEK_END)
+    buffer = b''
+    trimmed = False
+    while True:
+        if not trimmed:
+            newline = buffer.rfind(b'\n')
+            if newline >= 0 or not position:
+                buffer = buffer[:newline + 1]
+                trimmed = True
+                continue
+        elif buffer:
+            start = buffer.rfind(b'\n', 0, len(buffer) - 1) + 1
+            if start or not position:
+                yield position + len(buffer), buffer[start:]
+                buffer = buffer[:start]
+                continue
+        if not position:
+            return
+        step = min(BLOCK_SIZE, position)
+        position -= step
+        f.seek(position)
+        buffer = f.read(step) + buffer
+
+
+def jsonl_resume_point(f: BinaryIO) -> Tuple[int, Optional[str]]:
+    """End of the last complete poll in a JSON Lines export and its timestamp, (0, None) if there is none."""
+    for end, line in complete_lines_reversed(f):
+        try:
+            return end, json.loads(line)['timestamp']
+        except (ValueError, KeyError, TypeError):
+            continue
+    return 0, None
+
+
+def csv_resume_point(f: BinaryIO) -> Tuple[int, Optional[str]]:
+    """Start of the last poll's rows in a CSV export and the timestamp of the poll before it, (0, None) if none.
+
+    The last poll's rows may have been cut short, so they are dropped and the poll is exported again. Quoted fields
+    can span lines, which only reading from the start tells apart.
+    """
+    offset, record, quotes = 0, b'', 0
+    previous = current = None
+    current_start = 0
+    f.seek(0)
+    for line in f:
+        record += line
+        quotes += line.count(b'"')
+        if quotes % 2 or not line.endswith(b'\n'):
+            continue
+        start, offset, text, record, quotes = offset, offset + len(record), record.decode(errors='replace'), b'', 0
+        row = next(csv.reader(io.StringIO(text, newline='')), None)
+        try:
+            float(row[0])
+        except (TypeError, IndexError, ValueError):
+            continue
+        if row[0] != current:
+            previous, current, current_start = current, row[0], start
+    # Without a complete poll before it the file is written again from the start, header included.
+    return (current_start, previous) if previous else (0, None)
+
+
+RESUME_POINTS = {'jsonl': jsonl_resume_point, 'csv': csv_resume_point}
+
+
+class Command(BaseCommand):
+    help = "Stream polls with their votes and voter names as JSON Lines or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', help="Only polls posted in this channel.")
+        parser.add_argument('--since', help="Only polls created at or after this epoch or ISO 8601 timestamp.")
+        parser.add_argument('--until', help="Only polls created before this epoch or ISO 8601 timestamp.")
+        parser.add_argument('--after', help="Resume after the poll with this timestamp.")
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='jsonl')
+        parser.add_argument('--output', help="File to write, standard output by default.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Append to --output, continuing after the last poll it holds.")
+        parser.add_argument('--chunk-size', type=int, default=settings.POLLS_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        try:
+            since, until, after = (export.parse_bound(options[key]) for key in ('since', 'until', 'after'))
+        except ValueError as e:
+            raise CommandError(str(e))
+        path = options['output']
+        if options['resume']:
+            if not path:
+                raise CommandError("--resume needs --output")
+            if os.path.exists(path):
+                # Whatever follows the last complete poll is cut off, so the export continues on a clean boundary.
+                with open(path, 'r+b') as f:
+                    offset, last = RESUME_POINTS[fmt](f)
+                    f.truncate(offset)
+                after = last or after
+        out = open(path, 'a' if options['resume'] else 'w', newline='') if path else sys.stdout
+        try:
+            for line in export.export_lines(fmt, options['channel'], since, until, after, options['chunk_size']):
+                out.write(line)
+        finally:
+            if path:
+                out.close()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from main.fakeslack import FakeSlack
+
+
+class Command(BaseCommand):
+    help = "Serve a fake Slack Web API for load tests, point POLLS_SLACK_API_URL at http://HOST:PORT/api/."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every answer.")
+        parser.add_argument('--jitter', type=float, default=0.05, help="Up to this many more random seconds.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of calls answered with a 500.")
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                            help="Fraction of calls answered with a 429 and Retry-After.")
+        parser.add_argument('--retry-after', type=int, default=1)
+        parser.add_argument('--record', help="Append every call to this file as JSON lines.")
+
+    def handle(self, *args, **options):
+        record = open(options['record'], 'a') if options['record'] else None
+        server = FakeSlack((options['host'], options['port']), latency=options['latency'], jitter=options['jitter'],
+                           error_rate=options['error_rate'], rate_limit_rate=options['rate_limit_rate'],
+                           retry_after=options['retry_after'], record=record)
+        self.stdout.write(f"Fake Slack listening on {server.url}/api/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if record is not None:
+                record.close()
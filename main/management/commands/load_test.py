@@ -0,0 +1,31 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.loadtest import LoadTest, SCENARIOS
+
+
+class Command(BaseCommand):
+    help = "Drive a running app, whose Slack calls go to manage.py fake_slack, at a target rate and report on it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--slack-url', default='http://127.0.0.1:8900')
+        parser.add_argument('--token', default=os.environ.get("POLLS_SLACK_VERIFIER", ""),
+                            help="Verification token the app expects, POLLS_SLACK_VERIFIER by default.")
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                            help="Phase to run, repeatable. Defaults to every scenario in turn.")
+        parser.add_argument('--rps', type=float, default=20)
+        parser.add_argument('--duration', type=float, default=30, help="Seconds per phase.")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--polls', type=int, default=20, help="Polls created up front for the click phase.")
+        parser.add_argument('--channels', type=int, default=5)
+
+    def handle(self, *args, **options):
+        load = LoadTest(options['app_url'], options['slack_url'], options['token'], channels=options['channels'])
+        load.setup(options['polls'])
+        if not load.polls:
+            raise CommandError("No polls were posted, check that the app uses the fake Slack and the token.")
+        for scenario in options['scenario'] or SCENARIOS:
+            result = load.run_phase(scenario, options['rps'], options['duration'], options['concurrency'])
+            self.stdout.write(result.report())
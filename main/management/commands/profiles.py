@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import pstats
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.profiling import make_token, profile_paths
+
+
+class Command(BaseCommand):
+    help = "List the saved request profiles or summarize one of them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile', nargs='?',
+                            help="File name of the profile to summarize, 'latest' for the newest.")
+        parser.add_argument('--limit', type=int, default=20, help="Rows listed or functions and queries shown.")
+        parser.add_argument('--sort', default='cumulative', help="pstats sort key for the function table.")
+        parser.add_argument('--token', action='store_true',
+                            help="Print a signed X-Polls-Profile header value that profiles the request sending it.")
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(make_token())
+            return
+        paths = profile_paths(settings.POLLS_PROFILE_DIR)
+        if options['profile'] is None:
+            for path in paths[-options['limit']:]:
+                summary = self.sidecar(path)
+                started = datetime.fromtimestamp(summary.get('started', 0)).isoformat(timespec='seconds')
+                self.stdout.write(f"{os.path.basename(path)}  {started}  {summary.get('method')} {summary.get('path')} "
+                                  f"{summary.get('status')}  {summary.get('seconds', 0) * 1000:.0f} ms  "
+                                  f"{len(summary.get('queries', []))} queries  "
+                                  f"{len(summary.get('slack', []))} Slack calls")
+            return
+        name = os.path.basename(paths[-1]) if options['profile'] == 'latest' and paths else options['profile']
+        path = os.path.join(settings.POLLS_PROFILE_DIR, name)
+        if path not in paths:
+            raise CommandError(f"No profile named {options['profile']}")
+        self.summarize(path, options['limit'], options['sort'])
+
+    @staticmethod
+    def sidecar(path: str) -> dict:
+        try:
+            with open(path[:-len('.prof')] + '.json') as sidecar:
+                return json.load(sidecar)
+        except (OSError, ValueError):
+            return {}
+
+    def summarize(self, path: str, limit: int, sort: str) -> None:
+        summary = self.sidecar(path)
+        self.stdout.write(f"{summary.get('method')} {summary.get('path')} -> {summary.get('status')} in "
+                          f"{summary.get('seconds', 0) * 1000:.1f} ms, "
+                          f"SQL {summary.get('sql_seconds', 0) * 1000:.1f} ms, "
+                          f"Slack {summary.get('slack_seconds', 0) * 1000:.1f} ms")
+
+        queries = defaultdict(lambda: [0, 0.0])
+        for query in summary.get('queries', []):
+            queries[query['sql']][0] += 1
+            queries[query['sql']][1] += query['seconds']
+        self.stdout.write(f"\n{len(summary.get('queries', []))} queries, {len(queries)} distinct, slowest first:")
+        for sql, (count, seconds) in sorted(queries.items(), key=lambda item: -item[1][1])[:limit]:
+            self.stdout.write(f"{seconds * 1000:9.2f} ms {count:5d}x  {sql[:160]}")
+
+        self.stdout.write(f"\n{len(summary.get('slack', []))} Slack calls:")
+        for call in summary.get('slack', []):
+            self.stdout.write(f"{call['seconds'] * 1000:9.2f} ms  {call['method']} {call['channel'] or ''} "
+                              f"-> {call['status']}")
+
+        stream = io.StringIO()
+        pstats.Stats(path, stream=stream).sort_stats(sort).print_stats(limit)
+        self.stdout.write("\n" + stream.getvalue().strip())
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main import events
+from main.models import Poll, Question, VoteEvent
+
+
+class Command(BaseCommand):
+    help = "Snapshot the tallies of polls and questions that received vote events since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="Afterwards compare the replayed tally of every logged poll and question with the "
+                                 "vote tables.")
+        parser.add_argument('--full', action='store_true',
+                            help="Verify by replaying the whole log instead of starting from the newest snapshot.")
+
+    def handle(self, *args, **options):
+        taken = events.take_snapshots()
+        self.stdout.write(f"Took {taken} snapshots")
+        if not options['verify']:
+            return
+        logged = VoteEvent.objects.order_by()
+        objects = list(Poll.objects.filter(pk__in=logged.filter(poll__isnull=False).values('poll_id')).iterator()) + \
+            list(Question.objects.filter(pk__in=logged.filter(question__isnull=False).values('question_id')).iterator())
+        mismatched = 0
+        for obj in objects:
+            difference = events.verify(obj, from_snapshot=not options['full'])
+            if difference is not None:
+                mismatched += 1
+                self.stderr.write(f"{obj.pk}: replayed {difference[0]}, live {difference[1]}")
+        if mismatched:
+            raise CommandError(f"{mismatched} of {len(objects)} tallies do not match their event log")
+        self.stdout.write(f"Verified {len(objects)} tallies")
@@ -0,0 +1,23 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_lock = threading.Lock()
+_values: Dict[str, float] = defaultdict(float)
+
+
+def increment(name: str, value: float = 1) -> None:
+    with _lock:
+        _values[name] += value
+
+
+def reset() -> None:
+    """Start from zero with a new lock in a process forked from one that already counted."""
+    global _lock
+    _lock = threading.Lock()
+    _values.clear()
+
+
+def snapshot() -> Dict[str, float]:
+    with _lock:
+        return dict(_values)
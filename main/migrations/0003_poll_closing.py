@@ -0,0 +1,54 @@
+# Generated by Django 2.2.1 on 2026-10-19 00:29
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_add_complete_vote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollSnapshot',
+            fields=[
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='main.Poll')),
+                ('votes', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('text', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='closes_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedVote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('option', models.IntegerField()),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Poll')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.User')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedCompleteVote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('options_inner', django.contrib.postgres.fields.ArrayField(base_field=models.BooleanField(), size=99)),
+                ('user_secret', models.CharField(max_length=11, null=True)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Poll')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.User')),
+            ],
+        ),
+    ]
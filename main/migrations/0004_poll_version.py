@@ -0,0 +1,24 @@
+# Generated by Django 2.2.1 on 2026-10-19 00:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_poll_closing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
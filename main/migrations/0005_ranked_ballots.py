@@ -0,0 +1,33 @@
+# Generated by Django 2.2.1 on 2026-10-19 00:38
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import main.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_poll_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairwiseMatrix',
+            fields=[
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pairwise', serialize=False, to='main.Poll')),
+                ('counts', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='completevote',
+            name='ranking',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(), default=main.models.default_ranking, size=99),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='ranked',
+            field=models.BooleanField(default=False),
+        ),
+    ]
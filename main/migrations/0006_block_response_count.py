@@ -0,0 +1,33 @@
+# Generated by Django 2.2.1 on 2026-10-19 00:39
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_responses(apps, schema_editor):
+    Block = apps.get_model('main', 'Block')
+    Response = apps.get_model('main', 'Response')
+    counts = Response.objects.filter(question__block=OuterRef('pk')).order_by() \
+        .values('question__block').annotate(count=Count('id')).values('count')
+    Block.objects.update(response_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_ranked_ballots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='response_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_responses, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='block',
+            index=models.Index(fields=['poll', 'response_count', 'id'], name='main_block_poll_id_e93097_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.1 on 2026-10-19 00:43
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def index_text(apps, schema_editor):
+    Block = apps.get_model('main', 'Block')
+    Question = apps.get_model('main', 'Question')
+    Block.objects.update(search_vector=SearchVector('name', config='simple'))
+    Question.objects.update(search_vector=SearchVector('question', config='simple'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_block_response_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.RunPython(index_text, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='block',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='main_block_search__09f1ac_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='main_questi_search__17b226_gin'),
+        ),
+    ]
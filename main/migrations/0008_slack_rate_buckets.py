@@ -0,0 +1,21 @@
+# Generated by Django 2.2.1 on 2026-10-19 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_block_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlackRateBucket',
+            fields=[
+                ('key', models.CharField(max_length=120, primary_key=True, serialize=False)),
+                ('tokens', models.FloatField()),
+                ('updated', models.FloatField()),
+            ],
+        ),
+    ]
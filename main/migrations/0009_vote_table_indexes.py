@@ -0,0 +1,79 @@
+# Generated by Django 2.2.1 on 2026-10-19 00:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+DROP_POLL_UNIQUE = """
+DO $$
+DECLARE name text;
+BEGIN
+    FOR name IN SELECT conname FROM pg_constraint WHERE conrelid = 'main_poll'::regclass AND contype = 'u' LOOP
+        EXECUTE format('ALTER TABLE main_poll DROP CONSTRAINT %I', name);
+    END LOOP;
+END $$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_slack_rate_buckets'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='block',
+            name='main_block_poll_id_ac8d0f_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='completevote',
+            name='main_comple_poll_id_613aa0_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='poll',
+            name='main_poll_timesta_dd97ef_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='question',
+            name='main_questi_block_i_c7c3bc_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='response',
+            name='main_respon_questio_2f4895_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='user',
+            name='main_user_name_d2d935_idx',
+        ),
+        migrations.AlterField(
+            model_name='block',
+            name='poll',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='main.DistributedPoll'),
+        ),
+        migrations.AlterField(
+            model_name='completevote',
+            name='poll',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='main.Poll'),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='question',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='main.Question'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='poll',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='main.Poll'),
+        ),
+        # The primary key already makes timestamp unique. Django cannot tell the extra unique constraint apart from
+        # the primary key, so it is dropped by type.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(DROP_POLL_UNIQUE, migrations.RunSQL.noop)],
+            state_operations=[migrations.AlterUniqueTogether(name='poll', unique_together=set())],
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['question', 'user'], name='main_respon_questio_5fb80a_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.1 on 2026-10-19 01:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_vote_table_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='distributedpoll',
+            name='deleting',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='distributedpoll',
+            name='purge_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='distributedpoll',
+            name='purge_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
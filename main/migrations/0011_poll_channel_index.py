@@ -0,0 +1,17 @@
+# Generated by Django 2.2.1 on 2026-10-19 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_distributed_poll_purge'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='poll',
+            index=models.Index(fields=['channel', 'timestamp'], name='main_poll_channel_cdc604_idx'),
+        ),
+    ]
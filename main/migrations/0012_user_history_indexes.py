@@ -0,0 +1,41 @@
+# Generated by Django 2.2.1 on 2026-10-19 01:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_poll_channel_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='completevote',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='main.User'),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='main.User'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='main.User'),
+        ),
+        migrations.AddIndex(
+            model_name='completevote',
+            index=models.Index(fields=['user', 'id'], name='main_comple_user_id_d1c929_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['user', 'id'], name='main_respon_user_id_bee881_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['user', 'id'], name='main_vote_user_id_430a30_idx'),
+        ),
+    ]
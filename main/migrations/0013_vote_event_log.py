@@ -0,0 +1,88 @@
+# Generated by Django 2.2.1 on 2026-10-19 01:16
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Count
+
+
+def seed_snapshots(apps, schema_editor):
+    """Baseline tallies of the votes cast before the event log, which replays start from."""
+    models_ = {name: apps.get_model('main', name) for name in
+               ('Poll', 'Vote', 'ArchivedVote', 'CompleteVote', 'ArchivedCompleteVote', 'Question', 'Response',
+                'TallySnapshot')}
+    polls = {}
+    for model in (models_['Vote'], models_['ArchivedVote']):
+        for poll_id, option, count in model.objects.order_by().values('poll_id', 'option') \
+                .annotate(count=Count('id')).values_list('poll_id', 'option', 'count'):
+            polls.setdefault(poll_id, {}).setdefault(option, 0)
+            polls[poll_id][option] += count
+    for model in (models_['CompleteVote'], models_['ArchivedCompleteVote']):
+        for poll_id, options_inner in model.objects.values_list('poll_id', 'options_inner').iterator():
+            for option, selected in enumerate(options_inner):
+                if selected:
+                    polls.setdefault(poll_id, {}).setdefault(option, 0)
+                    polls[poll_id][option] += 1
+    questions = {}
+    for question_id, option, count in models_['Response'].objects.order_by().values('question_id', 'option') \
+            .annotate(count=Count('id')).values_list('question_id', 'option', 'count'):
+        questions.setdefault(question_id, {})[option] = count
+    now = django.utils.timezone.now()
+    snapshots = []
+    for model, field, tallies in ((models_['Poll'], 'poll_id', polls), (models_['Question'], 'question_id', questions)):
+        for pk, options in model.objects.filter(pk__in=list(tallies)).values_list('pk', 'options').iterator():
+            counts = [tallies[pk].get(option, 0) for option in range(len(options))]
+            snapshots.append(models_['TallySnapshot'](last_event=0, counts=counts, covers=now, **{field: pk}))
+    models_['TallySnapshot'].objects.bulk_create(snapshots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_user_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'vote'), (2, 'ballot'), (3, 'response')])),
+                ('option', models.SmallIntegerField()),
+                ('delta', models.SmallIntegerField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('poll', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='main.Poll')),
+                ('question', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='main.Question')),
+                ('user', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='main.User')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TallySnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_event', models.BigIntegerField()),
+                ('counts', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('covers', models.DateTimeField()),
+                ('poll', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='main.Poll')),
+                ('question', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='main.Question')),
+            ],
+        ),
+        migrations.RunPython(seed_snapshots, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='voteevent',
+            index=models.Index(fields=['poll', 'id'], name='main_voteev_poll_id_bfedb7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voteevent',
+            index=models.Index(fields=['question', 'id'], name='main_voteev_questio_a75cc0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tallysnapshot',
+            index=models.Index(fields=['poll', 'last_event'], name='main_tallys_poll_id_cf095d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tallysnapshot',
+            index=models.Index(fields=['question', 'last_event'], name='main_tallys_questio_b5d1d0_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.1 on 2026-10-19 01:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_vote_event_log'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='completevote',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='main.User'),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='main.User'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='main.User'),
+        ),
+    ]
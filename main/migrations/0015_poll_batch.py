@@ -0,0 +1,26 @@
+# Generated by Django 2.2.1 on 2026-10-19 01:40
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_protect_voter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('specs', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('default_channel', models.CharField(blank=True, max_length=9)),
+                ('total', models.PositiveIntegerField()),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('results', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
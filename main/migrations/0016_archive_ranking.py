@@ -0,0 +1,19 @@
+# Generated by Django 2.2.1 on 2026-10-19 01:54
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_poll_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedcompletevote',
+            name='ranking',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(), null=True, size=99),
+        ),
+    ]
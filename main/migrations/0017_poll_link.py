@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-19 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_archive_ranking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='link',
+            field=models.CharField(blank=True, max_length=12, null=True, unique=True),
+        ),
+    ]
@@ -1,14 +1,27 @@
 import copy
 import datetime
+import json
 import logging
 import os
 import random
+import re
 import string
-from typing import Dict, List, Union, Any, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from django.contrib.postgres.fields import ArrayField
-from django.core.exceptions import ValidationError, PermissionDenied
-from django.db import models
+import numpy as np
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from main import apm, condorcet
+
+logger = logging.getLogger(__name__)
 
 
 def absolute_url_without_request(location: str) -> str:
@@ -26,7 +39,7 @@ class TimestampField(models.CharField):
 
     @staticmethod
     def to_python_static(value: Union[str, datetime.datetime, float]) -> str:
-        logging.info(f'to_python: {value}, {type(value)}')
+        logger.debug('to_python: %s, %s', value, type(value))
 
         if isinstance(value, str):
             try:
@@ -47,7 +60,7 @@ class TimestampField(models.CharField):
 
     @staticmethod
     def from_db_value_static(value) -> datetime.datetime:
-        logging.info(f'db_value: {value}, {type(value)}')
+        logger.debug('db_value: %s, %s', value, type(value))
         if isinstance(value, str):
             try:
                 fvalue = float(value)
@@ -69,7 +82,7 @@ class TimestampField(models.CharField):
 
     @staticmethod
     def get_prep_value_static(value: Union[str, datetime.datetime, float]) -> str:
-        logging.info(f'get_prep_value: {value} {type(value)}')
+        logger.debug('get_prep_value: %s %s', value, type(value))
 
         if isinstance(value, datetime.datetime):
             dt = value
@@ -89,9 +102,6 @@ class User(models.Model):
     class Meta:
         get_latest_by = "name"
         ordering = ['name']
-        indexes = [
-            models.Index(fields=['name'])
-        ]
 
 
 class Poll(models.Model):
@@ -100,19 +110,44 @@ class Poll(models.Model):
     channel: str = models.CharField(max_length=9, null=False)
     question: str = models.CharField(max_length=200, null=False)
     options: List[str] = ArrayField(models.CharField(max_length=100, null=False), null=False, size=MAX_OPTIONS)
+    closes_at: Optional[datetime.datetime] = models.DateTimeField(null=True, blank=True)
+    closed_at: Optional[datetime.datetime] = models.DateTimeField(null=True, blank=True)
+    ranked: bool = models.BooleanField(default=False)
+    # Bumped on every change that affects the results, cheap to read for conditional requests.
+    version: int = models.PositiveIntegerField(default=0)
+    modified: datetime.datetime = models.DateTimeField(default=timezone.now)
+    # Key of the /p/<link>/ address in the Slack message. It is chosen before posting, Slack only assigns the timestamp
+    # the poll's own address is built from in its answer. Null for polls posted before messages used it.
+    link: Optional[str] = models.CharField(max_length=12, unique=True, null=True, blank=True)
 
     @property
     def timestamp_str(self):
         result = TimestampField.to_python_static(self.timestamp)
         return result
 
+    @property
+    def is_closed(self) -> bool:
+        return self.closed_at is not None
+
+    @property
+    def is_due(self) -> bool:
+        return not self.is_closed and self.closes_at is not None and self.closes_at <= timezone.now()
+
     @property
     def votes(self) -> List[List[str]]:
-        if self.timestamp:
-            partial = self.partial_votes
-            complete = self.complete_votes
-            votes = [a + b for a, b in zip(partial, complete)]
-            votes = [sorted(option) for option in votes]
+        if self.is_closed:
+            return self.snapshot.votes
+        elif self.timestamp:
+            # The labels are only worked out when there is an agent to send them to.
+            tally = apm.span('Poll.votes', 'app', 'tally', poll=self.timestamp_str, options=len(self.options)) \
+                if apm.ENABLED else apm.NO_SPAN
+            with tally as span:
+                partial = self.partial_votes
+                complete = self.complete_votes
+                votes = [a + b for a, b in zip(partial, complete)]
+                votes = [sorted(option) for option in votes]
+                if span is not apm.NO_SPAN:
+                    span.label(voters=sum(len(option) for option in votes))
             return votes
         else:
             return [[] for _ in self.options]
@@ -126,8 +161,8 @@ class Poll(models.Model):
     @property
     def partial_votes(self) -> List[List[str]]:
         votes: List[List[str]] = [[] for _ in self.options]
-        for vote in self.vote_set.all():
-            votes[vote.option].append(vote.user.name)
+        for option, user_name in self.vote_set.values_list('option', 'user__name'):
+            votes[option].append(user_name)
 
         votes = [sorted(option) for option in votes]
         return votes
@@ -135,18 +170,18 @@ class Poll(models.Model):
     @property
     def complete_votes(self) -> List[List[str]]:
         votes: List[List[str]] = [[] for _ in self.options]
-        for vote in self.completevote_set.all():
-            for option in vote.options:
-                ind = self.options.index(option)
-                votes[ind].append(vote.user.name)
+        for options_inner, user_name in self.completevote_set.values_list('options_inner', 'user__name'):
+            for ind, toggle in enumerate(options_inner[:len(self.options)]):
+                if toggle:
+                    votes[ind].append(user_name)
         votes = [sorted(option) for option in votes]
         return votes
 
     class Meta:
         get_latest_by = "timestamp"
         ordering = ["timestamp"]
-        unique_together = [["timestamp"]]
-        indexes = [models.Index(fields=['timestamp'])]
+        # Walking a channel's polls in timestamp order, as the export does.
+        indexes = [models.Index(fields=['channel', 'timestamp'])]
 
     def get_absolute_url(self):
         if self.timestamp:
@@ -154,19 +189,70 @@ class Poll(models.Model):
         else:
             return ''
 
+    @property
+    def message_url(self) -> str:
+        if self.link:
+            return absolute_url_without_request(f"/p/{self.link}/")
+        return self.get_absolute_url()
+
     def post_poll(self) -> str:
-        from main.views import format_text, format_attachments, post_message
-        text = format_text(self.question, self.options, self.votes, self.get_absolute_url())
-        attachments = format_attachments(self.options)
-        return post_message(self.channel, text, attachments)
+        """Post the poll to its channel as it will be rendered once stored, so no update has to follow."""
+        from main.views import format_attachments, post_message
+        if not self.link:
+            self.link = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(12))
+        return post_message(self.channel, self.render_text(), format_attachments(self.options))
 
-    def update_poll(self) -> None:
-        from main.views import format_text, format_attachments, order_options, poll_to_slack_timestamp, update_message
+    @property
+    def condorcet(self) -> Optional[Tuple[List[List[int]], Optional[int]]]:
+        if not self.ranked:
+            return None
+        pairwise = PairwiseMatrix.objects.filter(poll_id=self.pk).first() if self.timestamp else None
+        matrix = pairwise.matrix if pairwise else PairwiseMatrix.empty()
+        return condorcet.score(matrix, len(self.options))
+
+    @property
+    def ranked_summary(self) -> List[str]:
+        scores = self.condorcet
+        if scores is None:
+            return []
+        tiers, winner = scores
+        order = ' > '.join(' = '.join(self.options[i] for i in tier) for tier in tiers)
+        return [f"Ranked choice (Schulze): {order}",
+                f"Condorcet winner: {self.options[winner] if winner is not None else 'none'}"]
+
+    def render_text(self) -> str:
+        from main.views import format_text, order_options
         options, votes = order_options(self.options, self.votes)
-        text = format_text(self.question, options, votes, self.get_absolute_url())
-        attachments = format_attachments(self.options)
+        return format_text(self.question, options, votes, self.message_url, self.ranked_summary)
+
+    def update_poll(self) -> None:
+        from main.views import format_attachments, poll_to_slack_timestamp, update_message
         timestamp = poll_to_slack_timestamp(self)
-        update_message(self.channel, timestamp, text, attachments)
+        if self.is_closed:
+            # Closed polls lose their buttons and are rendered from the snapshot without touching the vote tables.
+            update_message(self.channel, timestamp, self.snapshot.text, json.dumps([]))
+        else:
+            update_message(self.channel, timestamp, self.render_text(), format_attachments(self.options))
+
+    def close(self, archive: bool = False) -> None:
+        with transaction.atomic():
+            # Rendered from the locked row, this instance may predate an option added since it was loaded.
+            poll = Poll.objects.select_for_update().get(timestamp=self.timestamp)
+            if not poll.is_closed:
+                text = poll.render_text() + "_This poll is closed._\n"
+                PollSnapshot.objects.create(poll=poll, votes=poll.votes, text=text)
+                if archive:
+                    archive_votes(poll)
+                now = timezone.now()
+                Poll.objects.filter(pk=poll.pk).update(closed_at=now, modified=now, version=models.F('version') + 1)
+                # Slack is only told once the lock is released, so votes on the poll never wait for its API.
+                transaction.on_commit(lambda: Poll.objects.get(pk=poll.pk).update_poll())
+        self.refresh_from_db(fields=['options', 'closed_at', 'version', 'modified'])
+
+    def close_if_due(self) -> bool:
+        if self.is_due:
+            self.close(archive=settings.POLLS_ARCHIVE_ON_CLOSE)
+        return self.is_closed
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -174,28 +260,52 @@ class Poll(models.Model):
             ts = self.post_poll()
             self.timestamp = TimestampField.from_db_value_static(ts)
 
+        self.modified = timezone.now()
+        if not self._state.adding:
+            self.version = models.F('version') + 1
         super().save(force_insert, force_update, using, update_fields)
+        if not isinstance(self.version, int):
+            self.refresh_from_db(fields=['version'])
 
         self.update_poll()
 
 
+def touch_poll(poll_id: Any) -> None:
+    Poll.objects.filter(pk=poll_id).update(version=models.F('version') + 1, modified=timezone.now())
+
+
 def default_options_inner():
     return [False]*Poll.MAX_OPTIONS
 
 
+def default_ranking():
+    return [0]*Poll.MAX_OPTIONS
+
+
+def ranked_options(options: List[str], ranking: List[int]) -> List[str]:
+    """The options a ballot ranked, most preferred first."""
+    return [options[i] for _, i in sorted((rank, i) for i, rank in enumerate(ranking[:len(options)]) if rank > 0)]
+
+
 class CompleteVote(models.Model):
-    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, null=False)
+    # Lookups by poll use the (poll, user) unique index.
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, null=False, db_index=False)
     options_inner = ArrayField(models.BooleanField(null=False), size=Poll.MAX_OPTIONS,
                                default=default_options_inner)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    # Lookups by user, including the paginated history, use the (user, id) index. Protected since a cascade would
+    # drop the user's choices from the tallies without a vote event.
+    user = models.ForeignKey(User, on_delete=models.PROTECT, null=False, db_index=False)
     user_secret = models.CharField(max_length=11, null=True)
+    # Rank given to each option on ranked polls, starting at 1 with 0 meaning unranked.
+    ranking = ArrayField(models.PositiveSmallIntegerField(null=False), size=Poll.MAX_OPTIONS,
+                         default=default_ranking)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['poll', 'user'], name='SingleVoteCopy')
         ]
+        indexes = [models.Index(fields=['user', 'id'])]
         ordering = ['poll', 'user']
-        indexes = [models.Index(fields=['poll'])]
 
     @property
     def options(self) -> List[str]:
@@ -204,23 +314,61 @@ class CompleteVote(models.Model):
 
     @options.setter
     def options(self, value: List[str]) -> None:
-        print(value, len(value))
         values = self.poll.options
         our_value = [(val in value) for val in values]
         if sum([int(x) for x in our_value]) != len(value):
-            print(our_value)
-            print(values)
-            print(value)
             raise ValidationError("Included duplicate or invalid values")
         our_value += [False] * (99 - len(our_value))
         self.options_inner = our_value
 
+    @property
+    def ranked_options(self) -> List[str]:
+        return ranked_options(self.poll.options, self.ranking)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored ranking and selections so a save only applies the difference to the pairwise matrix and
+        # the vote event log.
+        instance.saved_ranking = instance.__dict__.get('ranking')
+        instance.saved_options_inner = instance.__dict__.get('options_inner')
+        return instance
+
+    def set_ranking(self, ranking: List[int]) -> None:
+        ranking = list(ranking)
+        if len(ranking) > len(self.poll.options) or any(rank < 0 or rank > len(self.poll.options) for rank in ranking):
+            raise ValidationError("Ranks must be between 1 and the number of options")
+        self.ranking = ranking + [0] * (Poll.MAX_OPTIONS - len(ranking))
+        self.options_inner = [rank > 0 for rank in self.ranking]
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        super().save(force_insert, force_update, using, update_fields)
+        from main import events
+        with transaction.atomic():
+            super().save(force_insert, force_update, using, update_fields)
+            touch_poll(self.poll_id)
+            if self.poll.ranked:
+                apply_ballot_change(self.poll_id, getattr(self, 'saved_ranking', None), self.ranking)
+            events.record(events.ballot_changes(self.poll_id, self.user_id, getattr(self, 'saved_options_inner', None),
+                                                self.options_inner))
+        self.saved_ranking = list(self.ranking)
+        self.saved_options_inner = list(self.options_inner)
 
         self.poll.update_poll()
 
+    def delete(self, *args: Any, **kwargs: Any) -> Any:
+        from main import events
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            # A ballot another request removed first was already taken out of the tallies.
+            if result[0]:
+                touch_poll(self.poll_id)
+                if self.poll.ranked:
+                    apply_ballot_change(self.poll_id, getattr(self, 'saved_ranking', None), None)
+                events.record(events.ballot_changes(self.poll_id, self.user_id,
+                                                    getattr(self, 'saved_options_inner', self.options_inner), []))
+        return result
+
 
 def validate_vote(poll: Poll, user: User, user_secret: str):
     filtered = CompleteVote.objects.filter(poll=poll, user=user)
@@ -233,31 +381,210 @@ def validate_vote(poll: Poll, user: User, user_secret: str):
 
 
 class Vote(models.Model):
-    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, null=False)
+    # The (poll, option, user) unique index serves the toggle lookup and covers tallying a poll.
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, null=False, db_index=False)
     option = models.IntegerField(null=False)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    # Lookups by user, including the paginated history, use the (user, id) index. Protected since a cascade would
+    # drop the user's choices from the tallies without a vote event.
+    user = models.ForeignKey(User, on_delete=models.PROTECT, null=False, db_index=False)
 
     @property
     def chosen_option(self) -> str:
         return self.poll.options[self.option]
 
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            touch_poll(self.poll_id)
+            if adding:
+                VoteEvent.objects.create(kind=VoteEvent.VOTE, poll_id=self.poll_id, user_id=self.user_id,
+                                         option=self.option, delta=1)
+
+    def delete(self, *args: Any, **kwargs: Any) -> Any:
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            # Only the request that actually removed the row takes it out of the tally.
+            if result[0]:
+                touch_poll(self.poll_id)
+                VoteEvent.objects.create(kind=VoteEvent.VOTE, poll_id=self.poll_id, user_id=self.user_id,
+                                         option=self.option, delta=-1)
+        return result
+
     class Meta:
         unique_together = [['poll', 'option', 'user']]
+        indexes = [models.Index(fields=['user', 'id'])]
         ordering = ['poll', 'option']
 
 
+class PairwiseMatrix(models.Model):
+    """Running options x options totals over a ranked poll's ballots, ``counts[i, j]`` ballots prefer i over j."""
+    poll = models.OneToOneField(Poll, on_delete=models.CASCADE, primary_key=True, related_name='pairwise')
+    counts = models.BinaryField()
+
+    @staticmethod
+    def empty() -> np.ndarray:
+        return np.zeros((Poll.MAX_OPTIONS, Poll.MAX_OPTIONS), dtype=np.int32)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return np.frombuffer(bytes(self.counts), dtype=np.int32).reshape(Poll.MAX_OPTIONS, Poll.MAX_OPTIONS)
+
+
+def apply_matrix_delta(poll_id: Any, delta: np.ndarray) -> None:
+    with transaction.atomic():
+        pairwise, _ = PairwiseMatrix.objects.select_for_update().get_or_create(
+            poll_id=poll_id, defaults={'counts': PairwiseMatrix.empty().tobytes()})
+        pairwise.counts = (pairwise.matrix + delta).tobytes()
+        pairwise.save()
+
+
+def apply_ballot_change(poll_id: Any, old: Optional[List[int]], new: Optional[List[int]]) -> None:
+    apply_matrix_delta(poll_id, condorcet.ballot_change(old, new, Poll.MAX_OPTIONS))
+
+
+class SlackRateBucket(models.Model):
+    """Token bucket of one Slack method and channel, ``tokens`` as of ``updated`` seconds since the epoch."""
+    key = models.CharField(max_length=120, primary_key=True)
+    tokens = models.FloatField()
+    updated = models.FloatField()
+
+
+class PollBatch(models.Model):
+    """Polls from one POST to /polls/batch, posted by main.bulk.post_poll_batch in the background.
+
+    ``done`` counts the specs handled so far, ``results`` is filled in once the whole batch is.
+    """
+    specs = JSONField()
+    default_channel = models.CharField(max_length=9, blank=True)
+    total = models.PositiveIntegerField()
+    done = models.PositiveIntegerField(default=0)
+    results = JSONField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class PollSnapshot(models.Model):
+    poll = models.OneToOneField(Poll, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    votes = JSONField()
+    text = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class ArchivedVote(models.Model):
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, null=False)
+    option = models.IntegerField(null=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+
+
+class ArchivedCompleteVote(models.Model):
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, null=False)
+    options_inner = ArrayField(models.BooleanField(null=False), size=Poll.MAX_OPTIONS)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    user_secret = models.CharField(max_length=11, null=True)
+    # As on CompleteVote, null for ballots archived before rankings were kept.
+    ranking = ArrayField(models.PositiveSmallIntegerField(null=False), size=Poll.MAX_OPTIONS, null=True)
+
+
+def archive_votes(poll: Poll) -> None:
+    ArchivedVote.objects.bulk_create(ArchivedVote(poll_id=poll.pk, option=option, user_id=user_id)
+                                     for option, user_id in poll.vote_set.values_list('option', 'user_id'))
+    ArchivedCompleteVote.objects.bulk_create(
+        ArchivedCompleteVote(poll_id=poll.pk, options_inner=options_inner, user_id=user_id, user_secret=user_secret,
+                             ranking=ranking)
+        for options_inner, user_id, user_secret, ranking
+        in poll.completevote_set.values_list('options_inner', 'user_id', 'user_secret', 'ranking'))
+    poll.vote_set.all().delete()
+    poll.completevote_set.all().delete()
+
+
 class DistributedPoll(models.Model):
     name = models.CharField(max_length=50, unique=True, null=False)
+    # Set while main.bulk.purge_distributed_poll removes the poll, which hides it from dpoll and blocksearch.
+    deleting = models.BooleanField(default=False)
+    purge_total = models.PositiveIntegerField(default=0)
+    purge_done = models.PositiveIntegerField(default=0)
+
+    def sample_blocks(self, count: int) -> List["Block"]:
+        """Pick ``count`` blocks, least answered first and at random among blocks with the same number of responses.
+
+        Each step is one seek on the ``(poll, response_count, id)`` index: the lowest count not yet taken, the id range
+        of the blocks sharing it and then the first block at or after a random id in that range, wrapping around to
+        the start. Nothing is counted or skipped over, so the cost does not grow with the number of blocks. A block
+        following a gap in the ids is picked a little more often than the rest.
+        """
+        blocks = self.block_set.order_by('response_count', 'id')
+        chosen: List[Block] = []
+        floor = -1
+        while len(chosen) < count:
+            tier = blocks.filter(response_count__gt=floor).values_list('response_count', flat=True).first()
+            if tier is None:
+                break
+            in_tier = blocks.filter(response_count=tier)
+            bounds = in_tier.aggregate(low=models.Min('id'), high=models.Max('id'))
+            taken: List[int] = []
+            while len(chosen) < count:
+                remaining = in_tier.exclude(id__in=taken)
+                block = remaining.filter(id__gte=random.randint(bounds['low'], bounds['high'])).first() \
+                    or remaining.first()
+                if block is None:
+                    break
+                taken.append(block.pk)
+                chosen.append(block)
+            floor = tier
+        return chosen
+
+    def search_blocks(self, query: str, limit: int) -> List["Block"]:
+        """Blocks whose name or question text contains words starting with each word of ``query``, best match first.
+
+        Both match against the GIN indexed ``search_vector`` columns, the ranking only runs over matching blocks.
+        """
+        search = search_query(query)
+        if search is None:
+            return []
+        matching_questions = Question.objects.filter(block__poll=self, search_vector=search)
+        question_rank = Question.objects.filter(block=models.OuterRef('pk'), search_vector=search) \
+            .annotate(rank=SearchRank(models.F('search_vector'), search)).order_by('-rank').values('rank')[:1]
+        return list(self.block_set
+                    .filter(models.Q(search_vector=search)
+                            | models.Q(pk__in=matching_questions.values('block_id')))
+                    .annotate(rank=Greatest(SearchRank(models.F('search_vector'), search),
+                                            Coalesce(models.Subquery(question_rank), 0.0),
+                                            output_field=models.FloatField()))
+                    .order_by('-rank', 'name')[:limit])
+
+
+SEARCH_CONFIG = 'simple'
+
+
+def search_vector(text: str) -> SearchVector:
+    return SearchVector(models.Value(text, output_field=models.TextField()), config=SEARCH_CONFIG)
+
+
+def search_query(query: str) -> Optional[SearchQuery]:
+    # Every word has to match the start of a word, so partial words typed into Slack still find their block.
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f"{word}:*" for word in words), config=SEARCH_CONFIG, search_type='raw')
 
 
 class Block(models.Model):
     name = models.CharField(max_length=100, null=False)
-    poll = models.ForeignKey(DistributedPoll, on_delete=models.CASCADE, null=False)
+    # Lookups by poll use the (poll, response_count, id) index.
+    poll = models.ForeignKey(DistributedPoll, on_delete=models.CASCADE, null=False, db_index=False)
+    # Kept up to date by Response.save and Response.delete so dpoll can favour the least answered blocks.
+    response_count = models.PositiveIntegerField(default=0)
+    search_vector = SearchVectorField(null=True)
+
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        self.search_vector = search_vector(self.name)
+        super().save(*args, **kwargs)
 
     class Meta:
         ordering = ['name']
         indexes = [
-            models.Index(fields=['poll'])
+            models.Index(fields=['poll', 'response_count', 'id']),
+            GinIndex(fields=['search_vector'])
         ]
 
 
@@ -266,6 +593,7 @@ class Question(models.Model):
     question = models.CharField(max_length=200, null=False)
     options = ArrayField(models.CharField(max_length=50), null=False, size=99)
     id = models.CharField(max_length=4, default=None, blank=True, primary_key=True)  # noqa: A003
+    search_vector = SearchVectorField(null=True)
 
     # Code courtesy of https://stackoverflow.com/a/37359808
     # Sample of an ID generator - could be any string/number generator
@@ -280,34 +608,115 @@ class Question(models.Model):
             self.id = self.id_generator()
             while Question.objects.filter(id=self.id).exists():
                 self.id = self.id_generator()
+        self.search_vector = search_vector(self.question)
         super(Question, self).save(*args, **kwargs)
 
-    @property
+    @cached_property
     def responses(self) -> List[List[str]]:
         votes: List[List[str]] = [[] for _ in self.options]
-        for response in self.response_set.all():
-            votes[response.option].append(response.user.name)
+        for option, name in self.response_set.values_list('option', 'user__name'):
+            votes[option].append(name)
         return votes
 
     class Meta:
         indexes = [
-            models.Index(fields=["block"])
+            GinIndex(fields=["search_vector"])
         ]
 
 
 class Response(models.Model):
-    question = models.ForeignKey(Question, on_delete=models.CASCADE, null=False)
+    # Lookups by question use the (question, user) index.
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, null=False, db_index=False)
     option = models.IntegerField(null=False)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    # Lookups by user, including the paginated history, use the (user, id) index. Protected since a cascade would
+    # drop the user's choices from the tallies without a vote event.
+    user = models.ForeignKey(User, on_delete=models.PROTECT, null=False, db_index=False)
 
     @property
     def chosen_option(self) -> str:
         return self.question.options[self.option]
 
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                count_response(self.question_id, 1)
+                VoteEvent.objects.create(kind=VoteEvent.RESPONSE, question_id=self.question_id, user_id=self.user_id,
+                                         option=self.option, delta=1)
+
+    def delete(self, *args: Any, **kwargs: Any) -> Any:
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            if result[0]:
+                count_response(self.question_id, -1)
+                VoteEvent.objects.create(kind=VoteEvent.RESPONSE, question_id=self.question_id, user_id=self.user_id,
+                                         option=self.option, delta=-1)
+        return result
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['question', 'option', 'user'], name='Single Response Copy')
         ]
         indexes = [
-            models.Index(fields=["question"])
+            models.Index(fields=["question", "user"]),
+            models.Index(fields=["user", "id"]),
         ]
+
+
+def count_response(question_id: Any, change: int) -> None:
+    Block.objects.filter(question__id=question_id).update(response_count=models.F('response_count') + change)
+
+
+def load_block_questions(blocks: List[Block]) -> Dict[Any, List[Question]]:
+    """Questions of each block with their ``responses`` already filled in, in two queries however many there are."""
+    questions: Dict[Any, List[Question]] = {block.pk: [] for block in blocks}
+    by_id: Dict[str, Question] = {}
+    for question in Question.objects.filter(block__in=blocks):
+        question.__dict__['responses'] = [[] for _ in question.options]
+        questions[question.block_id].append(question)
+        by_id[question.pk] = question
+    for question_id, option, name in Response.objects.filter(question__block__in=blocks) \
+            .values_list('question_id', 'option', 'user__name'):
+        by_id[question_id].responses[option].append(name)
+    return questions
+
+
+class VoteEvent(models.Model):
+    """One append-only change to a tally: ``delta`` is +1 when ``user`` picked ``option`` and -1 when they dropped it.
+
+    Button votes and ballots are recorded against their poll, distributed poll responses against their question.
+    The relations are not constrained so the log outlives the rows it describes.
+    """
+    VOTE, BALLOT, RESPONSE = 1, 2, 3
+    KINDS = ((VOTE, 'vote'), (BALLOT, 'ballot'), (RESPONSE, 'response'))
+
+    id = models.BigAutoField(primary_key=True)  # noqa: A003
+    poll = models.ForeignKey(Poll, on_delete=models.DO_NOTHING, db_constraint=False, null=True, db_index=False)
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+                                 db_index=False)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False)
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+    option = models.SmallIntegerField()
+    delta = models.SmallIntegerField()
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Replaying the tail after a snapshot seeks on these.
+        indexes = [models.Index(fields=['poll', 'id']), models.Index(fields=['question', 'id'])]
+
+
+class TallySnapshot(models.Model):
+    """Per option counts of a poll or question after every event up to ``last_event``, all older than ``covers``.
+
+    Unconstrained like the events, so bulk deletes of questions never have to look at snapshots.
+    """
+    poll = models.ForeignKey(Poll, on_delete=models.DO_NOTHING, db_constraint=False, null=True, db_index=False)
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+                                 db_index=False)
+    last_event = models.BigIntegerField()
+    counts = ArrayField(models.IntegerField())
+    covers = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['poll', 'last_event']), models.Index(fields=['question', 'last_event'])]
@@ -0,0 +1,139 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+from main import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_X_POLLS_PROFILE'
+SALT = 'main.profiling'
+
+_state = threading.local()
+
+
+def make_token() -> str:
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def token_is_valid(token: str) -> bool:
+    try:
+        return signing.TimestampSigner(salt=SALT).unsign(token, max_age=settings.POLLS_PROFILE_TOKEN_MAX_AGE) \
+            == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+class RequestProfile:
+    def __init__(self, request: HttpRequest):
+        self.method = request.method
+        self.path = request.path
+        self.started = time.time()
+        self.profiler = cProfile.Profile()
+        self.queries: List[Dict[str, Any]] = []
+        self.slack: List[Dict[str, Any]] = []
+
+    def record_query(self, execute: Callable, sql: str, params: Any, many: bool, context: Dict) -> Any:
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'seconds': time.perf_counter() - start})
+
+    def summary(self, status: int, seconds: float) -> Dict[str, Any]:
+        return {
+            'method': self.method,
+            'path': self.path,
+            'status': status,
+            'started': self.started,
+            'seconds': seconds,
+            'sql_seconds': sum(query['seconds'] for query in self.queries),
+            'slack_seconds': sum(call['seconds'] for call in self.slack),
+            'queries': self.queries,
+            'slack': self.slack,
+        }
+
+
+def record_slack(method: str, channel: Optional[str], status: int, seconds: float) -> None:
+    """Note an outbound Slack call against the request being profiled on this thread, if any."""
+    profile = getattr(_state, 'profile', None)
+    if profile is not None:
+        profile.slack.append({'method': method, 'channel': channel, 'status': status, 'seconds': seconds})
+
+
+def profile_paths(directory: str) -> List[str]:
+    """Saved profiles, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.prof'))
+
+
+def save(profile: RequestProfile, summary: Dict[str, Any]) -> str:
+    directory = settings.POLLS_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    slug = profile.path.strip('/').replace('/', '_')[:60] or 'root'
+    base = os.path.join(directory, f"{time.time_ns():020d}-{os.getpid()}-{slug}")
+    # Standard pstats data next to a JSON sidecar with the SQL and Slack timings.
+    profile.profiler.dump_stats(base + '.prof')
+    with open(base + '.json', 'w') as sidecar:
+        json.dump(summary, sidecar)
+    for old in profile_paths(directory)[:-settings.POLLS_PROFILE_KEEP]:
+        for path in (old, old[:-len('.prof')] + '.json'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return base + '.prof'
+
+
+class ProfilingMiddleware:
+    """Profile the sampled requests and those carrying a signed ``X-Polls-Profile`` header.
+
+    A profiled request runs under cProfile with every query on the default database and every Slack call timed, the
+    result goes to the ring buffer in ``POLLS_PROFILE_DIR``. Other requests only pay for one header lookup and one
+    random number.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def wanted(self, request: HttpRequest) -> bool:
+        token = request.META.get(HEADER)
+        if token is not None:
+            return token_is_valid(token)
+        rate = settings.POLLS_PROFILE_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if not self.wanted(request):
+            return self.get_response(request)
+        profile = RequestProfile(request)
+        _state.profile = profile
+        start = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(profile.record_query):
+                profile.profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profile.profiler.disable()
+        finally:
+            _state.profile = None
+        seconds = time.perf_counter() - start
+        try:
+            path = save(profile, profile.summary(response.status_code, seconds))
+            metrics.increment('profiling.saved')
+            response['X-Polls-Profile-Id'] = os.path.basename(path)
+        except OSError:
+            logger.warning("Could not save the profile of %s", request.path, exc_info=True)
+        return response
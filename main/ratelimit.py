@@ -0,0 +1,114 @@
+import contextlib
+import logging
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpRequest, HttpResponse
+
+from main import metrics
+from main.models import SlackRateBucket
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+
+class RateLimited(Exception):
+    """A Slack call that would have to wait longer than this thread may, nothing was taken from the bucket."""
+
+    def __init__(self, method: str, retry_after: float):
+        super().__init__(f"Slack {method} is rate limited for another {retry_after:.1f} seconds")
+        self.retry_after = retry_after
+
+
+# Takes one token in a single statement: refill for the time elapsed on the database clock, capped at the burst, then
+# subtract one. A negative balance is a reservation, the caller waits until the refill covers it.
+TAKE = """
+INSERT INTO {table} (key, tokens, updated)
+VALUES (%(key)s, %(burst)s - 1, EXTRACT(EPOCH FROM clock_timestamp()))
+ON CONFLICT (key) DO UPDATE SET
+    tokens = LEAST(%(burst)s, {table}.tokens
+                   + (EXTRACT(EPOCH FROM clock_timestamp()) - {table}.updated) * %(rate)s) - 1,
+    updated = EXTRACT(EPOCH FROM clock_timestamp())
+RETURNING tokens
+"""
+
+REFUND = "UPDATE {table} SET tokens = tokens + 1 WHERE key = %(key)s"
+
+
+def patience() -> float:
+    """Longest this thread sleeps for a bucket: request threads barely wait, background work up to the maximum."""
+    return getattr(_state, 'patience', settings.POLLS_SLACK_RATE_LIMIT_REQUEST_WAIT)
+
+
+def is_patient() -> bool:
+    return hasattr(_state, 'patience')
+
+
+@contextlib.contextmanager
+def patient(seconds: Optional[float] = None) -> Iterator[None]:
+    """Let Slack calls made in this thread wait up to ``seconds``, ``POLLS_SLACK_RATE_LIMIT_MAX_WAIT`` by default."""
+    previous = getattr(_state, 'patience', None)
+    _state.patience = settings.POLLS_SLACK_RATE_LIMIT_MAX_WAIT if seconds is None else seconds
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _state.patience
+        else:
+            _state.patience = previous
+
+
+def reserve(method: str, channel: Optional[str], max_wait: float) -> float:
+    """Take a token for ``method`` in ``channel`` and return how many seconds to wait before using it.
+
+    Raises RateLimited when that is more than ``max_wait``, after handing the token back so the bucket never falls
+    further behind than callers are willing to wait.
+    """
+    policy = settings.POLLS_SLACK_RATE_LIMITS.get(method)
+    if policy is None:
+        return 0.0
+    rate, burst = policy
+    params = {'key': f"{method}:{channel or ''}", 'rate': rate, 'burst': burst}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(TAKE.format(table=SlackRateBucket._meta.db_table), params)
+        wait = max(0.0, -cursor.fetchone()[0] / rate)
+        if wait > max_wait:
+            cursor.execute(REFUND.format(table=SlackRateBucket._meta.db_table), params)
+            raise RateLimited(method, wait)
+    return wait
+
+
+def acquire(method: str, channel: Optional[str]) -> None:
+    metrics.increment(f'slack.ratelimit.{method}.calls')
+    try:
+        wait = reserve(method, channel, patience())
+    except RateLimited as e:
+        logger.warning("Slack %s bucket for %s is %.1f seconds behind, not waiting", method, channel, e.retry_after)
+        metrics.increment(f'slack.ratelimit.{method}.rejected')
+        raise
+    if wait <= 0:
+        return
+    metrics.increment(f'slack.ratelimit.{method}.waits')
+    metrics.increment(f'slack.ratelimit.{method}.wait_seconds', wait)
+    time.sleep(wait)
+
+
+class RateLimitedMiddleware:
+    """Answer 503 with a Retry-After header when a request gave up on a Slack bucket instead of sleeping for it."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        return self.get_response(request)
+
+    def process_exception(self, request: HttpRequest, exception: Exception) -> Optional[HttpResponse]:
+        if not isinstance(exception, RateLimited):
+            return None
+        response = HttpResponse(f"{exception}, try again shortly.", status=503, content_type='text/plain')
+        response['Retry-After'] = str(int(exception.retry_after) + 1)
+        return response
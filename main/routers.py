@@ -0,0 +1,63 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Iterator, Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+REPLICA = 'replica'
+PRIMARY_COOKIE = 'polls_primary_until'
+
+_state = threading.local()
+
+
+@contextmanager
+def replica_reads(enabled: bool = True) -> Iterator[None]:
+    previous = getattr(_state, 'replica', False)
+    _state.replica = enabled
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def is_pinned(request: HttpRequest) -> bool:
+    try:
+        return float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_to_primary(response: HttpResponse) -> HttpResponse:
+    # Reads stay on the primary for a short while after a user's own write so they always see their vote.
+    seconds = settings.POLLS_REPLICA_STICKY_SECONDS
+    response.set_cookie(PRIMARY_COOKIE, f"{time.time() + seconds:.0f}", max_age=seconds)
+    return response
+
+
+def read_only(view: Callable[..., HttpResponse]) -> Callable[..., HttpResponse]:
+    @wraps(view)
+    def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        with replica_reads(not is_pinned(request)):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """Send reads made inside ``replica_reads`` to the replica when one is configured, everything else to default."""
+
+    def db_for_read(self, model: Any, **hints: Any) -> Optional[str]:
+        if getattr(_state, 'replica', False) and REPLICA in settings.DATABASES:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model: Any, **hints: Any) -> Optional[str]:
+        return 'default'
+
+    def allow_relation(self, obj1: Any, obj2: Any, **hints: Any) -> Optional[bool]:
+        return True
+
+    def allow_migrate(self, db: str, app_label: str, model_name: Optional[str] = None, **hints: Any) -> Optional[bool]:
+        return db == 'default'
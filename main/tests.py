@@ -1,8 +1,65 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import tempfile
+import threading
+import tracemalloc
+from unittest import mock
+
+import elasticapm
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection
+from django.db.models import ProtectedError
+from django.http import HttpResponse
+from django.test import override_settings, RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+
+from main import apm, background, condorcet, events, export, ingest, live, metrics, profiling, ratelimit, warmup
+from main import views
+from main.fakeslack import FakeSlack
+from main.live import ResultsHub
+from main.loadtest import percentile
+from main.logs import PAYLOAD, PayloadSampler, QueuedHandler
+from main.models import ArchivedCompleteVote, ArchivedVote, Block, CompleteVote, DistributedPoll, PairwiseMatrix, \
+    Poll, PollSnapshot, Question, Response, TallySnapshot, User, Vote, VoteEvent
+from main.routers import pin_to_primary, PrimaryReplicaRouter, read_only, replica_reads
 
 # Create your tests here.
 
 
+class SlackStubMixin:
+    def setUp(self):
+        super().setUp()
+        # The rate limiter and the shared render cache are exercised on their own, stubbed calls go out immediately
+        # and their query counts leave out the render cache table.
+        limits = override_settings(POLLS_SLACK_RATE_LIMITS={}, CACHES={
+            'default': settings.CACHES['default'],
+            'slack_render': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        })
+        limits.enable()
+        self.addCleanup(limits.disable)
+        patcher = mock.patch('main.views.requests.post')
+        self.slack_post = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.slack_ts = iter(f"1557457622.{i:06d}" for i in range(1, 1000000))
+        self.slack_post.return_value.json.side_effect = lambda: {'ok': True, 'ts': next(self.slack_ts)}
+        self.slack_post.return_value.status_code = 200
+
+    def button(self, poll, option, user='alice'):
+        payload = {'callback_id': 'options', 'actions': [{'name': 'option', 'value': option}],
+                   'original_message': {'ts': poll.timestamp_str}, 'user': {'name': user}, 'token': ''}
+        return self.client.post('/interactive_button/', {'payload': json.dumps(payload)})
+
+
 class MainViewsTestCase(TestCase):
     def test_index(self):
         resp = self.client.get("/")
@@ -15,3 +72,998 @@ class MainViewsTestCase(TestCase):
 
         resp = self.client.post("/poll/")
         self.assertEqual(resp.status_code, 400)
+
+    def test_metrics(self):
+        resp = self.client.get("/status/metrics/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsInstance(resp.json(), dict)
+
+
+class LoggingPipelineTestCase(SimpleTestCase):
+    def test_full_queue_drops_and_counts(self):
+        handler = QueuedHandler('logging.NullHandler', queue_size=1)
+        handler.stop()
+        before = metrics.snapshot().get('logging.dropped', 0)
+        record = logging.LogRecord('main.views', logging.INFO, __file__, 1, 'Payload: %s', ({'a': 1},), None)
+        handler.handle(record)
+        handler.handle(record)
+        self.assertEqual(metrics.snapshot()['logging.dropped'] - before, 1)
+        self.assertEqual(handler.queue.get_nowait().msg, "Payload: {'a': 1}")
+        handler.close()
+
+    def test_payload_sampler(self):
+        sampler = PayloadSampler(rate=0.0, rates={'main.models': 1.0})
+        payload = logging.makeLogRecord(dict(name='main.views', msg='Payload', **PAYLOAD))
+        plain = logging.makeLogRecord({'name': 'main.views', 'msg': 'Poll not found'})
+        kept = logging.makeLogRecord(dict(name='main.models', msg='Payload', **PAYLOAD))
+        self.assertFalse(sampler.filter(payload))
+        self.assertTrue(sampler.filter(plain))
+        self.assertTrue(sampler.filter(kept))
+
+
+class RecordingApmClient(elasticapm.Client):
+    def __init__(self, **config):
+        self.events = []
+        super().__init__(service_name='polls-test', central_config=False, disable_send=True, metrics_interval='0ms',
+                         transaction_sample_rate=1.0, **config)
+
+    def queue(self, event_type, data, flush=False):
+        self.events.append((event_type, data))
+
+
+@override_settings(POLLS_SLACK_RATE_LIMITS={})
+class ApmTestCase(SimpleTestCase):
+    def test_disabled_without_server(self):
+        self.assertFalse(apm.ENABLED)
+        self.assertIs(apm.span('Poll.votes', poll='1'), apm.NO_SPAN)
+        self.assertIs(apm.background_transaction('refresh_poll'), apm.NO_SPAN)
+        with apm.span('Poll.votes') as span:
+            span.label(voters=1)
+        # Call sites do not even build a span's name and labels.
+        with mock.patch.object(apm, 'span') as span, mock.patch('main.views.requests.post') as post:
+            post.return_value.status_code = 200
+            views.call_slack('https://slack.com/api/chat.update', json={'channel': 'C1'})
+        span.assert_not_called()
+
+    @mock.patch('main.views.requests.post')
+    def test_background_tasks_get_labelled_spans(self, post):
+        post.return_value.status_code = 200
+        client = RecordingApmClient()
+        self.addCleanup(client.close)
+
+        def task():
+            views.call_slack('https://slack.com/api/chat.update', json={'channel': 'C1'})
+            with apm.span('Poll.votes', 'app', 'tally', poll='1557457622.000001') as span:
+                span.label(voters=3)
+            raise ValueError()
+
+        with mock.patch.object(apm, 'ENABLED', True), mock.patch.object(apm, 'get_client', return_value=client), \
+                self.assertLogs('main.background', logging.ERROR):
+            background.run(task)
+        spans = {data['name']: data for kind, data in client.events if kind == 'span'}
+        self.assertEqual(spans['Slack chat.update']['context']['tags'],
+                         {'slack_method': 'chat.update', 'channel': 'C1', 'status': 200, 'attempts': 1})
+        self.assertEqual(spans['Poll.votes']['context']['tags'], {'poll': '1557457622.000001', 'voters': 3})
+        transaction, = [data for kind, data in client.events if kind == 'transaction']
+        self.assertEqual((transaction['name'], transaction['result']), ('task', 'failure'))
+
+
+@override_settings(POLLS_SLACK_RATE_LIMITS={})
+class RenderCacheTestCase(TestCase):
+    def setUp(self):
+        caches['slack_render'].clear()
+
+    @mock.patch('main.views.requests.post')
+    def test_identical_update_is_skipped(self, post):
+        post.return_value.json.return_value = {'ok': True, 'ts': '1557457622.123456'}
+        attachments = views.format_attachments(['a', 'b'])
+        ts = views.post_message('C1', views.format_text('q', ['a', 'b'], [[], []], ''), attachments)
+        views.update_message('C1', ts, views.format_text('q', ['a', 'b'], [[], []], ''), attachments)
+        self.assertEqual(post.call_count, 1)
+        views.update_message('C1', ts, views.format_text('q', ['a', 'b'], [['x'], []], ''), attachments)
+        self.assertEqual(post.call_count, 2)
+        views.update_message('C1', ts, views.format_text('q', ['a', 'b'], [['x'], []], ''), attachments)
+        self.assertEqual(post.call_count, 2)
+
+    @mock.patch('main.views.requests.post')
+    def test_new_poll_is_posted_once_with_its_link(self, post):
+        post.return_value.status_code = 200
+        post.return_value.json.return_value = {'ok': True, 'ts': '1557457622.123456'}
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza'], ranked=True)
+        poll.save()
+        # The message already links to the poll, so the update Poll.save sends is skipped.
+        self.assertEqual(post.call_count, 1)
+        self.assertIn(f'/p/{poll.link}/', post.call_args[1]['json']['text'])
+        self.assertRedirects(self.client.get(f'/p/{poll.link}/results'), f'/polls/{poll.timestamp_str}/results',
+                             fetch_redirect_response=False)
+        Vote.objects.create(poll=poll, option=1, user=User.objects.create(name='alice'))
+        poll.update_poll()
+        self.assertEqual(post.call_count, 2)
+
+    def test_only_the_last_render_from_any_worker_is_skipped(self):
+        views.remember_render('C1', '1.0', 'X', None)
+        # Another worker sent Y since, X has to go out again.
+        views.remember_render('C1', '1.0', 'Y', None)
+        self.assertFalse(views.is_rendered('C1', '1.0', 'X', None))
+        self.assertTrue(views.is_rendered('C1', '1.0', 'Y', None))
+        with override_settings(CACHES={'slack_render': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            views.remember_render('C1', '1.0', 'Y', None)
+            self.assertFalse(views.is_rendered('C1', '1.0', 'Y', None))
+
+    def test_attachments_are_memoized(self):
+        self.assertIs(views.format_attachments(['a', 'b']), views.format_attachments(['a', 'b']))
+
+
+class CompactRenderTestCase(SimpleTestCase):
+    @override_settings(POLLS_COMPACT_RENDER_THRESHOLD=3, POLLS_COMPACT_RENDER_VOTERS_SHOWN=2)
+    def test_large_polls_are_truncated(self):
+        text = views.format_text('q', ['a', 'b'], [['u1', 'u2', 'u3', 'u4'], ['u5']], 'https://host/polls/1.5/')
+        self.assertIn('(4) a @u1, @u2 +2 more\n', text)
+        self.assertIn('(1) b @u5\n', text)
+        self.assertIn('Full results: https://host/polls/1.5/results', text)
+
+    @override_settings(POLLS_COMPACT_RENDER_THRESHOLD=10)
+    def test_small_polls_list_everyone(self):
+        text = views.format_text('q', ['a'], [['u1', 'u2', 'u3']], 'https://host/polls/1.5/')
+        self.assertEqual(text, '*q*\nhttps://host/polls/1.5/\n(3) a @u1, @u2, @u3\n')
+
+
+class ReplicaRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.databases = dict(settings.DATABASES, replica=dict(settings.DATABASES['default']))
+
+    def test_without_replica_everything_uses_default(self):
+        with override_settings(DATABASES={'default': settings.DATABASES['default']}), replica_reads():
+            self.assertEqual(self.router.db_for_read(Poll), 'default')
+
+    def test_read_only_views_use_replica_until_pinned(self):
+        seen = []
+
+        @read_only
+        def view(request):
+            seen.append(self.router.db_for_read(Poll))
+            self.assertEqual(self.router.db_for_write(Poll), 'default')
+            return HttpResponse()
+
+        with override_settings(DATABASES=self.databases):
+            request = RequestFactory().get('/polls/1.5/results')
+            view(request)
+            cookies = pin_to_primary(HttpResponse()).cookies
+            request.COOKIES.update({name: morsel.value for name, morsel in cookies.items()})
+            view(request)
+            self.assertEqual(self.router.db_for_read(Poll), 'default')
+        self.assertEqual(seen, ['replica', 'default'])
+
+
+class PollClosingTestCase(SlackStubMixin, TestCase):
+    def test_closed_poll_serves_snapshot_and_rejects_votes(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza'])
+        poll.save()
+        self.button(poll, 'Tacos')
+        url = f'/polls/{poll.timestamp_str}/close'
+        with mock.patch.dict(os.environ, {'POLLS_SLACK_VERIFIER': 'secret'}):
+            resp = self.client.post(url, json.dumps({'archive': True}), content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        for body in ('{"archive": tru', '[true]'):
+            self.assertEqual(self.client.post(f'{url}?token=', body, content_type='application/json').status_code, 400)
+        self.assertFalse(Poll.objects.get(pk=poll.pk).is_closed)
+        resp = self.client.post(f'{url}?token=', json.dumps({'archive': True}), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        poll = Poll.objects.get(pk=poll.pk)
+        self.assertTrue(poll.is_closed)
+        self.assertEqual(poll.votes, [['alice'], []])
+        self.assertEqual(Vote.objects.count(), 0)
+        self.assertEqual(ArchivedVote.objects.count(), 1)
+
+        self.button(poll, 'Pizza', 'bob')
+        self.assertFalse(User.objects.filter(name='bob').exists())
+        self.assertEqual(Poll.objects.get(pk=poll.pk).votes, [['alice'], []])
+
+    def test_closes_at_needs_a_valid_aware_datetime(self):
+        for closes_at in ('2019-13-45T00:00:00+00:00', '2019-05-10T12:00:00', 'tomorrow'):
+            resp = self.client.post('/polls/', json.dumps({'question': 'Lunch?', 'options': ['Tacos'],
+                                                           'closes_at': closes_at}), content_type='application/json')
+            self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Poll.objects.exists())
+
+    def test_archived_ballots_keep_their_ranking(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza', 'Sushi'], ranked=True)
+        poll.save()
+        CompleteVote.objects.create(poll=poll, user=User.objects.create(name='alice'),
+                                    options_inner=[True, True, True] + [False] * 96, ranking=[3, 1, 2] + [0] * 96)
+        poll.close(archive=True)
+        self.assertFalse(CompleteVote.objects.exists())
+        self.assertEqual(ArchivedCompleteVote.objects.get().ranking[:3], [3, 1, 2])
+        record, = export.poll_records([Poll.objects.get(pk=poll.pk)])
+        self.assertEqual(record['ballots'], [{'user': 'alice', 'options': ['Tacos', 'Pizza', 'Sushi'],
+                                              'ranking': ['Pizza', 'Sushi', 'Tacos']}])
+
+    @mock.patch('main.models.transaction.on_commit')
+    def test_close_keeps_concurrent_changes_and_updates_slack_after_commit(self, on_commit):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos'])
+        poll.save()
+        stale = Poll.objects.get(pk=poll.pk)
+        Poll.objects.filter(pk=poll.pk).update(options=['Tacos', 'Pizza'])
+        self.slack_post.reset_mock()
+        stale.close()
+        self.assertEqual((stale.options, stale.is_closed), (['Tacos', 'Pizza'], True))
+        self.assertIn('Pizza', PollSnapshot.objects.get(poll=poll).text)
+        self.assertEqual(self.slack_post.call_count, 0)
+        on_commit.call_args[0][0]()
+        self.assertIn('This poll is closed', self.slack_post.call_args[1]['json']['text'])
+
+    def test_due_poll_closes_on_next_click(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos'],
+                    closes_at=timezone.now() - datetime.timedelta(minutes=1))
+        poll.save()
+        self.button(poll, 'Tacos')
+        self.assertTrue(Poll.objects.get(pk=poll.pk).is_closed)
+        self.assertEqual(Vote.objects.count(), 0)
+
+
+class ResultsJsonTestCase(SlackStubMixin, TestCase):
+    def test_conditional_get(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza'])
+        poll.save()
+        self.button(poll, 'Pizza')
+        url = f'/polls/{poll.timestamp_str}/results.json'
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['options'][1], {'option': 'Pizza', 'count': 1, 'voters': ['alice']})
+        etag = resp['ETag']
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.button(poll, 'Tacos', 'bob')
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+
+
+class ResultsHubTestCase(SlackStubMixin, TestCase):
+    def test_watchers_share_one_computation(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos'])
+        poll.save()
+        hub = ResultsHub(interval=0)
+        hub.subscribe(poll.timestamp_str)
+        hub.subscribe(poll.timestamp_str)
+        with mock.patch('main.views.results_payload', wraps=views.results_payload) as payload:
+            hub.refresh()
+            hub.refresh()
+            self.assertEqual(payload.call_count, 1)
+            first = hub.wait(poll.timestamp_str, None, 0)
+            self.assertIs(hub.wait(poll.timestamp_str, None, 0), first)
+            self.assertIsNone(hub.wait(poll.timestamp_str, first[0], 0))
+
+            self.button(poll, 'Tacos')
+            hub.refresh()
+            self.assertEqual(payload.call_count, 2)
+        version, data = hub.wait(poll.timestamp_str, first[0], 0)
+        self.assertEqual(json.loads(data)['options'][0]['voters'], ['alice'])
+
+    def test_streams_beyond_the_cap_are_turned_away(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos'])
+        poll.save()
+        url = f'/polls/{poll.timestamp_str}/results/stream'
+        with mock.patch.object(live, 'hub', ResultsHub(interval=0, max_streams=1)):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            second = self.client.get(url)
+            self.assertEqual((second.status_code, second['Retry-After']), (503, '15'))
+            # Closing the response ends the stream, without the request_finished handler closing the test connection.
+            request_finished.disconnect(close_old_connections)
+            try:
+                first.close()
+            finally:
+                request_finished.connect(close_old_connections)
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class BulkImportTestCase(SlackStubMixin, TestCase):
+    def test_import_votes_and_ballots(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza'])
+        poll.save()
+        CompleteVote.objects.create(poll=poll, user=User.objects.create(name='carol'), user_secret='old',
+                                    options_inner=[True] + [False] * 98)
+        self.slack_post.reset_mock()
+        body = {
+            'votes': [{'user': f'user{i}', 'option': 'Tacos'} for i in range(500)] + [{'user': 'x', 'option': 'Sushi'}],
+            'ballots': [{'user': 'bob', 'options': ['Pizza'], 'secret': 'abc'},
+                        {'user': 'carol', 'options': ['Pizza'], 'secret': 'wrong'}]
+        }
+        with self.assertNumQueries(12):
+            resp = self.client.post(f'/polls/{poll.timestamp_str}/import?token=', json.dumps(body),
+                                    content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        result = resp.json()
+        self.assertEqual((result['votes'], result['ballots']), (500, 1))
+        self.assertEqual([(e['kind'], e['index']) for e in result['errors']], [('ballot', 1), ('vote', 500)])
+        self.assertEqual(self.slack_post.call_count, 1)
+        votes = Poll.objects.get(pk=poll.pk).votes
+        self.assertEqual((len(votes[0]), votes[1]), (501, ['bob']))
+
+        # Votes already there are not counted again, malformed bodies and rows are turned away.
+        body = {'votes': body['votes'][:3] + [{'user': 'dave', 'option': 'Pizza'}],
+                'ballots': [{'user': 'erin', 'options': ['Pizza'], 'secret': 12}]}
+        result = self.client.post(f'/polls/{poll.timestamp_str}/import?token=', json.dumps(body),
+                                  content_type='application/json').json()
+        self.assertEqual((result['votes'], result['ballots']), (1, 0))
+        self.assertEqual([(e['kind'], e['index']) for e in result['errors']], [('ballot', 0)])
+        resp = self.client.post(f'/polls/{poll.timestamp_str}/import?token=', '[]', content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        # Without the verification token nothing is imported.
+        body = {'votes': [{'user': 'mallory', 'option': 'Pizza'}]}
+        with mock.patch.dict(os.environ, {'POLLS_SLACK_VERIFIER': 'secret'}):
+            for url in (f'/polls/{poll.timestamp_str}/import', f'/polls/{poll.timestamp_str}/import?token=wrong'):
+                resp = self.client.post(url, json.dumps(body), content_type='application/json')
+                self.assertEqual(resp.status_code, 400)
+        self.assertFalse(User.objects.filter(name='mallory').exists())
+
+
+class VoteEventTestCase(SlackStubMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza'])
+        self.poll.save()
+
+    def respond(self, question, option, user='alice'):
+        payload = {'callback_id': f'qo_{question.pk}', 'actions': [{'name': f'qo_{question.pk}', 'value': option}],
+                   'original_message': {'ts': '1557457622.000001'}, 'channel': {'id': 'C1'}, 'user': {'name': user},
+                   'token': ''}
+        return self.client.post('/interactive_button/', {'payload': json.dumps(payload)})
+
+    def test_toggles_replay_from_snapshots(self):
+        for option, user in (('Tacos', 'alice'), ('Tacos', 'bob'), ('Tacos', 'alice'), ('Pizza', 'bob')):
+            self.button(self.poll, option, user)
+        self.assertEqual(list(VoteEvent.objects.order_by('id').values_list('option', 'delta')),
+                         [(0, 1), (0, 1), (0, -1), (1, 1)])
+        target = events.target_of(self.poll)
+        self.assertEqual(events.rebuild(target, 2)[0], [1, 1])
+        self.assertEqual(events.take_snapshots(), 0)
+        self.assertEqual(events.take_snapshots(timezone.now() + datetime.timedelta(hours=1)), 1)
+        snapshot = TallySnapshot.objects.get(poll=self.poll)
+        self.assertEqual((snapshot.counts, snapshot.last_event), ([1, 1], VoteEvent.objects.latest('id').pk))
+
+        self.button(self.poll, 'Pizza', 'carol')
+        last = VoteEvent.objects.latest('id').pk
+        with self.assertNumQueries(2):
+            self.assertEqual(events.rebuild(target, 2), ([1, 2], last))
+        self.assertEqual(events.rebuild(target, 2, at=snapshot.covers)[0], [1, 1])
+        self.assertIsNone(events.verify(Poll.objects.get(pk=self.poll.pk)))
+        self.assertIsNone(events.verify(Poll.objects.get(pk=self.poll.pk), from_snapshot=False))
+        TallySnapshot.objects.update(counts=[5, 5])
+        self.assertEqual(events.verify(Poll.objects.get(pk=self.poll.pk)), ([5, 6], [1, 2]))
+
+    def test_only_the_removing_delete_is_logged(self):
+        user = User.objects.create(name='alice')
+        Vote.objects.create(poll=self.poll, option=0, user=user)
+        first, second = Vote.objects.get(), Vote.objects.get()
+        self.assertEqual(first.delete()[0], 1)
+        self.assertEqual(second.delete()[0], 0)
+        ballot = CompleteVote.objects.create(poll=self.poll, user=user, options_inner=[True, True] + [False] * 97)
+        ballot.options_inner = [False, True] + [False] * 97
+        ballot.save()
+        CompleteVote.objects.get().delete()
+        self.assertEqual(list(VoteEvent.objects.order_by('id').values_list('kind', 'option', 'delta')),
+                         [(VoteEvent.VOTE, 0, 1), (VoteEvent.VOTE, 0, -1), (VoteEvent.BALLOT, 0, 1),
+                          (VoteEvent.BALLOT, 1, 1), (VoteEvent.BALLOT, 0, -1), (VoteEvent.BALLOT, 1, -1)])
+        self.assertIsNone(events.verify(Poll.objects.get(pk=self.poll.pk)))
+        Vote.objects.create(poll=self.poll, option=1, user=user)
+        with self.assertRaises(ProtectedError):
+            user.delete()
+
+    @mock.patch('main.background.transaction.on_commit')
+    def test_ballots_imports_and_responses_are_logged(self, on_commit):
+        user = User.objects.create(name='alice')
+        data = {'_method': 'vote', 'user': user.pk, 'user_secret': 'abc', 'options': ['Tacos']}
+        self.client.post(f'/polls/{self.poll.timestamp_str}/vote', data)
+        data['options'] = ['Pizza']
+        self.client.post(f'/polls/{self.poll.timestamp_str}/vote', data)
+        body = {'votes': [{'user': 'bob', 'option': 'Tacos'}, {'user': 'bob', 'option': 'Tacos'}],
+                'ballots': [{'user': 'alice', 'options': ['Tacos', 'Pizza'], 'secret': 'abc'},
+                            {'user': 'carol', 'options': ['Pizza']}]}
+        url = f'/polls/{self.poll.timestamp_str}/import?token='
+        self.client.post(url, json.dumps(body), content_type='application/json')
+        self.client.post(url, json.dumps(body), content_type='application/json')
+        self.assertEqual(VoteEvent.objects.filter(kind=VoteEvent.VOTE).count(), 1)
+        self.assertEqual(events.rebuild(events.target_of(self.poll), 2)[0], [2, 2])
+        self.assertIsNone(events.verify(Poll.objects.get(pk=self.poll.pk)))
+
+        block = Block.objects.create(poll=DistributedPoll.objects.create(name='survey'), name='Block 0')
+        question = Question.objects.create(block=block, question='Tea?', options=['Yes', 'No'])
+        self.respond(question, 'No')
+        self.respond(question, 'No')
+        self.respond(question, 'Yes', 'bob')
+        self.assertEqual(list(VoteEvent.objects.filter(question=question).values_list('option', 'delta')),
+                         [(1, 1), (1, -1), (0, 1)])
+        self.assertIsNone(events.verify(question))
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.polls = Poll.objects.bulk_create([
+            Poll(timestamp=f'155745762{i}.000001', channel='C2' if i == 1 else 'C1', question=f'Lunch {i}?',
+                 options=['Tacos', 'Pizza'], ranked=i == 3) for i in range(5)])
+        alice, bob = User.objects.create(name='alice'), User.objects.create(name='bob')
+        Vote.objects.create(poll=self.polls[0], option=1, user=bob)
+        Vote.objects.create(poll=self.polls[0], option=0, user=alice)
+        CompleteVote.objects.bulk_create([CompleteVote(poll=self.polls[3], user=alice, options_inner=[True, True],
+                                                       ranking=[2, 1])])
+
+    def lines(self, **params):
+        resp = self.client.get('/export/', {'token': '', **params})
+        self.assertEqual(resp.status_code, 200)
+        return b''.join(resp.streaming_content).decode().splitlines()
+
+    @override_settings(POLLS_EXPORT_CHUNK_SIZE=2)
+    def test_jsonl_in_keyset_chunks(self):
+        with self.assertNumQueries(2 * 5 + 1):
+            records = [json.loads(line) for line in self.lines(channel='C1')]
+        self.assertEqual([r['question'] for r in records], ['Lunch 0?', 'Lunch 2?', 'Lunch 3?', 'Lunch 4?'])
+        self.assertEqual(records[0]['votes'], [{'user': 'alice', 'option': 'Tacos'},
+                                               {'user': 'bob', 'option': 'Pizza'}])
+        self.assertEqual(records[2]['ballots'], [{'user': 'alice', 'options': ['Tacos', 'Pizza'],
+                                                  'ranking': ['Pizza', 'Tacos']}])
+        resumed = [json.loads(line)['question'] for line in self.lines(channel='C1', after=records[1]['timestamp'])]
+        self.assertEqual(resumed, ['Lunch 3?', 'Lunch 4?'])
+        bounded = self.lines(since='2019-05-10T03:07:03+00:00', until='1557457624')
+        self.assertEqual([json.loads(line)['question'] for line in bounded], ['Lunch 3?'])
+
+    def test_csv_and_command(self):
+        rows = list(csv.reader(self.lines(format='csv', channel='C1', until='1557457624')))
+        self.assertEqual(rows[0], export.CSV_HEADER)
+        self.assertEqual([row[3:] for row in rows[1:]], [['vote', 'alice', 'Tacos', ''], ['vote', 'bob', 'Pizza', ''],
+                                                         ['', '', '', ''], ['ballot', 'alice', 'Tacos', '2'],
+                                                         ['ballot', 'alice', 'Pizza', '1']])
+        self.assertEqual(self.client.get('/export/', {'token': '', 'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/export/', {'token': '', 'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/export/').status_code, 400)
+        with mock.patch.dict(os.environ, {'POLLS_SLACK_VERIFIER': 'secret'}):
+            self.assertEqual(self.client.get('/export/', {'token': ''}).status_code, 400)
+            self.assertEqual(self.client.get('/export/', {'token': 'secret'}).status_code, 200)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'polls.jsonl')
+            call_command('export_polls', '--output', path, '--until', '1557457622')
+            call_command('export_polls', '--output', path, '--resume')
+            with open(path) as f:
+                self.assertEqual([json.loads(line)['question'] for line in f], [f'Lunch {i}?' for i in range(5)])
+
+    def test_resume_cuts_back_to_the_last_complete_poll(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # A record larger than any single block read, followed by one cut off mid-write.
+            path = os.path.join(directory, 'polls.jsonl')
+            with open(path, 'w') as f:
+                f.write(json.dumps({'timestamp': self.polls[2].timestamp_str, 'question': 'x' * 100000}) + '\n')
+                f.write('{"timestamp": "1557457623.000001", "quest')
+            call_command('export_polls', '--output', path, '--resume')
+            with open(path) as f:
+                self.assertEqual([json.loads(line)['question'][:7] for line in f], ['x' * 7, 'Lunch 3', 'Lunch 4'])
+
+            # The rows of the last poll may be incomplete, it is written again in full.
+            path = os.path.join(directory, 'polls.csv')
+            call_command('export_polls', '--output', path, '--format', 'csv')
+            with open(path, newline='') as f:
+                complete = f.read()
+            with open(path, 'w', newline='') as f:
+                f.write(complete[:complete.index('alice,Pizza')])
+            call_command('export_polls', '--output', path, '--format', 'csv', '--resume')
+            with open(path, newline='') as f:
+                self.assertEqual(f.read(), complete)
+
+
+class ListingTestCase(TestCase):
+    def test_channel_polls_pages(self):
+        Poll.objects.bulk_create([Poll(timestamp=f'15574576{i:02d}.000001', channel='C2' if i % 4 == 0 else 'C1',
+                                       question=f'Lunch {i}?', options=['Tacos']) for i in range(12)])
+        seen, after = [], None
+        while True:
+            with self.assertNumQueries(1):
+                page = self.client.get('/channels/C1/polls/', {'limit': 4, **({'after': after} if after else {})})
+            page = page.json()
+            seen += [poll['question'] for poll in page['polls']]
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual(seen, [f'Lunch {i}?' for i in range(12) if i % 4])
+        self.assertEqual(self.client.get('/channels/C1/polls/', {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/channels/C1/polls/', {'after': 'x'}).status_code, 400)
+        for bound in ('inf', 'nan', '1e20'):
+            self.assertEqual(self.client.get('/channels/C1/polls/', {'after': bound}).status_code, 400)
+            self.assertEqual(self.client.get('/export/', {'token': '', 'since': bound}).status_code, 400)
+        self.assertEqual(self.client.get('/export/', {'token': '', 'until': '0001-01-01T00:00:00+01:00'}).status_code,
+                         400)
+
+    def test_user_history_pages(self):
+        poll, = Poll.objects.bulk_create([Poll(timestamp='1557457622.000001', channel='C1', question='Lunch?',
+                                               options=['Tacos', 'Pizza', 'Sushi'], ranked=True)])
+        alice, bob = User.objects.create(name='alice.b'), User.objects.create(name='bob')
+        for option in range(3):
+            Vote.objects.create(poll=poll, option=option, user=alice)
+        Vote.objects.create(poll=poll, option=0, user=bob)
+        CompleteVote.objects.bulk_create([CompleteVote(poll=poll, user=alice, options_inner=[True, False, True],
+                                                       ranking=[2, 0, 1])])
+        block = Block.objects.create(poll=DistributedPoll.objects.create(name='survey'), name='Food')
+        question = Question.objects.create(block=block, question='Why?', options=['Yes', 'No'])
+        Response.objects.create(question=question, user=alice, option=1)
+
+        with self.assertNumQueries(2):
+            first = self.client.get('/users/alice.b/votes/', {'limit': 2}).json()
+        self.assertEqual([vote['option'] for vote in first['votes']], ['Tacos', 'Pizza'])
+        second = self.client.get('/users/alice.b/votes/', {'limit': 2, 'after': first['next']}).json()
+        self.assertEqual(([vote['option'] for vote in second['votes']], second['next']), (['Sushi'], None))
+        ballots = self.client.get('/users/alice.b/ballots/').json()['ballots']
+        self.assertEqual((ballots[0]['options'], ballots[0]['ranking']), (['Tacos', 'Sushi'], ['Sushi', 'Tacos']))
+        with self.assertNumQueries(2):
+            responses = self.client.get('/users/alice.b/responses/').json()['responses']
+        self.assertEqual(responses[0], {'id': responses[0]['id'], 'poll': 'survey', 'block': 'Food',
+                                        'question': 'Why?', 'option': 'No'})
+        self.assertEqual(self.client.get('/users/carol/votes/').status_code, 404)
+
+
+class RankedChoiceTestCase(SlackStubMixin, TestCase):
+    def test_schulze_and_condorcet_winner(self):
+        # Tacos > Pizza > Sushi > Tacos is a cycle, Schulze breaks it on the weakest defeat.
+        rankings = [[1, 2, 3]] * 5 + [[3, 1, 2]] * 4 + [[2, 3, 1]] * 3
+        matrix = condorcet.pairwise_matrix(rankings, 3, chunk=5)
+        self.assertEqual((matrix[0, 1], matrix[1, 2], matrix[2, 0]), (8, 9, 7))
+        self.assertEqual(condorcet.score(matrix, 3), ([[0], [1], [2]], None))
+        self.assertEqual(condorcet.condorcet_winner(condorcet.pairwise_matrix([[1, 2], [1, 2], [2, 1]], 2), 2), 0)
+
+    def test_matrix_follows_ballot_changes(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza', 'Sushi'], ranked=True)
+        poll.save()
+        ballot = CompleteVote(poll=poll, user=User.objects.create(name='alice'), user_secret='abc')
+        ballot.set_ranking([2, 1])
+        ballot.save()
+        body = {'ballots': [{'user': 'bob', 'options': ['Sushi', 'Tacos'], 'secret': 'x'},
+                            {'user': 'carol', 'options': ['Sushi'], 'secret': 'y'}]}
+        resp = self.client.post(f'/polls/{poll.timestamp_str}/import?token=', json.dumps(body),
+                                content_type='application/json')
+        self.assertEqual(resp.json()['ballots'], 2)
+        ballot = CompleteVote.objects.get(pk=ballot.pk)
+        ballot.set_ranking([0, 0, 1])
+        ballot.save()
+        CompleteVote.objects.get(user__name='carol').delete()
+
+        rankings = CompleteVote.objects.filter(poll=poll).values_list('ranking', flat=True)
+        expected = condorcet.pairwise_matrix(rankings, Poll.MAX_OPTIONS)
+        self.assertTrue((PairwiseMatrix.objects.get(poll=poll).matrix == expected).all())
+        self.assertEqual(Poll.objects.get(pk=poll.pk).condorcet, ([[2], [0], [1]], 2))
+        data = self.client.get(f'/polls/{poll.timestamp_str}/results.json').json()
+        self.assertEqual(data['condorcet_winner'], 'Sushi')
+
+
+class BlockSamplingTestCase(TestCase):
+    def test_least_answered_blocks_first(self):
+        poll = DistributedPoll.objects.create(name='survey')
+        blocks = [Block.objects.create(poll=poll, name=f'Block {i}') for i in range(5)]
+        questions = [Question.objects.create(block=block, question='Why?', options=['Yes', 'No']) for block in blocks]
+        users = [User.objects.create(name=f'user{i}') for i in range(3)]
+        for question, answers in zip(questions, (3, 1, 0, 2, 0)):
+            for user in users[:answers]:
+                Response.objects.create(question=question, user=user, option=0)
+        Response.objects.filter(question=questions[3], user=users[0]).get().delete()
+        self.assertEqual([b.response_count for b in Block.objects.order_by('id')], [3, 1, 0, 1, 0])
+
+        self.assertEqual({b.pk for b in poll.sample_blocks(2)}, {blocks[2].pk, blocks[4].pk})
+        third = poll.sample_blocks(3)
+        self.assertIn(third[2].pk, {blocks[1].pk, blocks[3].pk})
+        self.assertEqual(len(poll.sample_blocks(10)), 5)
+
+
+class BlockSearchTestCase(TestCase):
+    def test_ranked_search_over_names_and_questions(self):
+        poll = DistributedPoll.objects.create(name='survey')
+        demographics = Block.objects.create(poll=poll, name='Demographics')
+        food = Block.objects.create(poll=poll, name='Food')
+        Block.objects.create(poll=poll, name='Travel')
+        Question.objects.create(block=food, question='Which demographic do you cook for?', options=['Kids'])
+        Question.objects.create(block=food, question='Favourite lunch spot?', options=['Tacos'])
+
+        self.assertEqual([b.name for b in poll.search_blocks('demog', 5)], ['Demographics', 'Food'])
+        self.assertEqual([b.name for b in poll.search_blocks('LUNCH spot', 5)], ['Food'])
+        self.assertEqual(poll.search_blocks('demo', 1), [demographics])
+        self.assertEqual(poll.search_blocks('!!', 5), [])
+        other = DistributedPoll.objects.create(name='other')
+        self.assertEqual(other.search_blocks('food', 5), [])
+
+
+class BlockQuestionsLoaderTestCase(SlackStubMixin, TestCase):
+    @mock.patch('main.views.time.sleep')
+    def test_posting_blocks_costs_two_queries(self, sleep):
+        poll = DistributedPoll.objects.create(name='survey')
+        blocks = [Block.objects.create(poll=poll, name=f'Block {i}') for i in range(3)]
+        users = [User.objects.create(name=f'user{i}') for i in range(4)]
+        for block in blocks:
+            for i in range(5):
+                question = Question.objects.create(block=block, question=f'Question {i}?', options=['Yes', 'No'])
+                for user in users[:i]:
+                    Response.objects.create(question=question, user=user, option=i % 2)
+        with self.assertNumQueries(2):
+            views.post_blocks('C1', blocks)
+        self.assertEqual(self.slack_post.call_count, 18)
+        loaded = views.load_block_questions(blocks)[blocks[0].pk]
+        self.assertEqual([q.responses for q in loaded],
+                         [Question.objects.get(pk=q.pk).responses for q in loaded])
+
+
+class VoteSubmissionTestCase(SlackStubMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza', 'Sushi'])
+        self.poll.save()
+        self.user = User.objects.create(name='alice')
+        self.slack_post.reset_mock()
+
+    def vote(self, options, secret='abc'):
+        data = {'_method': 'vote', 'user': self.user.pk, 'user_secret': secret, 'options': options}
+        return self.client.post(f'/polls/{self.poll.timestamp_str}/vote', data)
+
+    @mock.patch('main.background.transaction.on_commit')
+    def test_upsert_and_refresh_after_commit(self, on_commit):
+        with self.assertNumQueries(9):
+            resp = self.vote(['Tacos', 'Sushi'])
+        self.assertEqual(resp.status_code, 302)
+        self.vote(['Pizza'])
+        self.assertEqual(Poll.objects.get(pk=self.poll.pk).votes, [[], ['alice'], []])
+        self.assertEqual(self.vote(['Tacos'], secret='wrong').status_code, 403)
+        self.assertEqual(self.slack_post.call_count, 0)
+
+        with mock.patch('main.background.executor') as executor:
+            executor.submit.side_effect = lambda run, func, *args: func(*args)
+            on_commit.call_args[0][0]()
+        self.assertEqual(self.slack_post.call_count, 1)
+        self.assertIn('Pizza', self.slack_post.call_args[1]['json']['text'])
+
+    @mock.patch('main.background.transaction.on_commit')
+    def test_ranked_ballot_updates_matrix(self, on_commit):
+        self.poll.ranked = True
+        self.poll.save()
+        data = {'_method': 'vote', 'user': self.user.pk, 'user_secret': 'abc', 'rank_0': 2, 'rank_2': 1}
+        self.client.post(f'/polls/{self.poll.timestamp_str}/vote', data)
+        data.update(rank_0=1, rank_2=2)
+        self.client.post(f'/polls/{self.poll.timestamp_str}/vote', data)
+        expected = condorcet.pairwise_matrix([[1, 0, 2]], Poll.MAX_OPTIONS)
+        self.assertTrue((PairwiseMatrix.objects.get(poll=self.poll).matrix == expected).all())
+
+
+class DistributedPollPurgeTestCase(SlackStubMixin, TestCase):
+    @mock.patch('main.background.transaction.on_commit')
+    def test_delete_hides_then_purges_in_batches(self, on_commit):
+        poll = DistributedPoll.objects.create(name='survey')
+        other = DistributedPoll.objects.create(name='other')
+        user = User.objects.create(name='alice')
+        for target in (poll, other):
+            for i in range(3):
+                block = Block.objects.create(poll=target, name=f'Block {i}')
+                for j in range(2):
+                    question = Question.objects.create(block=block, question=f'Question {j}?', options=['Yes'])
+                    Response.objects.create(question=question, user=user, option=0)
+
+        resp = self.client.delete('/dpoll/survey/')
+        self.assertEqual(resp.status_code, 202)
+        self.assertTrue(resp.json()['deleting'])
+        self.assertEqual(Block.objects.filter(poll=poll).count(), 3)
+        self.assertEqual(self.client.get('/dpoll/survey/responses/').status_code, 404)
+        self.client.post('/event_handling/', json.dumps({'token': '', 'type': 'event_callback', 'event': {
+            'type': 'message', 'text': 'dpoll survey', 'channel': 'C1'}}), content_type='application/json')
+        self.assertIn('Poll not found', self.slack_post.call_args[1]['json']['text'])
+
+        with override_settings(POLLS_PURGE_BATCH_SIZE=4), self.assertNumQueries(25):
+            with mock.patch('main.background.executor') as executor:
+                executor.submit.side_effect = lambda run, func, *args: func(*args)
+                on_commit.call_args[0][0]()
+        self.assertFalse(DistributedPoll.objects.filter(name='survey').exists())
+        self.assertEqual(self.client.get('/dpoll/survey/').status_code, 404)
+        self.assertEqual(Response.objects.count(), 6)
+        self.assertEqual(Question.objects.count(), 6)
+        self.assertEqual(Block.objects.get(name='Block 0').poll, other)
+
+
+class SlackRateLimitTestCase(TestCase):
+    @override_settings(POLLS_SLACK_RATE_LIMITS={'chat.postMessage': (2.0, 2.0)}, POLLS_SLACK_RATE_LIMIT_MAX_WAIT=1.2)
+    @mock.patch('main.ratelimit.time.sleep')
+    def test_bucket_per_method_and_channel(self, sleep):
+        waits = [ratelimit.reserve('chat.postMessage', 'C1', 10) for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.5, places=1)
+        self.assertAlmostEqual(waits[3], 1.0, places=1)
+        self.assertEqual(ratelimit.reserve('chat.postMessage', 'C2', 0), 0.0)
+        self.assertEqual(ratelimit.reserve('chat.update', 'C1', 0), 0.0)
+
+        # Past the longest wait the token is handed back, the bucket does not fall further behind.
+        for _ in range(3):
+            with self.assertRaises(ratelimit.RateLimited):
+                ratelimit.reserve('chat.postMessage', 'C1', 1.2)
+        with self.assertRaises(ratelimit.RateLimited):
+            ratelimit.acquire('chat.postMessage', 'C1')
+        sleep.assert_not_called()
+        with ratelimit.patient(2):
+            ratelimit.acquire('chat.postMessage', 'C1')
+        self.assertAlmostEqual(sleep.call_args[0][0], 1.5, places=1)
+        self.assertFalse(ratelimit.is_patient())
+
+    @override_settings(POLLS_SLACK_RATE_LIMITS={'chat.update': (0.001, 1.0), 'chat.postMessage': (0.001, 1.0)})
+    @mock.patch('main.views.requests.post')
+    def test_requests_defer_updates_and_answer_503(self, post):
+        post.return_value.status_code = 200
+        post.return_value.json.return_value = {'ok': True, 'ts': '1557457622.000001'}
+        views.update_message('C1', '1.0', 'first', None)
+        with mock.patch('main.background.submit_once') as submit_once:
+            views.update_message('C1', '1.0', 'second', None)
+            views.update_message('C1', '1.0', 'third', None)
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(submit_once.call_args[0][:2], (('update_message', 'C1', '1.0'), views.send_deferred_update))
+        with mock.patch('main.ratelimit.time.sleep'), mock.patch('main.ratelimit.reserve', return_value=0.0):
+            views.send_deferred_update('C1', '1.0')
+        self.assertEqual(post.call_args[1]['json']['text'], 'third')
+
+        views.post_message('C1', 'first', None)
+        resp = self.client.post('/poll/', {'token': '', 'text': '"Lunch?" "Tacos"', 'channel_id': 'C1'})
+        self.assertEqual(resp.status_code, 503)
+        self.assertGreater(int(resp['Retry-After']), 100)
+
+
+class FakeSlackTestCase(TestCase):
+    def setUp(self):
+        self.slack = FakeSlack(('127.0.0.1', 0))
+        threading.Thread(target=self.slack.serve_forever, daemon=True).start()
+        self.addCleanup(self.slack.server_close)
+        self.addCleanup(self.slack.shutdown)
+
+    @mock.patch('main.views.time.sleep')
+    def test_calls_go_to_the_configured_api(self, sleep):
+        # Retrying after Retry-After is what background tasks do, requests hand the update to them instead.
+        with override_settings(POLLS_SLACK_API_URL=f"{self.slack.url}/api/", POLLS_SLACK_RATE_LIMITS={}), \
+                ratelimit.patient():
+            ts = views.post_message('C1', 'Hello', None)
+            self.slack.rate_limit_rate = 1.0
+            with self.assertRaises(requests.HTTPError):
+                views.update_message('C1', ts, 'Hello again', None)
+        calls = self.slack.snapshot()
+        self.assertEqual(calls['messages'], [{'channel': 'C1', 'ts': ts}])
+        self.assertEqual(calls['counts'], {'chat.postMessage': 1, 'chat.update': settings.POLLS_SLACK_MAX_RETRIES + 1})
+        self.assertEqual(calls['statuses']['429'], settings.POLLS_SLACK_MAX_RETRIES + 1)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile(list(range(1, 101)), 50), 50)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+
+
+class SurveyIngestTestCase(TestCase):
+    def setUp(self):
+        self.slack = FakeSlack(('127.0.0.1', 0))
+        threading.Thread(target=self.slack.serve_forever, daemon=True).start()
+        self.addCleanup(self.slack.server_close)
+        self.addCleanup(self.slack.shutdown)
+        settings_override = override_settings(POLLS_SLACK_API_URL=f"{self.slack.url}/api/", POLLS_SLACK_RATE_LIMITS={})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch('main.background.executor')
+        self.executor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def share(self, file_id):
+        looked_up = self.slack.snapshot()['counts'].get('files.info', 0)
+        resp = self.client.post('/event_handling/', json.dumps({'token': '', 'type': 'event_callback', 'event': {
+            'type': 'file_shared', 'file': {'id': file_id}, 'channel_id': 'C1'}}), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        # Nothing was downloaded on the request thread.
+        self.assertEqual(self.slack.snapshot()['counts'].get('files.info', 0), looked_up)
+        run, func, *args = self.executor.submit.call_args[0]
+        func(*args)
+
+    def test_survey_is_created_off_the_request_thread(self):
+        self.share('FSURVEY')
+        poll = DistributedPoll.objects.get(name='survey-FSURVEY')
+        self.assertEqual([block.name for block in poll.block_set.order_by('id')], ['Lunch', 'Commute'])
+        self.assertEqual(Question.objects.filter(block__poll=poll).count(), 3)
+        self.assertEqual(self.slack.snapshot()['counts']['chat.postMessage'], 1)
+
+    def test_unrelated_and_oversized_files_are_rejected(self):
+        rejected = metrics.snapshot().get('ingest.rejected', 0)
+        ignored = metrics.snapshot().get('ingest.ignored', 0)
+        self.slack.files['FIMAGE'] = b'\x89PNG\r\n' + os.urandom(512 * 1024)
+        self.share('FIMAGE')
+        with override_settings(POLLS_SURVEY_MAX_BYTES=100):
+            self.share('FIMAGE')
+            self.share('FLARGE')
+        self.assertFalse(DistributedPoll.objects.exists())
+        self.assertEqual(metrics.snapshot()['ingest.rejected'], rejected + 1)
+        self.assertEqual(metrics.snapshot()['ingest.ignored'], ignored + 2)
+        # Only the survey that was too large gets an answer, other uploads are dropped quietly.
+        self.assertEqual(self.slack.snapshot()['counts']['chat.postMessage'], 1)
+
+    def test_lines_stream_in_bounded_memory(self):
+        block = '[[Block: Block]]\n' + ''.join(f'Question {i}?\n\nYes\nNo\n\n' for i in range(20)).replace(
+            'Question', 'A rather long question to pad the survey out, number')
+        data = (block * (8 * 1024 * 1024 // len(block))).encode()
+
+        def chunks():
+            for start in range(0, len(data), 64 * 1024):
+                yield data[start:start + 64 * 1024]
+
+        tracemalloc.start()
+        try:
+            count = sum(1 for _ in ingest.survey_lines(chunks(), len(data)))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(count, data.count(b'\n'))
+        self.assertLess(peak, 1024 * 1024)
+
+        with self.assertRaises(ingest.SurveyRejected):
+            list(ingest.survey_lines(chunks(), len(data) - 1))
+        consumed = []
+        with self.assertRaises(ingest.SurveyRejected):
+            list(ingest.survey_lines((consumed.append(1) or b'GIF89a' for _ in range(100)), len(data)))
+        self.assertEqual(len(consumed), 1)
+        self.assertEqual(list(ingest.survey_lines([b'\xef\xbb\xbf  [[Blo', b'ck: A]]\r\nWhy?'], 100)),
+                         ['  [[Block: A]]\r', 'Why?'])
+
+
+class ProfilingTestCase(SlackStubMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_signed_requests_are_profiled_into_a_ring_buffer(self):
+        poll = Poll(channel='C1', question='Lunch?', options=['Tacos', 'Pizza'])
+        poll.save()
+        with override_settings(POLLS_PROFILE_DIR=self.directory, POLLS_PROFILE_KEEP=2):
+            self.client.get(f'/polls/{poll.timestamp_str}/results', HTTP_X_POLLS_PROFILE='forged')
+            self.assertEqual(profiling.profile_paths(self.directory), [])
+            token = profiling.make_token()
+            for _ in range(3):
+                resp = self.button(poll, 'Tacos', user='alice')
+            resp = self.client.post('/interactive_button/', {'payload': json.dumps({
+                'callback_id': 'options', 'actions': [{'name': 'addMore'}], 'trigger_id': '1',
+                'original_message': {'ts': poll.timestamp_str}, 'user': {'name': 'bob'}, 'token': ''
+            })}, HTTP_X_POLLS_PROFILE=token)
+            self.client.get(f'/polls/{poll.timestamp_str}/results', HTTP_X_POLLS_PROFILE=token)
+            paths = profiling.profile_paths(self.directory)
+            self.assertEqual(len(paths), 2)
+            self.assertEqual(resp['X-Polls-Profile-Id'], os.path.basename(paths[0]))
+            with open(paths[0][:-len('.prof')] + '.json') as sidecar:
+                summary = json.load(sidecar)
+            self.assertEqual([call['method'] for call in summary['slack']], ['dialog.open'])
+            self.assertTrue(summary['queries'])
+            pstats.Stats(paths[1])
+
+            out = io.StringIO()
+            call_command('profiles', stdout=out)
+            self.assertEqual(len(out.getvalue().splitlines()), 2)
+            call_command('profiles', 'latest', '--limit', '5', stdout=out)
+            self.assertIn('GET /polls/', out.getvalue())
+
+
+class ForkResetTestCase(TestCase):
+    def test_after_fork_rebuilds_process_state(self):
+        User.objects.create(name='alice')
+        metrics.increment('fork.parent')
+        self.assertEqual(background.submit(lambda: 1).result(), None)
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read)
+                warmup.after_fork()
+                state = {'metrics': metrics.snapshot(), 'random': random.random(),
+                         'connection': connection.connection is None, 'hub': live.hub.thread is None,
+                         'background': background.submit(metrics.increment, 'fork.child').exception(5) is None}
+                os.write(write, json.dumps(state).encode())
+            finally:
+                os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as f:
+            state = json.loads(f.read())
+        os.waitpid(pid, 0)
+        self.assertEqual(state['metrics'], {})
+        self.assertNotEqual(state['random'], random.random())
+        self.assertTrue(state['connection'] and state['hub'] and state['background'])
+        # The child left the shared connection alone.
+        self.assertEqual(User.objects.count(), 1)
+
+
+class QueryPlanTestCase(TestCase):
+    """Hot lookups must be answerable from an index, checked with sequential scans priced out as on a large table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create skips Poll.save and with it the Slack update.
+        cls.poll, = Poll.objects.bulk_create([Poll(timestamp='1557457622.000001', channel='C1', question='Lunch?',
+                                                   options=['Tacos', 'Pizza'])])
+        cls.user = User.objects.create(name='alice')
+        block = Block.objects.create(poll=DistributedPoll.objects.create(name='survey'), name='Food')
+        cls.question = Question.objects.create(block=block, question='Why?', options=['Yes', 'No'])
+
+    def assertIndexed(self, queryset):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan, f"{queryset.query}\n{plan}")
+
+    def test_hot_lookups_use_indexes(self):
+        self.assertIndexed(Vote.objects.filter(poll=self.poll, option=0, user=self.user))
+        self.assertIndexed(Vote.objects.filter(poll=self.poll).values_list('option', 'user__name'))
+        self.assertIndexed(CompleteVote.objects.filter(poll=self.poll, user=self.user))
+        self.assertIndexed(CompleteVote.objects.filter(poll=self.poll).values_list('options_inner', 'user__name'))
+        self.assertIndexed(Response.objects.filter(question=self.question, user=self.user))
+        self.assertIndexed(Response.objects.filter(question__block__poll__name='survey')
+                           .values_list('question_id', 'option', 'user__name'))
+        self.assertIndexed(User.objects.filter(name='alice'))
+        self.assertIndexed(Poll.objects.filter(timestamp=self.poll.timestamp))
+        self.assertIndexed(Poll.objects.filter(channel='C1', timestamp__gt=self.poll.timestamp).order_by('timestamp'))
+        for model in (Vote, CompleteVote, Response):
+            self.assertIndexed(model.objects.filter(user=self.user, id__gt=100).order_by('id'))
+
+    def test_vote_tally_is_index_only(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = Vote.objects.filter(poll=self.poll).values_list('option', 'user_id').explain()
+        self.assertIn('Index Only Scan', plan)
+
+    def test_no_duplicate_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT indrelid::regclass::text, indkey::text, array_agg(indexrelid::regclass::text)
+                FROM pg_index JOIN pg_class ON pg_class.oid = indrelid
+                WHERE relname LIKE 'main\\_%%' GROUP BY indrelid, indkey, indclass, indexprs, indpred
+                HAVING count(*) > 1
+            """)
+            self.assertEqual(cursor.fetchall(), [])
+
+
+@override_settings(POLLS_SLACK_CHANNEL_INTERVAL=0)
+class BatchCreateTestCase(SlackStubMixin, TestCase):
+    def test_batch_creates_and_reports_per_poll(self):
+        specs = [{'question': f'Check-in {i}?', 'options': ['Yes', 'No'], 'channel': f'C{i % 3}'} for i in range(6)]
+        specs.insert(2, {'question': 'Broken', 'options': 'Yes'})
+        with mock.patch('main.background.transaction.on_commit') as on_commit, self.assertNumQueries(1):
+            resp = self.client.post('/polls/batch', json.dumps(specs), content_type='application/json')
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json()['done'], 0)
+        self.assertEqual(self.slack_post.call_count, 0)
+
+        post_poll = Poll.post_poll
+
+        def post_or_fail(poll):
+            if poll.question == 'Check-in 4?':
+                raise requests.ConnectionError()
+            return post_poll(poll)
+        with mock.patch('main.background.executor') as executor, \
+                mock.patch.object(Poll, 'post_poll', autospec=True, side_effect=post_or_fail):
+            executor.submit.side_effect = lambda run, func, *args: func(*args)
+            on_commit.call_args[0][0]()
+        progress = self.client.get(resp['Location']).json()
+        self.assertEqual((progress['total'], progress['done']), (7, 7))
+        results = progress['results']
+        self.assertEqual([r['index'] for r in results], list(range(7)))
+        self.assertIn('error', results[2])
+        self.assertIn('error', results[5])
+        # Every poll Slack accepted is stored, whatever happened to the rest of the batch.
+        self.assertEqual(sorted(Poll.objects.values_list('question', flat=True)),
+                         [f'Check-in {i}?' for i in (0, 1, 2, 3, 5)])
+        # One postMessage per poll, the message carries its link from the start.
+        self.assertEqual(self.slack_post.call_count, 5)
+        self.assertEqual(sorted(call[1]['json']['text'].split('\n')[1] for call in self.slack_post.call_args_list),
+                         sorted(poll.message_url for poll in Poll.objects.all()))
+
+    @mock.patch('main.views.time.sleep')
+    def test_rate_limited_calls_are_retried(self, sleep):
+        limited = mock.Mock(status_code=429, headers={'Retry-After': '2'})
+        ok = mock.Mock(status_code=200)
+        ok.json.return_value = {'ok': True, 'ts': '1557457622.000001'}
+        self.slack_post.side_effect = [limited, ok]
+        with ratelimit.patient():
+            self.assertEqual(views.post_message('C1', 'text'), '1557457622.000001')
+        sleep.assert_called_once_with(2.0)
+        self.slack_post.side_effect = [limited]
+        with self.assertRaises(ratelimit.RateLimited):
+            views.post_message('C1', 'text')
@@ -1,25 +1,39 @@
 import datetime
-import io
+import functools
+import hashlib
+import itertools
 import json
 import logging
 import math
 import os
-import random
+import tempfile
 import time
 from collections import defaultdict
 from datetime import timezone
-from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar, Set, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar, Union
 
 import requests
+from django.conf import settings
 from django.core import serializers
-from django.db import IntegrityError, models
-from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest, Http404
-from django.shortcuts import get_object_or_404, render, redirect
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, models, transaction
+from django.http import Http404, HttpRequest, HttpResponse, HttpResponseBadRequest, JsonResponse, \
+    StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
-
-from main.models import Block, DistributedPoll, Poll, Question, Response, User, Vote, CompleteVote, validate_vote, \
-    TimestampField
-from main.forms import NameAndSecretForm, MultipleChoiceCompleteVoteForm
+from django.views.decorators.http import condition
+
+from main import apm, background, export, listing, metrics, profiling, ratelimit
+from main.bulk import import_votes, post_poll_batch, purge_distributed_poll
+from main.forms import complete_vote_form, NameAndSecretForm
+from main.ingest import CHUNK_SIZE, NotASurvey, survey_lines, SurveyRejected
+from main.live import open_stream
+from main.logs import PAYLOAD
+from main.models import Block, CompleteVote, DistributedPoll, load_block_questions, Poll, PollBatch, Question, Response, \
+    TimestampField, User, validate_vote, Vote
+from main.routers import is_pinned, pin_to_primary, read_only, replica_reads
 
 T = TypeVar('T')
 U = TypeVar('U')
@@ -57,8 +71,9 @@ client_secret = os.environ.get("POLLS_CLIENT_SECRET", "")
 bot_secret = os.environ.get("POLLS_BOT_SECRET", "")
 
 
-def add_poll(channel: str, question: str, options: List[str]) -> Poll:
-    poll = Poll(channel=channel, question=question, options=options)
+def add_poll(channel: str, question: str, options: List[str], closes_at: Optional[datetime.datetime] = None,
+             ranked: bool = False) -> Poll:
+    poll = Poll(channel=channel, question=question, options=options, closes_at=closes_at, ranked=ranked)
     poll.save()
     return poll
 
@@ -99,17 +114,31 @@ def order_options(options: List[str], votes: List[List[str]]) -> Tuple[List[str]
     return options, votes
 
 
-def format_text(question: str, options: List[str], votes: List[List[str]], location: str) -> str:
-    text = f"*{question}*\n{location}\n"
+def format_text(question: str, options: List[str], votes: List[List[str]], location: str,
+                summary: Optional[List[str]] = None) -> str:
+    lines = [f"*{question}*", location]
+    # Past the threshold only the first few voters per option are named so the message size stays bounded.
+    compact = sum(len(voters) for voters in votes) > settings.POLLS_COMPACT_RENDER_THRESHOLD
+    shown = settings.POLLS_COMPACT_RENDER_VOTERS_SHOWN
     for index, option in enumerate(options):
-        to_add = '(' + str(len(votes[index])) + ") " + option
-        to_add += ' ' + ', '.join([f'@{username}' for username in votes[index]])
-        # Add count + condorcet score here
-        text += to_add + '\n'
-    return text
+        voters = votes[index]
+        usernames = ', '.join([f'@{username}' for username in (voters[:shown] if compact else voters)])
+        if compact and len(voters) > shown:
+            usernames += f' +{len(voters) - shown} more'
+        lines.append(f"({len(voters)}) {option} {usernames}")
+    if summary:
+        lines.extend(summary)
+    if compact and location:
+        lines.append(f"Full results: {location}results")
+    return '\n'.join(lines) + '\n'
 
 
 def format_attachments(options: List[str], options_name: str = "option", include_add_more: bool = True) -> str:
+    return _format_attachments(tuple(options), options_name, include_add_more)
+
+
+@functools.lru_cache(maxsize=1024)
+def _format_attachments(options: Tuple[str, ...], options_name: str, include_add_more: bool) -> str:
     actions = []
     for option in options:
         attach = {"name": options_name, "text": option, "type": "button", "value": option}
@@ -125,8 +154,53 @@ def format_attachments(options: List[str], options_name: str = "option", include
     return json.dumps(attachments)
 
 
+def render_digest(text: str, attachments: Optional[str]) -> str:
+    return hashlib.sha1(f"{text}\0{attachments}".encode()).hexdigest()
+
+
+def remember_render(channel: str, timestamp: str, text: str, attachments: Optional[str]) -> None:
+    caches['slack_render'].set(f"{channel}:{timestamp}", render_digest(text, attachments))
+
+
+def is_rendered(channel: str, timestamp: str, text: str, attachments: Optional[str]) -> bool:
+    cache = caches['slack_render']
+    # Another worker may have sent a different render since this process remembered one, only a shared cache knows.
+    if isinstance(cache, LocMemCache):
+        return False
+    return cache.get(f"{channel}:{timestamp}") == render_digest(text, attachments)
+
+
+def slack_url(method: str) -> str:
+    return f"{settings.POLLS_SLACK_API_URL.rstrip('/')}/{method}"
+
+
+def call_slack(method_url: str, **kwargs: Any) -> requests.Response:
+    method = method_url.rsplit('/', 1)[-1]
+    channel = (kwargs.get('json') or kwargs.get('params') or {}).get('channel')
+    # Slack answers 429 with a Retry-After header when a method or channel is over its rate limit.
+    outbound = apm.span(f'Slack {method}', 'external', 'slack', slack_method=method, channel=channel) \
+        if apm.ENABLED else apm.NO_SPAN
+    with outbound as span:
+        for attempt in range(settings.POLLS_SLACK_MAX_RETRIES + 1):
+            ratelimit.acquire(method, channel)
+            start = time.perf_counter()
+            response = requests.post(method_url, **kwargs)
+            profiling.record_slack(method, channel, response.status_code, time.perf_counter() - start)
+            if response.status_code != 429 or attempt == settings.POLLS_SLACK_MAX_RETRIES:
+                break
+            delay = float(response.headers.get('Retry-After', 1))
+            if delay > ratelimit.patience():
+                raise ratelimit.RateLimited(method, delay)
+            logger.warning("Rate limited by %s, retrying in %s seconds", method_url, delay)
+            metrics.increment('slack.retry_after_seconds', delay)
+            time.sleep(delay)
+        if span is not apm.NO_SPAN:
+            span.label(status=response.status_code, attempts=attempt + 1)
+    return response
+
+
 def create_dialog(payload: Dict) -> None:
-    method_url = 'https://slack.com/api/dialog.open'
+    method_url = slack_url('dialog.open')
     method_params = {
         "token": client_secret,
         "trigger_id": payload['trigger_id'],
@@ -142,20 +216,25 @@ def create_dialog(payload: Dict) -> None:
         }
     }
     method_params['dialog'] = json.dumps(method_params['dialog'])
-    logger.info("Params: %s", method_params)
-    response_data = requests.post(method_url, params=method_params)
-    logger.info("Dialog Response Body: %s", response_data.content)
+    logger.info("Params: %s", method_params, extra=PAYLOAD)
+    response_data = call_slack(method_url, params=method_params)
+    logger.info("Dialog Response Body: %s", response_data.content, extra=PAYLOAD)
     response_data.raise_for_status()
 
 
-def load_distributed_poll_file(name: str, lines: List[str]) -> Tuple[DistributedPoll, List[Block], List[Question]]:
+def load_distributed_poll_file(name: str, lines: Iterable[str]) -> Tuple[DistributedPoll, int, int]:
+    """Create a distributed poll from the lines of a survey file, returning it with its block and question counts.
+
+    Lines are consumed as they come and nothing but the current block and question is kept, so ``lines`` can be a
+    download in progress.
+    """
     poll = DistributedPoll()
     poll.name = name
     if poll.name.endswith('.txt'):
         poll.name = poll.name[:-4]
     poll.save()
-    blocks: List[Block] = []
-    questions: List[Question] = []
+    blocks = 0
+    questions = 0
     current_block: Optional[Block] = None
     current_question: Optional[Question] = None
     current_options: List[str] = []
@@ -164,11 +243,11 @@ def load_distributed_poll_file(name: str, lines: List[str]) -> Tuple[Distributed
         line = line.strip()
         if line.startswith("[[Block:"):
             if current_block is not None:
-                blocks.append(current_block)
+                blocks += 1
                 on_options = False
                 if current_question is not None:
                     current_question.save()  # noqa: T484
-                    questions.append(current_question)
+                    questions += 1
                 current_question = None
                 current_options = []
             line = line[8:-2]
@@ -180,7 +259,7 @@ def load_distributed_poll_file(name: str, lines: List[str]) -> Tuple[Distributed
         elif len(line) == 0:
             if on_options:
                 current_question.options = current_options  # noqa: T484
-                questions.append(current_question)
+                questions += 1
                 current_question.save()  # noqa: T484
                 current_question = None
                 current_options = []
@@ -197,13 +276,62 @@ def load_distributed_poll_file(name: str, lines: List[str]) -> Tuple[Distributed
             current_options.append(line)
     if current_question is not None and on_options:
         current_question.options = current_options  # noqa: T484
-        questions.append(current_question)
+        questions += 1
         current_question.save()  # noqa: T484
     if current_block is not None:
-        blocks.append(current_block)
+        blocks += 1
     return poll, blocks, questions
 
 
+def ingest_survey_file(file_id: str, channel: str) -> None:
+    """Stream a shared survey file into a new distributed poll, within a byte cap and a time limit."""
+    timeout = settings.POLLS_SURVEY_DOWNLOAD_TIMEOUT
+    max_bytes = settings.POLLS_SURVEY_MAX_BYTES
+    file_response = requests.get(slack_url('files.info'), params={'token': client_secret, 'file': file_id},
+                                 timeout=timeout)
+    logger.info("File Response Body: %s", file_response.content, extra=PAYLOAD)
+    file_response.raise_for_status()
+    file_info: Dict = file_response.json()['file']
+    title = file_info['title']
+    try:
+        # The download is spooled to disk first, so the transaction only lasts as long as parsing the file does and
+        # a download that fails half way never opens one.
+        with tempfile.TemporaryFile('w+', encoding='utf-8', newline='\n') as spool:
+            with requests.get(file_info['url_private_download'],
+                              headers={"Authorization": "Bearer " + client_secret}, stream=True,
+                              timeout=timeout) as response:
+                response.raise_for_status()
+                lines = survey_lines(response.iter_content(CHUNK_SIZE), max_bytes, time.monotonic() + timeout)
+                # Only the first chunk is read to tell a survey from any other upload before a file known to be too
+                # large is turned down, as only surveys are worth an answer in the channel.
+                first = next(lines, None)
+                if max(file_info.get('size', 0), int(response.headers.get('Content-Length') or 0)) > max_bytes:
+                    raise SurveyRejected(f"it is larger than {max_bytes} bytes")
+                for line in itertools.chain([] if first is None else [first], lines):
+                    spool.write(line + '\n')
+            spool.seek(0)
+            lines = (line[:-1] for line in spool)
+            with transaction.atomic(), apm.span('load_distributed_poll_file', 'app', 'survey', file=file_id) as span:
+                poll, blocks, questions = load_distributed_poll_file(title, lines)
+                span.label(blocks=blocks, questions=questions)
+    except NotASurvey as e:
+        logger.info("Ignored shared file %s: %s", file_id, e)
+        metrics.increment('ingest.ignored')
+        return
+    except SurveyRejected as e:
+        logger.info("Rejected shared file %s: %s", file_id, e)
+        metrics.increment('ingest.rejected')
+        post_message(channel, f'Could not create a distributed poll from "{title}", {e}.', None, False)
+        return
+    except IntegrityError:
+        logger.info("Poll already existed.", exc_info=True)
+        post_message(channel, "Could not create distributed poll a poll with name \""
+                     + title + "\" already exists.", None, False)
+        return
+    logger.info("Created distributed poll %s with %d blocks and %d questions", poll.name, blocks, questions)
+    post_message(channel, "Distributed Poll Created: " + poll.name, None, True)
+
+
 def collapse_lists(lists: List[List[str]]) -> List[List[str]]:
     if len(lists) == 0:
         return lists
@@ -222,7 +350,7 @@ def collapse_lists(lists: List[List[str]]) -> List[List[str]]:
 
 
 def post_message(channel: str, message: str, attachments: Optional[str] = None, use_client_secret: bool = True) -> str:
-    post_message_url = "https://slack.com/api/chat.postMessage"
+    post_message_url = slack_url('chat.postMessage')
     body_dict = {
         "text": message,
         "channel": channel,
@@ -230,16 +358,21 @@ def post_message(channel: str, message: str, attachments: Optional[str] = None,
         "attachments": attachments
     }
     headers = {"Authorization": f"Bearer {client_secret if use_client_secret else bot_secret}", "Content-Type": "application/json; charset=utf-8"}
-    text_response = requests.post(post_message_url, headers=headers, json=body_dict)
-    logger.info('Post Response Body: %s', text_response.content)
+    text_response = call_slack(post_message_url, headers=headers, json=body_dict)
+    logger.info('Post Response Body: %s', text_response.content, extra=PAYLOAD)
     text_response.raise_for_status()
     text_response_dict = text_response.json()
+    remember_render(channel, text_response_dict['ts'], message, attachments)
     return text_response_dict['ts']
 
 
 def update_message(channel: str, timestamp: str, text: str, attachments: Optional[str] = None,
                    use_client_secret: bool = True) -> None:
-    method_url = 'https://slack.com/api/chat.update'
+    if is_rendered(channel, timestamp, text, attachments):
+        metrics.increment('slack.update.skipped')
+        logger.debug("Skipping update of %s:%s, nothing changed", channel, timestamp)
+        return
+    method_url = slack_url('chat.update')
     body_dict = {
         "channel": channel,
         "ts": timestamp,
@@ -249,9 +382,37 @@ def update_message(channel: str, timestamp: str, text: str, attachments: Optiona
     }
     # Content-type is automatically set since we use the json parameter
     headers = {"Authorization": f"Bearer {client_secret if use_client_secret else bot_secret}"}
-    text_response = requests.post(method_url, headers=headers, json=body_dict)
-    logger.info("Update Response Body: %s", text_response.content)
+    try:
+        text_response = call_slack(method_url, headers=headers, json=body_dict)
+    except ratelimit.RateLimited:
+        if ratelimit.is_patient():
+            raise
+        defer_update(channel, timestamp, text, attachments, use_client_secret)
+        return
+    logger.info("Update Response Body: %s", text_response.content, extra=PAYLOAD)
     text_response.raise_for_status()
+    remember_render(channel, timestamp, text, attachments)
+    metrics.increment('slack.update.sent')
+
+
+# The newest render of each message whose update a request handed to the background, keyed by channel and timestamp.
+_deferred_updates: Dict[Tuple[str, str], Tuple[str, Optional[str], bool]] = {}
+
+
+def defer_update(channel: str, timestamp: str, text: str, attachments: Optional[str], use_client_secret: bool) -> None:
+    """Send a message update from the background, where waiting for the rate limiter does not hold a request.
+
+    Later renders replace a queued one, so the message ends up showing the newest whatever order tasks run in.
+    """
+    _deferred_updates[(channel, timestamp)] = (text, attachments, use_client_secret)
+    metrics.increment('slack.update.deferred')
+    background.submit_once(('update_message', channel, timestamp), send_deferred_update, channel, timestamp)
+
+
+def send_deferred_update(channel: str, timestamp: str) -> None:
+    render = _deferred_updates.pop((channel, timestamp), None)
+    if render is not None:
+        update_message(channel, timestamp, *render)
 
 
 def post_question(channel: str, question: Question) -> None:
@@ -261,27 +422,40 @@ def post_question(channel: str, question: Question) -> None:
     post_message(channel, text, attachments, False)
 
 
+def post_blocks(channel: str, blocks: List[Block]) -> None:
+    questions = load_block_questions(blocks)
+    for block in blocks:
+        post_message(channel, '*' + block.name + '*', None, False)
+        for question in questions[block.pk]:
+            post_question(channel, question)
+            time.sleep(0.5)
+
+
 def poll_to_slack_timestamp(poll: Poll) -> str:
     timestamp_datetime: datetime.datetime = TimestampField.from_db_value_static(poll.timestamp)
-    logger.info("Timestamp: (%s) - %s", timestamp_datetime, type(timestamp_datetime))
+    logger.debug("Timestamp: (%s) - %s", timestamp_datetime, type(timestamp_datetime))
     if isinstance(timestamp_datetime, datetime.datetime):
         timestamp_float = timestamp_datetime.replace(tzinfo=timezone.utc).timestamp()
         timestamp = f"{timestamp_float:17.6f}"
-        logger.info("Timestamp Corrected: (%s) - %s", timestamp, type(timestamp))
+        logger.debug("Timestamp Corrected: (%s) - %s", timestamp, type(timestamp))
     else:
         raise TypeError("timestamp_datetime was not a datetime as expected.")
 
     return timestamp
 
 
-def check_token(request: HttpRequest) -> Optional[HttpResponse]:
+def check_token(request: HttpRequest, method: str = "POST") -> Optional[HttpResponse]:
     verifier = os.environ.get("POLLS_SLACK_VERIFIER", "")
-    if request.method != "POST":
-        return HttpResponseBadRequest("400 Request should be of type POST.")
-    if "token" in request.POST:
-        sent_token = request.POST["token"]
-    elif "payload" in request.POST and "token" in json.loads(request.POST["payload"]):
-        sent_token = json.loads(request.POST["payload"])["token"]
+    if request.method != method:
+        return HttpResponseBadRequest(f"400 Request should be of type {method}.")
+    params = request.POST if method == "POST" else request.GET
+    if "token" in params:
+        sent_token = params["token"]
+    elif "payload" in params and "token" in json.loads(params["payload"]):
+        sent_token = json.loads(params["payload"])["token"]
+    elif "token" in request.GET:
+        # Endpoints taking a JSON body get the token in the query string.
+        sent_token = request.GET["token"]
     else:
         return HttpResponseBadRequest("400 Request is not signed!")
     if verifier != sent_token:
@@ -306,9 +480,10 @@ def unique_list(seq: Iterable[T], id_function: Callable[[T], U] = lambda x: x) -
 
 
 def normalize_post(request: HttpRequest) -> None:
-    if getattr(request, "POST") is None:
+    # The Events API posts JSON bodies, which Django leaves out of request.POST.
+    if getattr(request, "POST") is None or request.content_type == 'application/json':
         request.POST = json.loads(request.body)
-    logger.info(f'Request: {request.POST}')
+    logger.info('Request: %s', request.POST, extra=PAYLOAD)
 
 
 @csrf_exempt
@@ -316,6 +491,11 @@ def server_status(request: HttpRequest) -> HttpResponse:
     return HttpResponse()
 
 
+@csrf_exempt
+def server_metrics(request: HttpRequest) -> HttpResponse:
+    return JsonResponse(metrics.snapshot())
+
+
 @csrf_exempt
 def interactive_button(request: HttpRequest) -> HttpResponse:
     normalize_post(request)
@@ -325,38 +505,42 @@ def interactive_button(request: HttpRequest) -> HttpResponse:
         return error_code
     
     payload = json.loads(request.POST['payload'])
-    logger.info(f'Payload: {payload}')
+    logger.info('Payload: %s', payload, extra=PAYLOAD)
     if payload["callback_id"] == "newOption":
         poll = timestamped_poll(payload['state'])
+        if poll.close_if_due():
+            return HttpResponse()
         poll.options.append(payload['submission']['new_option'])
         poll.options = unique_list(poll.options)
         poll.save()
         # update_poll(payload['channel']['id'], poll)
     elif payload['callback_id'] == "options":
         if payload["actions"][0]["name"] == "addMore":
-            create_dialog(payload)
+            if not timestamped_poll(payload['original_message']['ts']).close_if_due():
+                create_dialog(payload)
         elif payload['actions'][0]["name"] == "option":
             poll = timestamped_poll(payload['original_message']['ts'])
+            if poll.close_if_due():
+                return HttpResponse()
             voted_index = poll.options.index(payload["actions"][0]["value"])
             user = find_or_create_user(payload['user'])
-            vote = Vote.objects.filter(poll=poll, option=voted_index, user=user).first()
-            if vote is not None:
-                vote.delete()
-            else:
-                Vote.objects.create(poll=poll, option=voted_index, user=user)
+            with transaction.atomic():
+                vote = Vote.objects.filter(poll=poll, option=voted_index, user=user).first()
+                # Deleting reports whether this click removed the row, when a concurrent click got there first this
+                # one adds it back like any other toggle.
+                if vote is None or not vote.delete()[0]:
+                    Vote.objects.create(poll=poll, option=voted_index, user=user)
             # update_poll(payload['channel']['id'], poll)
     elif payload['callback_id'].startswith('qo_'):
         if payload['actions'][0]['name'].startswith('qo_'):
             question_id = payload['actions'][0]['name'][3:]
             question = get_object_or_404(Question, id=question_id)
             user = find_or_create_user(payload['user'])
-            responses = Response.objects.filter(question=question, user=user)
-            if len(responses) != 0:
-                for response in responses:
-                    response.delete()
-            else:
-                response_index = question.options.index(payload['actions'][0]['value'])
-                Response.objects.create(option=response_index, question=question, user=user)
+            with transaction.atomic():
+                responses = Response.objects.filter(question=question, user=user)
+                if sum(response.delete()[0] for response in responses) == 0:
+                    response_index = question.options.index(payload['actions'][0]['value'])
+                    Response.objects.create(option=response_index, question=question, user=user)
             attachments = format_attachments(question.options, "qo_" + question.id, False)
             text = format_text(question.question, question.options, question.responses, '')
             timestamp = payload['original_message']['ts']
@@ -407,73 +591,48 @@ def event_handling(request: HttpRequest) -> HttpResponse:
 
     if request.POST["type"] == "event_callback":
         if request.POST["event"]["type"] == "file_shared":
-            file_id = request.POST["event"]["file"]["id"]
-            file_response = requests.get("https://slack.com/api/files.info?token=" + client_secret + "&file=" + file_id)
-            logger.info("File Response Body: %s", file_response.content)
-            file_response.raise_for_status()
-            file_response_dict: Dict = file_response.json()
-            response = requests.get(file_response_dict['file']['url_private_download'],
-                                    headers={"Authorization": "Bearer " + client_secret})
-            response.raise_for_status()
-            file_like_obj = io.StringIO(response.text)
-            lines = file_like_obj.readlines()
-            try:
-                poll, _, _ = load_distributed_poll_file(file_response_dict['file']["title"], lines)
-                post_message(request.POST["event"]["channel_id"], "Distributed Poll Created: " + poll.name, None, True)
-            except IntegrityError:
-                logger.info("Poll already existed.", exc_info=True)
-                post_message(request.POST["event"]["channel_id"],
-                             "Could not create distributed poll a poll with name \""
-                             + file_response_dict['file']['title'] + "\" already exists.", None, False)
+            # Slack wants an answer within seconds, the download and parsing happen on a background thread.
+            background.submit(ingest_survey_file, request.POST["event"]["file"]["id"],
+                              request.POST["event"]["channel_id"])
         elif request.POST["event"]["type"] == 'message' \
                 and "subtype" not in request.POST["event"]:
             if request.POST["event"]["text"].lower().startswith("dpoll"):
                 name = ' '.join(request.POST["event"]["text"].split(' ')[1:]).strip()
-                polls = DistributedPoll.objects.filter(name=name)
+                polls = DistributedPoll.objects.filter(name=name, deleting=False)
                 if len(polls) == 0:
                     logger.info("Poll not found")
                     post_message(request.POST["event"]["channel"], "Poll not found: " + name, None, False)
                 else:
                     poll = polls[0]
-                    blocks = list(poll.block_set.all())
-                    random.shuffle(blocks)
-                    blocks = blocks[:2]
-                    for block in blocks:
-                        post_message(request.POST["event"]["channel"], '*' + block.name + '*', None, False)
-                        for question in block.question_set.all():
-                            post_question(request.POST["event"]["channel"], question)
-                            time.sleep(0.5)
+                    post_blocks(request.POST["event"]["channel"], poll.sample_blocks(settings.POLLS_DPOLL_BLOCKS))
             elif request.POST["event"]["text"].lower().startswith("blocksearch"):
                 text = request.POST["event"]["text"].replace('\u201c', '"').replace('\u201d', '"')
                 name = text.split('"')[1].strip()
                 query = text.split('"')[2].strip()
-                polls = DistributedPoll.objects.filter(name=name)
+                polls = DistributedPoll.objects.filter(name=name, deleting=False)
                 if len(polls) == 0:
                     logger.info("Poll not found")
                     post_message(request.POST["event"]["channel"], "Poll not found: " + name, None, False)
                 else:
                     poll = polls[0]
-                    blocks = poll.block_set.filter(name__icontains=query)
+                    blocks = poll.search_blocks(query, settings.POLLS_BLOCKSEARCH_LIMIT)
                     if len(blocks) == 0:
                         logger.info("No matching blocks found")
                         post_message(request.POST["event"]["channel"],
                                      f'No matching blocks found for query "{query}" in poll "{name}"',
                                      None, False)
-                    for block in blocks:
-                        post_message(request.POST["event"]["channel"], '*' + block.name + '*', None, False)
-                        for question in block.question_set.all():
-                            post_question(request.POST["event"]["channel"], question)
-                            time.sleep(0.5)
+                    post_blocks(request.POST["event"]["channel"], blocks)
 
     return HttpResponse()
 
 
 @csrf_exempt
+@read_only
 def poll_responses(request: HttpRequest, poll_name: str) -> HttpResponse:
     if request.method != "GET":
         return HttpResponseBadRequest()
 
-    poll = get_object_or_404(DistributedPoll, name=poll_name)
+    poll = get_object_or_404(DistributedPoll, name=poll_name, deleting=False)
     blocks = poll.block_set.all()
     questions: List[Question] = []
     for block in blocks:
@@ -487,22 +646,33 @@ def poll_responses(request: HttpRequest, poll_name: str) -> HttpResponse:
             response_list[i] = str(response.option)
             responses[response.user.name].append(response_list)
     responses = {key: collapse_lists(value) for key, value in responses.items()}
-    logger.debug(f"Collapsed responses: {responses}")
+    logger.debug("Collapsed responses: %s", responses)
     results = ['\t'.join(headers)] + [name + '\t' + '\t'.join(l) for name, values in responses.items()
                                       for l in values]
     return HttpResponse('\n'.join(results))
 
 
+def purge_progress(poll: DistributedPoll, status: int = 200) -> JsonResponse:
+    return JsonResponse({'name': poll.name, 'deleting': poll.deleting, 'total': poll.purge_total,
+                         'done': poll.purge_done}, status=status)
+
+
 @csrf_exempt
 def delete_distributedpoll(request: HttpRequest, poll_name: str) -> HttpResponse:
+    """DELETE hides the poll at once and purges it in the background, GET reports how far the purge got."""
+    if request.method == "GET":
+        return purge_progress(get_object_or_404(DistributedPoll, name=poll_name))
     if request.method != "DELETE":
         return HttpResponseBadRequest()
 
     poll = get_object_or_404(DistributedPoll, name=poll_name)
+    if not poll.deleting:
+        DistributedPoll.objects.filter(pk=poll.pk).update(deleting=True)
+        poll.deleting = True
+    # Submitting again for a poll already being deleted restarts a purge lost with a previous process.
+    background.after_commit(('purge', poll.pk), purge_distributed_poll, poll.pk)
 
-    poll.delete()
-
-    return HttpResponse()
+    return purge_progress(poll, status=202)
 
 def JsonModelResponse(model: models.Model, status_code: int = 200, location: str = None, request: HttpRequest = None) -> HttpResponse:
     serialized = serializers.serialize('json', [model])
@@ -525,13 +695,104 @@ def create_poll(request: HttpRequest) -> HttpResponse:
         question = poll_data['question']
         options = poll_data['options']
         channel = poll_data.get('channel', os.environ.get('POLLS_DEFAULT_CHANNEL', ''))
-        poll = add_poll(question=question, options=options, channel=channel)
-        poll.save()
+        closes_at = None
+        if poll_data.get('closes_at'):
+            try:
+                closes_at = parse_datetime(poll_data['closes_at'])
+            except (TypeError, ValueError):
+                return HttpResponseBadRequest()
+            # A naive time could not be compared with the aware clock polls are closed by.
+            if closes_at is None or closes_at.tzinfo is None:
+                return HttpResponseBadRequest("closes_at must be an ISO 8601 datetime with a timezone.")
+        poll = add_poll(question=question, options=options, channel=channel, closes_at=closes_at,
+                        ranked=bool(poll_data.get('ranked', False)))
         return JsonModelResponse(poll, 201, f'/polls/{poll.timestamp_str}/', request)
     else:
         return HttpResponseBadRequest()
 
 
+def batch_progress(batch: PollBatch, status: int = 200) -> JsonResponse:
+    return JsonResponse({'id': batch.pk, 'total': batch.total, 'done': batch.done, 'results': batch.results},
+                        status=status)
+
+
+@csrf_exempt
+def create_poll_batch(request: HttpRequest) -> HttpResponse:
+    """POST queues the polls to be posted in the background, GET on the returned location reports the progress."""
+    if request.method == "POST":
+        try:
+            specs = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest()
+        if not isinstance(specs, list) or len(specs) > settings.POLLS_BATCH_MAX_POLLS:
+            return HttpResponseBadRequest()
+        batch = PollBatch.objects.create(specs=specs, default_channel=os.environ.get('POLLS_DEFAULT_CHANNEL', ''),
+                                         total=len(specs))
+        background.after_commit(('poll_batch', batch.pk), post_poll_batch, batch.pk)
+        response = batch_progress(batch, status=202)
+        response['Location'] = request.build_absolute_uri(f'/polls/batch/{batch.pk}/')
+        return response
+    else:
+        return HttpResponseBadRequest()
+
+
+def poll_batch(request: HttpRequest, batch_id: str) -> HttpResponse:
+    return batch_progress(get_object_or_404(PollBatch, pk=batch_id))
+
+
+@csrf_exempt
+def close_poll(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
+    if request.method == "POST":
+        error_code = check_token(request)
+        if error_code is not None:
+            return error_code
+        poll = timestamped_poll(poll_timestamp)
+        try:
+            options = json.loads(request.body) if request.body else {}
+        except ValueError:
+            return HttpResponseBadRequest()
+        if not isinstance(options, dict):
+            return HttpResponseBadRequest()
+        poll.close(archive=bool(options.get('archive', False)))
+        return JsonModelResponse(poll)
+    else:
+        return HttpResponseBadRequest()
+
+
+@csrf_exempt
+def import_poll_votes(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
+    if request.method == "POST":
+        error_code = check_token(request)
+        if error_code is not None:
+            return error_code
+        poll = timestamped_poll(poll_timestamp)
+        if poll.close_if_due():
+            return HttpResponseBadRequest("400 Poll is closed.")
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest()
+        if not isinstance(data, dict):
+            return HttpResponseBadRequest()
+        votes = data.get('votes', [])
+        ballots = data.get('ballots', [])
+        if not isinstance(votes, list) or not isinstance(ballots, list) \
+                or len(votes) + len(ballots) > settings.POLLS_IMPORT_MAX_ROWS:
+            return HttpResponseBadRequest()
+        imported_votes, imported_ballots, errors = import_votes(poll, votes, ballots)
+        return JsonResponse({'votes': imported_votes, 'ballots': imported_ballots, 'errors': errors})
+    else:
+        return HttpResponseBadRequest()
+
+
+def poll_link(request: HttpRequest, link: str, rest: Optional[str] = None) -> HttpResponse:
+    """The address in a poll's Slack message, which is posted before the poll's own address is known."""
+    # Not read_only: the link is followed right after the poll was posted, before a replica may have it.
+    poll = get_object_or_404(Poll, link=link)
+    return redirect(f'/polls/{poll.timestamp_str}/{rest or ""}')
+
+
+@read_only
 def view_poll(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
     if request.method == "GET":
         poll = timestamped_poll(poll_timestamp)
@@ -546,17 +807,23 @@ def vote_on_poll(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
     if request.method == "GET":
         submitted_form = NameAndSecretForm(request.GET)
         if submitted_form.is_valid():
-            poll = timestamped_poll(poll_timestamp)
+            with replica_reads(not is_pinned(request)):
+                poll = timestamped_poll(poll_timestamp)
+            if poll.close_if_due():
+                return HttpResponseBadRequest("400 Poll is closed.")
+            # The ballot lookup checks the secret and may create the ballot, so it always runs on the primary.
             vote = find_or_create_vote(poll,
                                        submitted_form.cleaned_data['user_name'],
                                        submitted_form.cleaned_data['user_secret'])
-            form = MultipleChoiceCompleteVoteForm(instance=vote)
+            form = complete_vote_form(poll)(instance=vote)
             return render(request, "voteonpoll.html",
                           {'form': form, 'path': request.get_full_path(force_append_slash=True)})
         else:
             return HttpResponseBadRequest()
     elif request.method == 'POST':
         poll = timestamped_poll(poll_timestamp)
+        if poll.close_if_due():
+            return HttpResponseBadRequest("400 Poll is closed.")
         if request.POST['_method'] == "addvote":
             option = request.POST['option']
             if option in poll.options:
@@ -564,15 +831,12 @@ def vote_on_poll(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
             else:
                 poll.options.append(option)
                 poll.save()
-                return redirect(request.POST['next'])
+                return pin_to_primary(redirect(request.POST['next']))
         elif request.POST['_method'] == 'vote':
-            submitted_form = MultipleChoiceCompleteVoteForm(request.POST)
-            if submitted_form.is_valid() \
-                    and submitted_form.cleaned_data['poll'].timestamp.timestamp() == float(poll_timestamp):
-                validate_vote(submitted_form.cleaned_data['poll'], submitted_form.cleaned_data['user'],
-                              submitted_form.cleaned_data['user_secret'])
+            submitted_form = complete_vote_form(poll)(request.POST, poll=poll)
+            if submitted_form.is_valid():
                 submitted_form.save()
-                return redirect(f"/polls/{poll_timestamp}/results")
+                return pin_to_primary(redirect(f"/polls/{poll_timestamp}/results"))
                 # return JsonModelResponse(submitted_form.instance, 201)
             else:
                 return HttpResponseBadRequest()
@@ -582,8 +846,133 @@ def vote_on_poll(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
         return HttpResponseBadRequest()
 
 
+@read_only
 def poll_results(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
     if request.method == "GET":
         poll = timestamped_poll(poll_timestamp)
         return render(request, "pollresults.html",
-                      {'poll': poll})
\ No newline at end of file
+                      {'poll': poll})
+
+
+def results_payload(poll: Poll) -> Dict[str, Any]:
+    payload = {
+        'timestamp': poll.timestamp_str,
+        'question': poll.question,
+        'closed': poll.is_closed,
+        'version': poll.version,
+        'options': [{'option': option, 'count': len(voters), 'voters': voters}
+                    for option, voters in zip(poll.options, poll.votes)]
+    }
+    scores = poll.condorcet
+    if scores is not None:
+        tiers, winner = scores
+        payload['schulze'] = [[poll.options[i] for i in tier] for tier in tiers]
+        payload['condorcet_winner'] = poll.options[winner] if winner is not None else None
+    return payload
+
+
+def poll_version(request: HttpRequest, poll_timestamp: str) -> Optional[Tuple[int, datetime.datetime]]:
+    # Memoized on the request so the ETag and Last-Modified checks share one indexed lookup.
+    if not hasattr(request, '_poll_version'):
+        request._poll_version = Poll.objects.filter(timestamp=poll_timestamp) \
+            .values_list('version', 'modified').first()
+    return request._poll_version
+
+
+def results_etag(request: HttpRequest, poll_timestamp: str) -> Optional[str]:
+    version = poll_version(request, poll_timestamp)
+    return f"{poll_timestamp}-{version[0]}" if version else None
+
+
+def results_last_modified(request: HttpRequest, poll_timestamp: str) -> Optional[datetime.datetime]:
+    version = poll_version(request, poll_timestamp)
+    return version[1] if version else None
+
+
+@read_only
+@condition(etag_func=results_etag, last_modified_func=results_last_modified)
+def poll_results_json(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
+    if request.method == "GET":
+        poll = timestamped_poll(poll_timestamp)
+        return JsonResponse(results_payload(poll))
+    else:
+        return HttpResponseBadRequest()
+
+
+def page_size(request: HttpRequest) -> int:
+    limit = int(request.GET.get('limit', settings.POLLS_LIST_PAGE_SIZE))
+    if not 0 < limit <= settings.POLLS_LIST_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {settings.POLLS_LIST_MAX_PAGE_SIZE}")
+    return limit
+
+
+@read_only
+def list_channel_polls(request: HttpRequest, channel: str) -> HttpResponse:
+    """A page of a channel's polls in timestamp order, pass ``next`` back as ``after`` for the following page."""
+    if request.method != "GET":
+        return HttpResponseBadRequest()
+    after = request.GET.get('after')
+    try:
+        limit = page_size(request)
+        if after is not None:
+            export.check_epoch(after)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse(listing.channel_polls(channel, after, limit))
+
+
+@read_only
+def list_user_history(request: HttpRequest, user_name: str, kind: str) -> HttpResponse:
+    """A page of a user's votes, ballots or distributed poll responses, oldest first."""
+    if request.method != "GET":
+        return HttpResponseBadRequest()
+    user = get_object_or_404(User, name=user_name)
+    try:
+        limit = page_size(request)
+        after = int(request.GET['after']) if 'after' in request.GET else None
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse(listing.user_history(user, kind, after, limit))
+
+
+def export_polls(request: HttpRequest) -> HttpResponse:
+    """Stream polls with their votes as JSON Lines or CSV, filtered by ``channel``, ``since`` and ``until``.
+
+    Resume an interrupted export by passing the last timestamp received as ``after``. Needs the same ``token`` as the
+    Slack endpoints.
+    """
+    error_code = check_token(request, "GET")
+    if error_code is not None:
+        return error_code
+    fmt = request.GET.get('format', 'jsonl')
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest(f"format must be one of {', '.join(export.FORMATS)}")
+    try:
+        since, until, after = (export.parse_bound(request.GET.get(key)) for key in ('since', 'until', 'after'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    # The rows are produced after the view returns, outside read_only, so the replica choice is passed along.
+    lines = export.export_lines(fmt, request.GET.get('channel'), since, until, after,
+                                settings.POLLS_EXPORT_CHUNK_SIZE, replica=not is_pinned(request))
+    response = StreamingHttpResponse(lines, content_type=export.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="polls.{fmt}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def poll_results_stream(request: HttpRequest, poll_timestamp: str) -> HttpResponse:
+    if request.method == "GET":
+        timestamped_poll(poll_timestamp)
+        stream = open_stream(poll_timestamp)
+        if stream is None:
+            # Every stream pins a worker thread, past the cap clients poll results.json until a slot frees up.
+            response = HttpResponse("Too many live result streams, poll results.json instead.", status=503,
+                                    content_type='text/plain')
+            response['Retry-After'] = str(int(settings.POLLS_SSE_KEEPALIVE_SECONDS))
+            return response
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    else:
+        return HttpResponseBadRequest()
@@ -0,0 +1,68 @@
+import logging
+from typing import List, Optional
+
+from django.core.exceptions import PermissionDenied
+from django.db import connection, transaction
+
+from main import background, events
+from main.models import apply_ballot_change, CompleteVote, Poll, touch_poll, User
+
+logger = logging.getLogger(__name__)
+
+
+class _Conflict(Exception):
+    pass
+
+
+UPSERT = """
+INSERT INTO {table} (poll_id, user_id, user_secret, options_inner, ranking)
+VALUES (%s, %s, %s, %s, %s)
+ON CONFLICT (poll_id, user_id) DO UPDATE
+    SET options_inner = EXCLUDED.options_inner, ranking = EXCLUDED.ranking
+    WHERE {table}.user_secret IS NOT DISTINCT FROM EXCLUDED.user_secret
+RETURNING id, xmax = 0
+"""
+
+
+def refresh_poll(poll_id: str) -> None:
+    Poll.objects.get(pk=poll_id).update_poll()
+
+
+def upsert_ballot(poll: Poll, user: User, secret: Optional[str], options_inner: List[bool],
+                  ranking: List[int]) -> int:
+    """Create or replace ``user``'s ballot on ``poll`` and return its id, raising PermissionDenied on a wrong secret.
+
+    The existing ballot is locked and written with a single INSERT ... ON CONFLICT in one transaction, the Slack
+    message is refreshed on the background executor once that transaction commits.
+    """
+    try:
+        return _upsert_ballot(poll, user, secret, options_inner, ranking)
+    except _Conflict:
+        # Another request created this ballot between our lookup and our insert, the retry sees it.
+        logger.info("Ballot of %s on %s was created concurrently, retrying", user.pk, poll.pk)
+        return _upsert_ballot(poll, user, secret, options_inner, ranking)
+
+
+def _upsert_ballot(poll: Poll, user: User, secret: Optional[str], options_inner: List[bool],
+                   ranking: List[int]) -> int:
+    with transaction.atomic():
+        existing = CompleteVote.objects.select_for_update().filter(poll=poll, user=user) \
+            .values_list('user_secret', 'ranking', 'options_inner').first()
+        if existing is not None and existing[0] != secret:
+            raise PermissionDenied()
+        with connection.cursor() as cursor:
+            cursor.execute(UPSERT.format(table=CompleteVote._meta.db_table),
+                           [poll.pk, user.pk, secret, options_inner, ranking])
+            row = cursor.fetchone()
+        if row is None:
+            raise PermissionDenied()
+        ballot_id, inserted = row
+        if existing is None and not inserted:
+            raise _Conflict()
+        touch_poll(poll.pk)
+        events.record(events.ballot_changes(poll.pk, user.pk, existing[2] if existing is not None else None,
+                                            options_inner))
+        if poll.ranked:
+            apply_ballot_change(poll.pk, existing[1] if existing is not None else None, ranking)
+        background.after_commit(('refresh_poll', poll.pk), refresh_poll, poll.pk)
+    return ballot_id
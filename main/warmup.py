@@ -0,0 +1,57 @@
+import logging
+import random
+import time
+from typing import Any, List
+
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES = ('nameandsecret.html', 'voteonpoll.html', 'pollresults.html')
+
+# Database connections inherited from the parent. They stay referenced so they are never closed from this process,
+# which would end the session for the parent as well.
+_inherited: List[Any] = []
+
+
+def warm_up() -> float:
+    """Build the read-only state requests need before the first one arrives.
+
+    With the app preloaded this runs once in the gunicorn master and the workers share the result copy on write,
+    otherwise every worker pays for it before it starts serving rather than on its first request.
+    """
+    start = time.perf_counter()
+    # Importing the views configures logging and importing the forms opens WordNet.
+    from main import forms, views  # noqa: F401
+    resolver = get_resolver()
+    # Loads the URLconf and compiles every pattern's regex.
+    resolver.reverse_dict
+    resolver.resolve('/status/')
+    for name in TEMPLATES:
+        get_template(name)
+    # Reads the WordNet lemma lists once and keeps the short words default secrets are drawn from.
+    forms.get_default_secret()
+    # Nothing opened while warming up may be shared with forked workers.
+    connections.close_all()
+    seconds = time.perf_counter() - start
+    logger.info("Warmed up in %.2f s", seconds)
+    return seconds
+
+
+def after_fork() -> None:
+    """Give a freshly forked worker its own copies of the state that holds threads, locks, sockets or a seed."""
+    from main import background, live, logs, metrics
+    # Forked workers would otherwise all draw the same default secrets.
+    random.seed()
+    # The gunicorn master closes its connections before forking, anything still open is left to the parent.
+    for connection in connections.all():
+        if connection.connection is not None:
+            _inherited.append(connection.connection)
+            connection.connection = None
+    metrics.reset()
+    for handler in logs.queued_handlers():
+        handler.restart()
+    background.reset()
+    live.hub.reset()
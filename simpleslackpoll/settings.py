@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import tempfile
 
 import dj_database_url
 
@@ -32,18 +33,25 @@ ALLOWED_HOSTS = os.environ.get("POLLS_HOST", "localhost;127.0.0.1").split(';')
 
 # Application definition
 
+# Elastic APM is only installed when a server is configured, without one no agent, instrumentation or spans run.
+POLLS_APM_SERVER_URL = os.environ.get("POLLS_APM_SERVER_URL", "")
+
 INSTALLED_APPS = (
     'main',
     'django_extensions',
-    'elasticapm.contrib.django'
 )
 
 MIDDLEWARE = (
+    'main.profiling.ProfilingMiddleware',
     'django.middleware.common.CommonMiddleware',
-    # To send performance metrics, add our tracing middleware:
-    'elasticapm.contrib.django.middleware.TracingMiddleware',
+    'main.ratelimit.RateLimitedMiddleware',
 )
 
+if POLLS_APM_SERVER_URL:
+    INSTALLED_APPS += ('elasticapm.contrib.django',)
+    # To send performance metrics, add our tracing middleware:
+    MIDDLEWARE += ('elasticapm.contrib.django.middleware.TracingMiddleware',)
+
 ROOT_URLCONF = 'simpleslackpoll.urls'
 
 TEMPLATES = [
@@ -74,6 +82,29 @@ DATABASES = {
 }
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Digest of the last text and attachments sent for each Slack message, used to skip no-op chat.update calls.
+    # It has to be shared by every worker, a per process cache would skip updates another worker overwrote, so the
+    # default is a database table (created by createcachetable) and local memory backends never skip anything.
+    'slack_render': {
+        'BACKEND': os.environ.get("POLLS_RENDER_CACHE_BACKEND", 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get("POLLS_RENDER_CACHE_LOCATION", 'polls_slack_render'),
+        'TIMEOUT': int(os.environ.get("POLLS_RENDER_CACHE_TIMEOUT", "3600")),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
+# Slack messages switch to counts plus the first few voters per option once a poll has more votes than this.
+POLLS_COMPACT_RENDER_THRESHOLD = int(os.environ.get("POLLS_COMPACT_RENDER_THRESHOLD", "100"))
+POLLS_COMPACT_RENDER_VOTERS_SHOWN = int(os.environ.get("POLLS_COMPACT_RENDER_VOTERS_SHOWN", "5"))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 
@@ -89,22 +120,44 @@ USE_TZ = True
 
 ELASTIC_APM = {
     # Set required service name. Allowed characters:
-  # a-z, A-Z, 0-9, -, _, and space
-  'SERVICE_NAME': 'simplepoll',
-
-  # Set custom APM Server URL (default: http://localhost:8200)
-  'SERVER_URL': 'http://localhost:8200',
+    # a-z, A-Z, 0-9, -, _, and space
+    'SERVICE_NAME': os.environ.get("POLLS_APM_SERVICE_NAME", "simplepoll"),
+    'SERVER_URL': POLLS_APM_SERVER_URL,
+    # Send data even though DEBUG is on.
+    'DEBUG': True,
+    # Fraction of requests traced with spans, the rest are only counted.
+    'TRANSACTION_SAMPLE_RATE': float(os.environ.get("POLLS_APM_SAMPLE_RATE", "0.1")),
+    # Spans recorded per traced request before the rest are dropped.
+    'TRANSACTION_MAX_SPANS': int(os.environ.get("POLLS_APM_MAX_SPANS", "200")),
+    # Stack traces are only collected for spans slower than this.
+    'SPAN_FRAMES_MIN_DURATION': os.environ.get("POLLS_APM_SPAN_FRAMES_MIN_DURATION", "20ms"),
+}
 
-  'DEBUG': True
+POLLS_LOG_QUEUE_SIZE = int(os.environ.get("POLLS_LOG_QUEUE_SIZE", "10000"))
+# Fraction of request/response payload log records kept, overridable per logger with "name=rate;name=rate".
+POLLS_PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get("POLLS_PAYLOAD_LOG_SAMPLE_RATE", "1.0"))
+POLLS_PAYLOAD_LOG_SAMPLE_RATES = {
+    name: float(rate) for name, rate in
+    (item.split('=', 1) for item in os.environ.get("POLLS_PAYLOAD_LOG_SAMPLE_RATES", "").split(';') if '=' in item)
 }
 
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'payload_sampler': {
+            '()': 'main.logs.PayloadSampler',
+            'rate': POLLS_PAYLOAD_LOG_SAMPLE_RATE,
+            'rates': POLLS_PAYLOAD_LOG_SAMPLE_RATES,
+        },
+    },
     'handlers': {
         'logstash': {
             'level': 'DEBUG',
-            'class': 'logstash.TCPLogstashHandler',
+            # Records are queued and shipped by a background thread so a slow logstash never blocks requests.
+            'class': 'main.logs.QueuedHandler',
+            'target': 'logstash.TCPLogstashHandler',
+            'queue_size': POLLS_LOG_QUEUE_SIZE,
             'host': 'localhost',
             'port': 5959, # Default value: 5959
             'version': 0, # Version of logstash event schema. Default value: 0 (for backward compatibility of the library)
@@ -116,9 +169,15 @@ LOGGING = {
     'loggers': {
         'django': {
             'handlers': ['logstash'],
-            'level': 'DEBUG',
+            'level': os.environ.get("POLLS_DJANGO_LOG_LEVEL", "INFO"),
             'propagate': True,
         },
+        'main.views': {
+            'filters': ['payload_sampler'],
+        },
+        'main.models': {
+            'filters': ['payload_sampler'],
+        },
     }
 }
 
@@ -141,3 +200,92 @@ else:
     config = dj_database_url.config()
     if config and POLLS_DATABASE != "local":
         DATABASES['default'] = config
+
+# Optional read replica of the primary for the read-only views, as a postgres:// URL.
+REPLICA_DATABASE = os.environ.get("POLLS_REPLICA_DATABASE_URL", None)
+if REPLICA_DATABASE is not None:
+    DATABASES['replica'] = dj_database_url.parse(REPLICA_DATABASE)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['main.routers.PrimaryReplicaRouter']
+
+# How long a user's reads stay on the primary after they vote, covering replication lag.
+POLLS_REPLICA_STICKY_SECONDS = int(os.environ.get("POLLS_REPLICA_STICKY_SECONDS", "10"))
+
+# Move the raw vote rows of a poll into the archive tables when it closes at its deadline.
+POLLS_ARCHIVE_ON_CLOSE = os.environ.get("POLLS_ARCHIVE_ON_CLOSE", "false").lower() == "true"
+
+# Live results over Server-Sent Events: how often watched polls are checked for changes, the keepalive period and
+# how long a single stream is held open before the client is asked to reconnect.
+POLLS_SSE_POLL_INTERVAL = float(os.environ.get("POLLS_SSE_POLL_INTERVAL", "1.0"))
+POLLS_SSE_KEEPALIVE_SECONDS = float(os.environ.get("POLLS_SSE_KEEPALIVE_SECONDS", "15"))
+POLLS_SSE_MAX_SECONDS = float(os.environ.get("POLLS_SSE_MAX_SECONDS", "300"))
+# Threads per gunicorn worker, the Procfile starts gthread workers with this many. Every open stream holds one of them
+# for as long as it is connected, so a worker serves at most POLLS_GUNICORN_THREADS - POLLS_SSE_RESERVED_THREADS
+# streams and answers 503 beyond that. The reserved threads keep Slack's webhooks, which must be answered within 3
+# seconds, and every other request going. To serve more watchers per worker raise the thread count.
+POLLS_GUNICORN_THREADS = int(os.environ.get("POLLS_GUNICORN_THREADS", "16"))
+POLLS_SSE_RESERVED_THREADS = int(os.environ.get("POLLS_SSE_RESERVED_THREADS", "8"))
+POLLS_SSE_MAX_STREAMS = max(1, POLLS_GUNICORN_THREADS - POLLS_SSE_RESERVED_THREADS)
+
+# Largest number of votes plus ballots accepted by one bulk import request.
+POLLS_IMPORT_MAX_ROWS = int(os.environ.get("POLLS_IMPORT_MAX_ROWS", "50000"))
+
+# Base URL of the Slack Web API, pointed at a fake server such as ``manage.py fake_slack`` for load tests.
+POLLS_SLACK_API_URL = os.environ.get("POLLS_SLACK_API_URL", "https://slack.com/api/")
+
+# Outbound Slack calls: retries after a 429, concurrent requests for batch posting and the spacing between
+# messages posted to the same channel.
+POLLS_SLACK_MAX_RETRIES = int(os.environ.get("POLLS_SLACK_MAX_RETRIES", "3"))
+POLLS_SLACK_CONCURRENCY = int(os.environ.get("POLLS_SLACK_CONCURRENCY", "8"))
+POLLS_SLACK_CHANNEL_INTERVAL = float(os.environ.get("POLLS_SLACK_CHANNEL_INTERVAL", "1.0"))
+# Token buckets per Slack method and channel, shared by every process through the database, as
+# "method=calls_per_second/burst;...". Methods without an entry are not limited, an empty value turns limiting off.
+POLLS_SLACK_RATE_LIMITS = {
+    method: tuple(float(part) for part in policy.split('/', 1)) for method, policy in
+    (item.split('=', 1) for item in os.environ.get(
+        "POLLS_SLACK_RATE_LIMITS", "chat.postMessage=1/3;chat.update=1/5;dialog.open=2/10").split(';') if '=' in item)
+}
+# Longest a background task waits for its bucket, and a web request, which should not hold its thread for long. A call
+# that would have to wait longer is not made: background tasks fail, requests defer message updates to the background
+# and otherwise answer 503.
+POLLS_SLACK_RATE_LIMIT_MAX_WAIT = float(os.environ.get("POLLS_SLACK_RATE_LIMIT_MAX_WAIT", "10"))
+POLLS_SLACK_RATE_LIMIT_REQUEST_WAIT = float(os.environ.get("POLLS_SLACK_RATE_LIMIT_REQUEST_WAIT", "0.5"))
+POLLS_BATCH_MAX_POLLS = int(os.environ.get("POLLS_BATCH_MAX_POLLS", "500"))
+
+# Request profiling: the fraction of requests profiled, plus any request carrying a signed X-Polls-Profile header
+# (see ``manage.py profiles --token``). The newest POLLS_PROFILE_KEEP profiles are kept in POLLS_PROFILE_DIR.
+POLLS_PROFILE_SAMPLE_RATE = float(os.environ.get("POLLS_PROFILE_SAMPLE_RATE", "0"))
+POLLS_PROFILE_DIR = os.environ.get("POLLS_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "polls-profiles"))
+POLLS_PROFILE_KEEP = int(os.environ.get("POLLS_PROFILE_KEEP", "200"))
+POLLS_PROFILE_TOKEN_MAX_AGE = int(os.environ.get("POLLS_PROFILE_TOKEN_MAX_AGE", "86400"))
+
+# Threads running work deferred out of requests, such as refreshing a poll's Slack message after a vote.
+POLLS_BACKGROUND_WORKERS = int(os.environ.get("POLLS_BACKGROUND_WORKERS", "4"))
+
+# Number of blocks a dpoll message asks, the least answered blocks are picked first.
+POLLS_DPOLL_BLOCKS = int(os.environ.get("POLLS_DPOLL_BLOCKS", "2"))
+
+# Most blocks one blocksearch message posts, best matches first.
+POLLS_BLOCKSEARCH_LIMIT = int(os.environ.get("POLLS_BLOCKSEARCH_LIMIT", "5"))
+
+# Rows removed per DELETE statement when a distributed poll is purged in the background.
+POLLS_PURGE_BATCH_SIZE = int(os.environ.get("POLLS_PURGE_BATCH_SIZE", "5000"))
+
+# Polls fetched per query by the streaming export, together with their votes this bounds its memory use.
+POLLS_EXPORT_CHUNK_SIZE = int(os.environ.get("POLLS_EXPORT_CHUNK_SIZE", "500"))
+
+# Load the URLconf, templates and word lists when the WSGI app is created instead of on the first request.
+POLLS_WARM_UP = os.environ.get("POLLS_WARM_UP", "1") == "1"
+
+# Default and largest page sizes of the listing endpoints.
+POLLS_LIST_PAGE_SIZE = int(os.environ.get("POLLS_LIST_PAGE_SIZE", "50"))
+POLLS_LIST_MAX_PAGE_SIZE = int(os.environ.get("POLLS_LIST_MAX_PAGE_SIZE", "500"))
+
+# Shared survey files larger than this are rejected without being read past the limit.
+POLLS_SURVEY_MAX_BYTES = int(os.environ.get("POLLS_SURVEY_MAX_BYTES", str(8 * 1024 * 1024)))
+# Seconds allowed for looking up and downloading a shared survey file.
+POLLS_SURVEY_DOWNLOAD_TIMEOUT = float(os.environ.get("POLLS_SURVEY_DOWNLOAD_TIMEOUT", "30"))
+
+# Tally snapshots only cover vote events at least this many seconds old, so slow transactions are not skipped.
+POLLS_TALLY_SNAPSHOT_LAG = float(os.environ.get("POLLS_TALLY_SNAPSHOT_LAG", "60"))
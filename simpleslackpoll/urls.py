@@ -20,14 +20,26 @@ from django.conf.urls import url
 from main import views
 
 urlpatterns = [
+    url(r'^status/metrics/', views.server_metrics, name="metrics"),
     url(r'^status/', views.server_status, name="status"),
     url(r'^interactive_button/', views.interactive_button, name="interactive_button"),
     url(r'^poll/', views.slash_poll, name="poll"),
     url(r'^event_handling/', views.event_handling, name="event_handling"),
+    url(r'^export/$', views.export_polls, name="export"),
+    url(r'^channels/(?P<channel>\w+)/polls/$', views.list_channel_polls, name="channel_polls"),
+    url(r'^users/(?P<user_name>[^/]+)/(?P<kind>votes|ballots|responses)/$', views.list_user_history,
+        name="user_history"),
     url(r'^dpoll/(?P<poll_name>\w+)/responses/$', views.poll_responses),
     url(r'^dpoll/(?P<poll_name>\w+)/', views.delete_distributedpoll),
+    url(r'^polls/(?P<poll_timestamp>\d+(\.\d+)?)/close', views.close_poll),
+    url(r'^polls/(?P<poll_timestamp>\d+(\.\d+)?)/import', views.import_poll_votes),
+    url(r'^polls/(?P<poll_timestamp>\d+(\.\d+)?)/results\.json$', views.poll_results_json),
+    url(r'^polls/(?P<poll_timestamp>\d+(\.\d+)?)/results/stream', views.poll_results_stream),
     url(r'^polls/(?P<poll_timestamp>\d+(\.\d+)?)/results', views.poll_results),
     url(r'^polls/(?P<poll_timestamp>\d+(\.\d+)?)/vote', views.vote_on_poll),
     url(r'^polls/(?P<poll_timestamp>\d+(\.\d+)?)/', views.view_poll),
+    url(r'^p/(?P<link>\w+)/(?P<rest>results)?$', views.poll_link),
+    url(r'^polls/batch/(?P<batch_id>\d+)/', views.poll_batch),
+    url(r'^polls/batch', views.create_poll_batch),
     url(r'^polls/', views.create_poll)
 ]
@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/1.8/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "simpleslackpoll.settings")
 
 application = get_wsgi_application()
+
+if settings.POLLS_WARM_UP:
+    from main.warmup import warm_up
+    warm_up()